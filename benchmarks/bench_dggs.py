@@ -0,0 +1,338 @@
+# Copyright (C) 2024-2025 CS GROUP, https://cs-soprasteria.com
+#
+# This file is part of DGGS Toolbox:
+#
+#     https://github.com/CS-SI/dggs_tbx
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+#
+# DGGS Toolbox is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# DGGS Toolbox is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with DGGS Toolbox. If not, see
+# https://www.gnu.org/licenses/.
+
+
+"""
+Benchmarks of grid generation, zonal aggregation and grid outputs.
+
+Every case runs on a synthetic Sentinel-2 like band (uint16, 10 m, UTM,
+512x512 tiles and internal overviews) held in GDAL's in-memory file system,
+in a fresh process so that its peak RSS is its own (the synthetic band
+included). Results are written to a JSON file with the commit and the library
+versions, two result files of the same size are compared with the compare
+command:
+
+    python benchmarks/bench_dggs.py run --out base.json
+    python benchmarks/bench_dggs.py run --out new.json
+    python benchmarks/bench_dggs.py compare base.json new.json
+
+compare exits with status 1 when a case got slower, or used more memory,
+beyond the tolerance, which can gate dependency upgrades.
+"""
+
+import json
+import os
+import platform
+import resource
+import subprocess
+import time
+from concurrent.futures import ProcessPoolExecutor
+from importlib.metadata import PackageNotFoundError, version
+from multiprocessing import get_context
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Dict, List
+
+import numpy as np
+import rasterio
+import typer
+from rasterio.enums import Resampling
+from rasterio.transform import from_origin
+
+app = typer.Typer()
+
+# Sentinel-2 10 m band of tile 32TQM
+S2_SIZE = 10980
+S2_CRS = "EPSG:32632"
+S2_ORIGIN = (300000, 5000040)
+RASTER_PATH = Path("/vsimem/bench/B02.tif")
+PACKAGES = ["dggs_tbx", "numpy", "rasterio", "h3", "rhealpixdggs", "dask", "pyarrow"]
+
+
+def synthetic_cog(size: int, raster_path: Path = RASTER_PATH) -> Path:
+    """
+    Write a tiled band with internal overviews to GDAL's in-memory file system
+    """
+    data = np.random.default_rng(0).integers(1, 10000, (size, size), dtype="uint16")
+    with rasterio.open(
+        raster_path,
+        "w",
+        driver="GTiff",
+        height=size,
+        width=size,
+        count=1,
+        dtype="uint16",
+        crs=S2_CRS,
+        transform=from_origin(*S2_ORIGIN, 10, 10),
+        nodata=0,
+        tiled=True,
+        blockxsize=512,
+        blockysize=512,
+    ) as dst:
+        dst.write(data, 1)
+        factors = [2**i for i in range(1, 6) if size // 2**i >= 256]
+        dst.build_overviews(factors, Resampling.average)
+    return raster_path
+
+
+# Imports are done by the cases so that every process only loads what it runs
+
+
+def h3_grid(raster_path: Path, resolution: int, out_dir: Path):
+    from dggs_tbx.h3_tbx import h3_from_raster_extent
+
+    return h3_from_raster_extent(raster_path, out_dir, resolution, df_ret=True)
+
+
+def h3_filled_grid(raster_path: Path, resolution: int, out_dir: Path):
+    from dggs_tbx.h3_tbx import h3_with_geometry, h3_zonal_mean
+
+    means = h3_zonal_mean([raster_path], resolution, ids_only=True)
+    grid = h3_with_geometry(means)
+    grid["h3_id"] = means.index.to_numpy()
+    return grid.reset_index(drop=True)
+
+
+def run_h3_grid(raster_path: Path, resolution: int, out_dir: Path, _):
+    return len(h3_grid(raster_path, resolution, out_dir))
+
+
+def run_dask_h3_grid(raster_path: Path, resolution: int, out_dir: Path, _):
+    from dggs_tbx.h3_tbx import dask_h3_from_raster
+
+    return len(dask_h3_from_raster(raster_path, out_dir, resolution, df_ret=True))
+
+
+def run_rpix_grid(raster_path: Path, resolution: int, out_dir: Path, _):
+    from dggs_tbx.rpix_tbx import rpix_from_raster_extent
+
+    return len(rpix_from_raster_extent(raster_path, out_dir, resolution, df_ret=True))
+
+
+def run_h3_zonal(raster_path: Path, resolution: int, out_dir: Path, _, **kwargs):
+    from dggs_tbx.h3_tbx import h3_zonal_mean
+
+    return len(h3_zonal_mean([raster_path], resolution, ids_only=True, **kwargs))
+
+
+def run_rpix_zonal(raster_path: Path, resolution: int, out_dir: Path, _):
+    from dggs_tbx.rpix_tbx import rpix_zonal_mean
+
+    return len(rpix_zonal_mean([raster_path], resolution, ids_only=True))
+
+
+def run_mask(raster_path: Path, resolution: int, out_dir: Path, grid):
+    from dggs_tbx.utils import rasterval_grid
+
+    return len(rasterval_grid(grid, raster_path, "B02"))
+
+
+def run_save_grid(raster_path: Path, resolution: int, out_dir: Path, grid, suffix):
+    from dggs_tbx.utils import save_grid
+
+    save_grid(grid, out_dir / f"grid_{resolution}{suffix}", id_column="h3_id")
+    return len(grid)
+
+
+def run_copy_encoding(raster_path: Path, resolution: int, out_dir: Path, grid):
+    from dggs_tbx.pgload import column_types, encode_copy, frame_columns
+
+    columns = frame_columns(grid.set_index("h3_id"))
+    encode_copy(columns, column_types(columns, (grid.geometry.name,)))
+    return len(grid)
+
+
+# name: (setup building the argument of run, run returning the number of cells,
+#        whether the case reads every pixel)
+CASES = {
+    "grid_h3": (None, run_h3_grid, False),
+    "grid_h3_dask": (None, run_dask_h3_grid, False),
+    "grid_rpix": (None, run_rpix_grid, False),
+    "zonal_h3": (None, run_h3_zonal, True),
+    "zonal_h3_workers": (
+        None,
+        lambda *args: run_h3_zonal(*args, workers=4, overview_budget=0),
+        True,
+    ),
+    "zonal_h3_full_resolution": (
+        None,
+        lambda *args: run_h3_zonal(*args, overview_budget=0),
+        True,
+    ),
+    "zonal_rpix": (None, run_rpix_zonal, True),
+    "zonal_h3_mask": (h3_grid, run_mask, True),
+    "write_geojson": (
+        h3_filled_grid,
+        lambda *args: run_save_grid(*args, ".geojson"),
+        False,
+    ),
+    "write_parquet": (
+        h3_filled_grid,
+        lambda *args: run_save_grid(*args, ".parquet"),
+        False,
+    ),
+    "encode_copy": (h3_filled_grid, run_copy_encoding, False),
+}
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux, bytes on macOS
+    scale = 1024**2 if platform.system() == "Darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+
+def run_case(name: str, resolution: int, size: int, repeat: int) -> Dict:
+    """
+    Time a case in the current process, the best of repeat runs
+    """
+    setup, run, reads_pixels = CASES[name]
+    raster_path = synthetic_cog(size)
+    with TemporaryDirectory() as tmp_dir:
+        out_dir = Path(tmp_dir)
+        state = setup(raster_path, resolution, out_dir) if setup else None
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            cells = run(raster_path, resolution, out_dir, state)
+            timings.append(time.perf_counter() - start)
+    seconds = min(timings)
+    pixels = size * size
+    return {
+        "case": name,
+        "resolution": resolution,
+        "cells": cells,
+        "pixels": pixels,
+        "seconds": seconds,
+        "cells_per_s": cells / seconds,
+        "pixels_per_s": pixels / seconds if reads_pixels else None,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def metadata(size: int, repeat: int) -> Dict:
+    versions = {}
+    for package in PACKAGES:
+        try:
+            versions[package] = version(package)
+        except PackageNotFoundError:
+            versions[package] = None
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=Path(__file__).parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "size": size,
+        "repeat": repeat,
+        "versions": versions,
+    }
+
+
+@app.command()
+def run(
+    out: Path = Path("benchmarks.json"),
+    resolutions: str = "6,7,8",
+    cases: str = None,
+    size: int = S2_SIZE,
+    repeat: int = 3,
+):
+    """
+    Run the benchmark cases (comma separated, all by default) at every
+    resolution on a SIZE x SIZE synthetic band, and write the results to OUT
+    """
+    names = cases.split(",") if cases else list(CASES)
+    unknown = set(names) - set(CASES)
+    if unknown:
+        raise typer.BadParameter(f"Unknown cases {unknown}, expected {list(CASES)}")
+    results = []
+    for name in names:
+        for resolution in [int(r) for r in resolutions.split(",")]:
+            # A fresh process per case: its own peak RSS, no warm caches
+            with ProcessPoolExecutor(1, mp_context=get_context("spawn")) as pool:
+                result = pool.submit(run_case, name, resolution, size, repeat).result()
+            typer.echo(
+                f"{name:<26} res {resolution:>2}  {result['seconds']:8.3f} s  "
+                f"{result['cells_per_s']:12.0f} cells/s  "
+                f"{result['peak_rss_mb']:8.0f} MB"
+            )
+            results.append(result)
+    out.write_text(
+        json.dumps({"meta": metadata(size, repeat), "results": results}, indent=2)
+    )
+    typer.echo(f"Results written to {out}")
+
+
+def compare_results(base: List[Dict], new: List[Dict], tolerance: float) -> List:
+    """
+    (case, resolution, time ratio, memory ratio, regression) of the cases of
+    both result lists, ratios being new / base
+    """
+    base = {(r["case"], r["resolution"]): r for r in base}
+    rows = []
+    for result in new:
+        key = (result["case"], result["resolution"])
+        if key not in base:
+            continue
+        time_ratio = result["seconds"] / base[key]["seconds"]
+        memory_ratio = result["peak_rss_mb"] / base[key]["peak_rss_mb"]
+        regression = max(time_ratio, memory_ratio) > 1 + tolerance
+        rows.append((*key, time_ratio, memory_ratio, regression))
+    return rows
+
+
+@app.command()
+def compare(base: Path, new: Path, tolerance: float = 0.2):
+    """
+    Compare two result files, exit with status 1 if a case regressed by more
+    than the tolerance (0.2 = 20%) in time or peak RSS
+    """
+    base_results, new_results = (json.loads(p.read_text()) for p in (base, new))
+    for key in ("size", "cpu_count", "machine"):
+        if base_results["meta"][key] != new_results["meta"][key]:
+            typer.echo(
+                f"Warning: {key} differs, {base_results['meta'][key]} != "
+                f"{new_results['meta'][key]}"
+            )
+    rows = compare_results(base_results["results"], new_results["results"], tolerance)
+    for name, resolution, time_ratio, memory_ratio, regression in rows:
+        flag = "REGRESSION" if regression else ""
+        typer.echo(
+            f"{name:<26} res {resolution:>2}  time x{time_ratio:5.2f}  "
+            f"memory x{memory_ratio:5.2f}  {flag}"
+        )
+    if any(row[-1] for row in rows):
+        raise typer.Exit(1)
+
+
+if __name__ == "__main__":
+    app()
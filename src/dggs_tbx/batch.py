@@ -0,0 +1,280 @@
+# Copyright (C) 2024-2025 CS GROUP, https://cs-soprasteria.com
+#
+# This file is part of DGGS Toolbox:
+#
+#     https://github.com/CS-SI/dggs_tbx
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+#
+# DGGS Toolbox is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# DGGS Toolbox is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with DGGS Toolbox. If not, see
+# https://www.gnu.org/licenses/.
+
+
+"""
+Batch conversion of (tile, date, grid, resolution) jobs.
+
+Jobs run on a process pool: every worker keeps its imports and its pooled DB
+engine from one job to the next, and jobs at different stages (download,
+aggregation, DB load) overlap. Finished jobs are recorded in a SQLite manifest
+so that an interrupted batch resumes without redoing them. The tables are
+indexed and analyzed once, after the last job.
+"""
+
+import logging
+import re
+import sqlite3
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import astuple, dataclass
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional
+
+from rich.progress import track
+
+from dggs_tbx import profiling
+from dggs_tbx.h3_tbx import s2_to_h3
+from dggs_tbx.pgload import index_table
+from dggs_tbx.rpix_tbx import s2_to_rpix
+from dggs_tbx.utils import db_connect, parse_res_range
+
+logger = logging.getLogger(__name__)
+
+GRIDS = {"h3": s2_to_h3, "rpix": s2_to_rpix}
+JOB_FIELDS = ("tile", "date", "grid", "resolution")
+
+
+@dataclass(frozen=True)
+class Job:
+    """
+    Conversion of one Sentinel-2 acquisition
+    :param tile: Sentinel-2 tile id, e.g. 32TQM
+    :param date: Acquisition date, YYYYMMDD
+    :param grid: DGGS, h3 or rpix
+    :param resolution: Resolution, or MIN:MAX range of resolutions
+    """
+
+    tile: str
+    date: str
+    grid: str
+    resolution: str
+
+
+def parse_job(fields: List[str]) -> Job:
+    job = Job(*fields)
+    if job.grid not in GRIDS:
+        raise ValueError(f"Unknown grid {job.grid}, expected one of {list(GRIDS)}")
+    if ":" in job.resolution:
+        parse_res_range(job.resolution)
+    else:
+        int(job.resolution)
+    return job
+
+
+def read_jobs(jobs_path: Path) -> List[Job]:
+    """
+    Read a list of jobs, one tile, date, grid and resolution per line separated
+    by commas or spaces. A CSV header naming the columns, in any order, is
+    optional; blank lines and lines starting with # are skipped.
+    """
+    jobs = []
+    order = list(range(len(JOB_FIELDS)))
+    with open(jobs_path) as f:
+        for line_number, line in enumerate(f, 1):
+            fields = [field for field in re.split(r"[,\s]+", line) if field]
+            if not fields or fields[0].startswith("#"):
+                continue
+            if not jobs and {field.lower() for field in fields} == set(JOB_FIELDS):
+                order = [
+                    [field.lower() for field in fields].index(name)
+                    for name in JOB_FIELDS
+                ]
+                continue
+            if len(fields) != len(JOB_FIELDS):
+                raise ValueError(
+                    f"{jobs_path}:{line_number}: expected {len(JOB_FIELDS)} fields "
+                    f"{JOB_FIELDS}, got {fields}"
+                )
+            try:
+                jobs.append(parse_job([fields[i] for i in order]))
+            except ValueError as e:
+                raise ValueError(f"{jobs_path}:{line_number}: {e}") from e
+    return jobs
+
+
+class JobManifest:
+    """
+    SQLite record of the jobs of a batch, kept across runs
+    :param path: SQLite file, created if missing
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "tile TEXT NOT NULL, date TEXT NOT NULL, grid TEXT NOT NULL, "
+            "resolution TEXT NOT NULL, status TEXT NOT NULL, seconds REAL, "
+            "error TEXT, updated TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP, "
+            "PRIMARY KEY (tile, date, grid, resolution))"
+        )
+        self.conn.commit()
+
+    def __enter__(self) -> "JobManifest":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+    def done(self) -> set:
+        rows = self.conn.execute(
+            "SELECT tile, date, grid, resolution FROM jobs WHERE status = 'done'"
+        )
+        return {Job(*row) for row in rows}
+
+    def pending(self, jobs: Iterable[Job]) -> List[Job]:
+        """
+        Jobs not done yet, without duplicates, in their original order
+        """
+        done = self.done()
+        return [job for job in dict.fromkeys(jobs) if job not in done]
+
+    def record(
+        self, job: Job, status: str, seconds: float = None, error: str = None
+    ) -> None:
+        # Committed job by job, an interruption loses no finished job
+        self.conn.execute(
+            "INSERT OR REPLACE INTO jobs "
+            "(tile, date, grid, resolution, status, seconds, error) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (*astuple(job), status, seconds, error),
+        )
+        self.conn.commit()
+
+    def counts(self) -> Dict[str, int]:
+        rows = self.conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status")
+        return dict(rows.fetchall())
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+def job_table(job: Job, table_name: str) -> str:
+    return f"{table_name}_{job.grid}"
+
+
+def index_tables(table_names: Iterable[str]) -> None:
+    """
+    Index and analyze the tables loaded by a batch, see pgload.index_table
+    """
+    engine = db_connect()
+    for name in sorted(set(table_names)):
+        index_table(engine, name)
+
+
+def run_job(job: Job, table_name: str, **kwargs) -> float:
+    """
+    Convert the acquisition of a job and load it into {table_name}_{grid}.
+    All the resolutions reach the table in a single statement, so a job is
+    either fully loaded or not at all. The table is not indexed, see
+    index_tables.
+    :param kwargs: Other arguments of s2_to_h3 / s2_to_rpix
+    :return: Duration of the job in seconds
+    """
+    if ":" in job.resolution:
+        kwargs["res_range"] = job.resolution
+    else:
+        kwargs["res"] = int(job.resolution)
+    start = time.perf_counter()
+    GRIDS[job.grid](
+        job.tile,
+        job.date,
+        job_table(job, table_name),
+        defer_merge=True,
+        create_indexes=False,
+        **kwargs,
+    )
+    return time.perf_counter() - start
+
+
+def run_batch(
+    jobs: List[Job],
+    manifest_path: Path,
+    table_name: str,
+    workers: int = 2,
+    runner: Callable[..., float] = run_job,
+    indexer: Optional[Callable[[Iterable[str]], None]] = index_tables,
+    **kwargs,
+) -> Dict[str, int]:
+    """
+    Run the jobs not yet recorded as done in the manifest on a process pool.
+    Failed jobs are recorded with their traceback and run again by the next
+    batch.
+    :param jobs: Jobs of the batch, see read_jobs
+    :param manifest_path: SQLite manifest of the batch
+    :param table_name: Prefix of the tables, one per grid
+    :param workers: Number of jobs run at once
+    :param runner: Function running one job, run_job by default
+    :param indexer: Function indexing the tables of the jobs done once the
+                    batch is over, index_tables by default, None to skip it
+    :param kwargs: Other arguments of the runner
+    :return: Number of jobs of the manifest per status
+    """
+    with JobManifest(manifest_path) as manifest:
+        pending = manifest.pending(jobs)
+        logger.info(
+            f"-- {len(jobs) - len(pending)} jobs already done, {len(pending)} to run"
+        )
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            # Workers send the stages they profiled back with their result
+            futures = {
+                pool.submit(profiling.remote(runner), job, table_name, **kwargs): job
+                for job in pending
+            }
+            try:
+                for future in track(
+                    as_completed(futures),
+                    total=len(futures),
+                    description="Running jobs...",
+                ):
+                    _record(manifest, futures[future], future)
+            except KeyboardInterrupt:
+                # Record the jobs finishing while the pool shuts down
+                logger.warning("-- Interrupted, waiting for the running jobs")
+                for future in futures:
+                    future.cancel()
+                for future in as_completed(futures):
+                    if not future.cancelled():
+                        _record(manifest, futures[future], future)
+                raise
+        # Jobs done by earlier runs too, an interrupted run indexes nothing
+        done = manifest.done()
+        tables = {job_table(job, table_name) for job in jobs if job in done}
+        if indexer is not None and tables:
+            indexer(tables)
+        counts = manifest.counts()
+    logger.info(f"-- Batch finished: {counts}")
+    return counts
+
+
+def _record(manifest: JobManifest, job: Job, future) -> None:
+    if future.exception() is None:
+        manifest.record(job, "done", profiling.merged(future.result()))
+        return
+    error = future.exception()
+    logger.error(f"-- Job {job} failed: {error!r}")
+    manifest.record(
+        job, "failed", error="".join(traceback.format_exception(error)).strip()
+    )
@@ -0,0 +1,248 @@
+# Copyright (C) 2024-2025 CS GROUP, https://cs-soprasteria.com
+#
+# This file is part of DGGS Toolbox:
+#
+#     https://github.com/CS-SI/dggs_tbx
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+#
+# DGGS Toolbox is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# DGGS Toolbox is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with DGGS Toolbox. If not, see
+# https://www.gnu.org/licenses/.
+
+"""
+Sparse pixel to cell mappings, cached on disk per raster grid.
+
+The mapping of a raster grid onto a DGGS at a given resolution is stored as
+a CSR matrix (one row per cell, one column per pixel) so that aggregating a
+new band or acquisition date is a single sparse matrix-vector product.
+"""
+
+import hashlib
+import logging
+import os
+from dataclasses import dataclass
+from functools import cached_property
+from pathlib import Path
+from typing import Optional, Tuple
+
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+
+from dggs_tbx.zonal import CellFunc, ZonalStats, valid_mask, window_lonlat
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CellMap:
+    """
+    CSR pixel to cell matrix of a raster grid
+    :param cells: Cell id of every row
+    :param indptr: Row pointers into indices and weights
+    :param indices: Flat pixel indices (row * width + col)
+    :param weights: Fraction of the pixel covered by the cell, None for 1
+    :param shape: Raster (height, width)
+    """
+
+    cells: np.ndarray
+    indptr: np.ndarray
+    indices: np.ndarray
+    weights: Optional[np.ndarray]
+    shape: Tuple[int, int]
+
+    def aggregate(self, values: np.ndarray, nodata=None) -> ZonalStats:
+        """
+        Weighted statistics of a band, or of a (bands, rows, cols) stack, for
+        every cell
+        :param values: Band array of the raster shape, or stack of bands
+        :param nodata: Value ignored in the statistics, or list of values per band
+        """
+        values = values.reshape(-1, self.shape[0] * self.shape[1])[:, self.indices]
+        weights = valid_mask(values, nodata).astype(np.float64)
+        if self.weights is not None:
+            weights *= self.weights
+        cells = np.repeat(self.cells, np.diff(self.indptr))
+        return ZonalStats.from_sorted(cells, values, weights)
+
+    @cached_property
+    def pixel_order(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Entries of the matrix sorted by pixel, and their pixel indices
+        """
+        order = np.argsort(self.indices, kind="stable")
+        return order, self.indices[order]
+
+    def window(self, window: Window) -> "CellMap":
+        """
+        Pixel to cell matrix of a window of the raster grid, so that windows
+        are aggregated as they are read (see zonal.window_stats)
+        """
+        width = self.shape[1]
+        order, pixels = self.pixel_order
+        start, stop = np.searchsorted(
+            pixels,
+            [window.row_off * width, (window.row_off + window.height) * width],
+        )
+        rows, cols = np.divmod(pixels[start:stop], width)
+        inside = (cols >= window.col_off) & (cols < window.col_off + window.width)
+        # Back to the order of the matrix, grouped by cell
+        entries = np.sort(order[start:stop][inside])
+        rows, cols = np.divmod(self.indices[entries], width)
+        cell_rows, counts = np.unique(
+            np.searchsorted(self.indptr, entries, side="right") - 1,
+            return_counts=True,
+        )
+        return CellMap(
+            cells=self.cells[cell_rows],
+            indptr=np.concatenate([[0], np.cumsum(counts)]),
+            indices=(rows - window.row_off) * window.width + cols - window.col_off,
+            weights=None if self.weights is None else self.weights[entries],
+            shape=(window.height, window.width),
+        )
+
+    def save(self, path: Path) -> None:
+        # Write then rename so that concurrent runs never read a partial file
+        tmp_path = path.with_name(f"{path.stem}.{os.getpid()}.tmp.npz")
+        arrays = {
+            "cells": self.cells,
+            "indptr": self.indptr,
+            "indices": self.indices,
+            "shape": np.array(self.shape),
+        }
+        if self.weights is not None:
+            arrays["weights"] = self.weights
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: Path) -> "CellMap":
+        with np.load(path) as npz:
+            return cls(
+                cells=npz["cells"],
+                indptr=npz["indptr"],
+                indices=npz["indices"],
+                weights=npz["weights"] if "weights" in npz else None,
+                shape=tuple(npz["shape"].tolist()),
+            )
+
+
+def build_cell_map(
+    raster_path: Path,
+    cell_func: CellFunc,
+    resolution: int,
+    supersample: int = 1,
+    chunk_rows: int = 512,
+) -> CellMap:
+    """
+    Build the pixel to cell matrix of a raster grid
+    :param raster_path: Path to a raster of the grid
+    :param cell_func: Function mapping lon, lat arrays to cell ids
+    :param resolution: DGGS resolution
+    :param supersample: Number of samples per pixel side, weights are the
+                        fraction of samples falling in each cell when > 1
+    :param chunk_rows: Number of raster rows processed at once
+    """
+    offsets = (np.arange(supersample) + 0.5) / supersample
+    pairs_cells, pairs_pixels, pairs_samples = [], [], []
+    with rasterio.open(raster_path, "r") as src:
+        height, width, transform, crs = src.height, src.width, src.transform, src.crs
+    for row_off in range(0, height, chunk_rows):
+        window = Window(0, row_off, width, min(chunk_rows, height - row_off))
+        size = window.height * width
+        chunk_cells = []
+        for dy in offsets:
+            for dx in offsets:
+                lon, lat = window_lonlat(transform, crs, window, offset=(dx, dy))
+                chunk_cells.append(cell_func(lon, lat, resolution))
+        chunk_cells = np.concatenate(chunk_cells)
+        pixels = np.tile(np.arange(size, dtype=np.int64), supersample**2)
+        if supersample > 1:
+            # Count the samples of every (cell, pixel) pair of the chunk, so
+            # that no more than one pair per covered pixel is held
+            chunk_cells, codes = np.unique(chunk_cells, return_inverse=True)
+            pairs, samples = np.unique(codes * size + pixels, return_counts=True)
+            codes, pixels = np.divmod(pairs, size)
+            chunk_cells = chunk_cells[codes]
+            pairs_samples.append(samples)
+        pairs_cells.append(chunk_cells)
+        pairs_pixels.append(pixels + row_off * width)
+    pairs_cells = np.concatenate(pairs_cells)
+    pairs_pixels = np.concatenate(pairs_pixels)
+
+    cells, rows = np.unique(pairs_cells, return_inverse=True)
+    del pairs_cells
+    order = np.argsort(rows, kind="stable")
+    indices = pairs_pixels[order]
+    weights = None
+    if supersample > 1:
+        samples = np.concatenate(pairs_samples)[order]
+        weights = (samples / supersample**2).astype(np.float32)
+    counts = np.bincount(rows, minlength=len(cells))
+    indptr = np.concatenate([[0], np.cumsum(counts)])
+    logger.info(f"-- Built pixel to cell map of {len(cells)} cells at res {resolution}")
+    return CellMap(
+        cells=cells,
+        indptr=indptr,
+        indices=indices.astype(np.int32 if height * width < 2**31 else np.int64),
+        weights=weights,
+        shape=(height, width),
+    )
+
+
+def cell_map_path(
+    cache_dir: Path,
+    raster_path: Path,
+    grid_name: str,
+    resolution: int,
+    tile_id: str = "",
+    supersample: int = 1,
+    suffix: str = ".npz",
+) -> Path:
+    """
+    Cache file of the pixel to cell map of a raster grid. The key holds the
+    tile id, grid name, resolution and a digest of the raster transform.
+    :param suffix: Extension of the file, .npy for the labels of dggs_tbx.labels
+    """
+    with rasterio.open(raster_path, "r") as src:
+        grid_key = f"{src.crs.to_wkt()}|{tuple(src.transform)}|{src.shape}"
+    digest = hashlib.sha1(f"{grid_key}|{supersample}".encode()).hexdigest()[:16]
+    prefix = f"{tile_id}_" if tile_id else ""
+    return Path(cache_dir) / f"{prefix}{grid_name}_res_{resolution}_{digest}{suffix}"
+
+
+def cached_cell_map(
+    cache_dir: Path,
+    raster_path: Path,
+    grid_name: str,
+    cell_func: CellFunc,
+    resolution: int,
+    tile_id: str = "",
+    supersample: int = 1,
+) -> CellMap:
+    """
+    Load the pixel to cell map of a raster grid from the cache, building and
+    storing it on a cache miss
+    """
+    path = cell_map_path(
+        cache_dir, raster_path, grid_name, resolution, tile_id, supersample
+    )
+    if path.exists():
+        logger.info(f"-- Using cached pixel to cell map {path}")
+        return CellMap.load(path)
+    cell_map = build_cell_map(raster_path, cell_func, resolution, supersample)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    cell_map.save(path)
+    logger.info(f"-- Pixel to cell map saved to: {path}")
+    return cell_map
@@ -0,0 +1,76 @@
+# Copyright (C) 2024-2025 CS GROUP, https://cs-soprasteria.com
+#
+# This file is part of DGGS Toolbox:
+#
+#     https://github.com/CS-SI/dggs_tbx
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+#
+# DGGS Toolbox is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# DGGS Toolbox is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with DGGS Toolbox. If not, see
+# https://www.gnu.org/licenses/.
+
+
+"""
+Per cell cloud index of Sentinel-2 L2A scene classification (SCL) rasters.
+
+SCL windows are classified as they are read and reduced by the zonal engine
+(see dggs_tbx.zonal), so the cloud fraction, the number of valid pixels and
+the highest class of every cell come out of a single pass over the band,
+without an intermediate mask raster.
+"""
+
+import numpy as np
+import pandas as pd
+
+from dggs_tbx.utils import SCL_NODATA_VALUE, classify_scl
+from dggs_tbx.zonal import ZonalStats
+
+# Nodata of the derived (masked flag, SCL class) bands
+CLOUD_NODATA = [255, SCL_NODATA_VALUE]
+
+
+def scl_cloud_values(scl: np.ndarray) -> np.ndarray:
+    """
+    Derive the (masked, class) bands of a (1, rows, cols) SCL window: 1 where
+    the class is masked (see SCL_MASK_VALUES), 0 where clear and 255 on nodata,
+    and the SCL class itself
+    """
+    masked = classify_scl(scl[0])
+    # classify_scl gives 0 for masked and 1 for clear pixels
+    np.subtract(1, masked, out=masked, where=masked != 255)
+    return np.stack([masked, scl[0].astype(np.uint8)])
+
+
+def cloud_index_frame(stats: ZonalStats) -> pd.DataFrame:
+    """
+    Cloud index per cell id from stats of the scl_cloud_values bands
+    :return: DataFrame with the cloud_fraction (NaN without valid pixels),
+             the number of valid_pixels and the max_class of every cell
+    """
+    valid = stats.counts[0]
+    return pd.DataFrame(
+        {
+            "cloud_fraction": np.divide(
+                stats.sums[0],
+                valid,
+                out=np.full(len(valid), np.nan),
+                where=valid > 0,
+            ).astype(np.float32),
+            "valid_pixels": valid.astype(np.int64),
+            "max_class": np.where(
+                np.isfinite(stats.maxs[1]), stats.maxs[1], SCL_NODATA_VALUE
+            ).astype(np.int16),
+        },
+        index=stats.cells,
+    )
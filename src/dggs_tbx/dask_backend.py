@@ -0,0 +1,168 @@
+# Copyright (C) 2024-2025 CS GROUP, https://cs-soprasteria.com
+#
+# This file is part of DGGS Toolbox:
+#
+#     https://github.com/CS-SI/dggs_tbx
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+#
+# DGGS Toolbox is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# DGGS Toolbox is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with DGGS Toolbox. If not, see
+# https://www.gnu.org/licenses/.
+
+
+"""
+Dask backend of the zonal aggregation.
+
+The raster is partitioned into chunks of block aligned windows, every chunk
+is read and aggregated by a task running on a Dask worker, and the partial
+statistics are merged along a reduction tree, so that neither the pixels nor
+all the partials ever go through a single process. Workers open the rasters
+themselves: on a multi-node cluster their paths must be reachable from every
+node (shared file system or GDAL virtual file system).
+"""
+
+import logging
+from contextlib import ExitStack
+from pathlib import Path
+from typing import List, Optional
+
+import dask
+import numpy as np
+
+from dggs_tbx.zonal import (
+    CellFunc,
+    ValueFunc,
+    ZonalAccumulator,
+    ZonalStats,
+    open_band_stack,
+    window_stats,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def dask_client(address: str = None, workers: int = None):
+    """
+    Client of a distributed scheduler, or of a LocalCluster of single threaded
+    worker processes, closed with the client, when no address is given
+    :param address: Scheduler address, e.g. tcp://10.0.0.1:8786
+    :param workers: Number of workers of the LocalCluster, one per core if None
+    """
+    from distributed import Client
+
+    if address is not None:
+        return Client(address)
+    return Client(n_workers=workers, threads_per_worker=1, processes=True)
+
+
+def chunk_stats(
+    list_bands: List[Path],
+    resampling,
+    max_pixel_area: Optional[float],
+    windows: list,
+    cell_func: CellFunc,
+    resolution: int,
+    nodata: list,
+    value_func: Optional[ValueFunc] = None,
+    labels=None,
+    cell_maps: Optional[list] = None,
+) -> ZonalStats:
+    """
+    Statistics of a chunk of windows, read on the worker running the task
+    :param cell_maps: Pixel to cell maps of the windows, see window_stats
+    """
+    with ExitStack() as stack:
+        ref, sources = open_band_stack(stack, list_bands, resampling, max_pixel_area)
+        accumulator = ZonalAccumulator(len(nodata))
+        for i, window in enumerate(windows):
+            values = np.stack([src.read(1, window=window) for src in sources])
+            accumulator.add(
+                window_stats(
+                    values,
+                    ref.transform,
+                    ref.crs,
+                    window,
+                    cell_func,
+                    resolution,
+                    nodata,
+                    value_func,
+                    labels,
+                    None if cell_maps is None else cell_maps[i],
+                )
+            )
+        return accumulator.result()
+
+
+def tree_merge(partials: list, split_every: int = 8):
+    """
+    Delayed merge of delayed partial stats, split_every partials at a time
+    """
+    merge = dask.delayed(ZonalStats.merge, pure=True)
+    while len(partials) > 1:
+        partials = [
+            merge(partials[i : i + split_every])
+            for i in range(0, len(partials), split_every)
+        ]
+    return partials[0]
+
+
+def dask_zonal_stats(
+    client,
+    list_bands: List[Path],
+    windows: list,
+    resampling,
+    max_pixel_area: Optional[float],
+    cell_func: CellFunc,
+    resolution: int,
+    nodata: list,
+    value_func: Optional[ValueFunc] = None,
+    windows_per_task: int = 4,
+    split_every: int = 8,
+    labels=None,
+    cell_map=None,
+) -> ZonalStats:
+    """
+    Aggregate windows of a band stack on a Dask cluster (see zonal_stats)
+    :param client: distributed Client, or None for the default Dask scheduler
+    :param windows_per_task: Number of windows read and aggregated by a task
+    :param split_every: Number of partials merged by a task of the reduction
+    :param labels: Cell labels of the pixel grid, mapped by every worker
+    :param cell_map: Pixel to cell map of the pixel grid, tasks receive the
+                     part of the map of their windows
+    """
+    task = dask.delayed(chunk_stats, pure=True)
+    partials = []
+    for i in range(0, len(windows), windows_per_task):
+        chunk = windows[i : i + windows_per_task]
+        partials.append(
+            task(
+                list_bands,
+                resampling,
+                max_pixel_area,
+                chunk,
+                cell_func,
+                resolution,
+                nodata,
+                value_func,
+                labels,
+                None if cell_map is None else [cell_map.window(w) for w in chunk],
+            )
+        )
+    if not partials:
+        return ZonalStats.empty(len(nodata))
+    logger.info(f"-- Aggregating {len(windows)} windows in {len(partials)} Dask tasks")
+    merged = tree_merge(partials, split_every)
+    if client is None:
+        return merged.compute()
+    return client.compute(merged).result()
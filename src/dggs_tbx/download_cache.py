@@ -0,0 +1,131 @@
+# Copyright (C) 2024-2025 CS GROUP, https://cs-soprasteria.com
+#
+# This file is part of DGGS Toolbox:
+#
+#     https://github.com/CS-SI/dggs_tbx
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+#
+# DGGS Toolbox is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# DGGS Toolbox is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with DGGS Toolbox. If not, see
+# https://www.gnu.org/licenses/.
+
+"""
+Local content-addressed cache of S3 objects with LRU eviction.
+
+Objects are stored under the digest of their key and ETag, so a modified
+object is fetched again. Downloads go to a temporary file renamed into place
+and callers get hard links to the cached files, which lets several workers
+share one cache directory and evict files that others still use.
+"""
+
+import hashlib
+import logging
+import os
+import shutil
+import threading
+from pathlib import Path
+
+from dggs_tbx import profiling
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_SIZE = 20 * 1024**3
+
+
+class DownloadCache:
+    """
+    LRU cache of S3 objects
+    :param cache_dir: Directory of the cached objects
+    :param max_bytes: Total size above which the least recently used objects
+                      are evicted
+    """
+
+    def __init__(self, cache_dir: Path, max_bytes: int = DEFAULT_CACHE_SIZE):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def object_path(self, key: str, etag: str) -> Path:
+        digest = hashlib.sha256(f"{key}|{etag.strip(chr(34))}".encode()).hexdigest()
+        return self.cache_dir / digest[:2] / f"{digest}{Path(key).suffix}"
+
+    def fetch(self, client, bucket: str, key: str, etag: str) -> Path:
+        """
+        Return the cached file of an object, downloading it on a cache miss
+        """
+        path = self.object_path(key, etag)
+        if path.exists():
+            # Mark as recently used
+            os.utime(path)
+            logger.info(f" -- Cache hit for {key}")
+            return path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Unique per process and thread, concurrent downloads never share it
+        tmp_path = path.with_name(
+            f".{path.name}.{os.getpid()}.{threading.get_ident()}.part"
+        )
+        try:
+            client.download_file(bucket, key, str(tmp_path))
+            profiling.count(s3_bytes=tmp_path.stat().st_size)
+            os.replace(tmp_path, path)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+        self.evict(keep=path)
+        return path
+
+    def get(self, client, bucket: str, key: str, etag: str, dest: Path) -> Path:
+        """
+        Place the object at dest, as a hard link to the cached file when the
+        file system allows it
+        """
+        path = self.fetch(client, bucket, key, etag)
+        dest.unlink(missing_ok=True)
+        try:
+            self._place(path, dest)
+        except FileNotFoundError:
+            # Evicted by another worker since it was fetched
+            logger.info(f" -- {key} left the cache before use, fetching it again")
+            self._place(self.fetch(client, bucket, key, etag), dest)
+        return dest
+
+    @staticmethod
+    def _place(path: Path, dest: Path) -> None:
+        try:
+            os.link(path, dest)
+        except OSError:
+            shutil.copyfile(path, dest)
+
+    def evict(self, keep: Path = None) -> None:
+        """
+        Remove the least recently used objects until the cache fits max_bytes
+        """
+        entries = []
+        for path in self.cache_dir.glob("*/*"):
+            if path.name.startswith("."):
+                continue
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                # Evicted by another worker
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            path.unlink(missing_ok=True)
+            total -= size
+            logger.info(f" -- Evicted {path.name} from the download cache")
@@ -0,0 +1,142 @@
+# Copyright (C) 2024-2025 CS GROUP, https://cs-soprasteria.com
+#
+# This file is part of DGGS Toolbox:
+#
+#     https://github.com/CS-SI/dggs_tbx
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+#
+# DGGS Toolbox is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# DGGS Toolbox is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with DGGS Toolbox. If not, see
+# https://www.gnu.org/licenses/.
+
+"""
+Incremental (Geo)Parquet output of DGGS grids.
+
+Rows are sorted by their 64-bit cell id and written one row group at a time,
+every row group carries min/max statistics so that readers can skip the
+groups outside a cell id range. Geometries, when present, are stored as WKB
+with the GeoParquet "geo" metadata.
+"""
+
+import json
+import logging
+from pathlib import Path
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import shapely
+
+logger = logging.getLogger(__name__)
+
+GEOPARQUET_VERSION = "1.0.0"
+
+
+class GridParquetWriter:
+    """
+    Write grid frames to a Parquet file, one or more row groups per frame
+    :param path: Output Parquet file
+    :param id_column: Integer cell id column the rows are sorted by
+    :param row_group_size: Maximum number of rows per row group
+    """
+
+    def __init__(self, path: Path, id_column: str, row_group_size: int = 2**17):
+        self.path = Path(path)
+        self.id_column = id_column
+        self.row_group_size = row_group_size
+        self.writer = None
+        self.schema = None
+        self.rows = 0
+        self.last_id = None
+
+    def __enter__(self) -> "GridParquetWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+    def write(self, df: pd.DataFrame) -> None:
+        """
+        Sort a frame by cell id and append it as row groups. Frames written
+        in increasing id order give a file sorted as a whole.
+        """
+        df = df.sort_values(self.id_column, kind="stable")
+        table = self._to_arrow(df)
+        if self.writer is None:
+            self.schema = table.schema
+            self.writer = pq.ParquetWriter(
+                self.path,
+                self.schema,
+                compression="zstd",
+                write_statistics=True,
+                sorting_columns=[
+                    pq.SortingColumn(self.schema.get_field_index(self.id_column))
+                ],
+            )
+        else:
+            table = table.cast(self.schema)
+        if len(df) and self.last_id is not None:
+            if df[self.id_column].iloc[0] < self.last_id:
+                logger.warning(
+                    f"-- {self.path} is only sorted within row groups, "
+                    "frames were not written in increasing cell id order"
+                )
+        if len(df):
+            self.last_id = df[self.id_column].iloc[-1]
+        for offset in range(0, table.num_rows, self.row_group_size):
+            self.writer.write_table(table.slice(offset, self.row_group_size))
+        self.rows += table.num_rows
+
+    def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+            logger.info(f"-- {self.rows} cells saved to: {self.path}")
+
+    def _to_arrow(self, df: pd.DataFrame) -> pa.Table:
+        geo = None
+        if isinstance(df, gpd.GeoDataFrame):
+            geom_col = df.geometry.name
+            geo = {
+                "version": GEOPARQUET_VERSION,
+                "primary_column": geom_col,
+                "columns": {
+                    geom_col: {
+                        "encoding": "WKB",
+                        "geometry_types": [],
+                        "crs": df.crs.to_json_dict() if df.crs else None,
+                    }
+                },
+            }
+            df = pd.DataFrame(df)
+            df[geom_col] = shapely.to_wkb(np.asarray(df[geom_col].values))
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        if geo is not None:
+            metadata = dict(table.schema.metadata or {})
+            metadata[b"geo"] = json.dumps(geo).encode()
+            table = table.replace_schema_metadata(metadata)
+        return table
+
+
+def write_grid_parquet(
+    df: pd.DataFrame, path: Path, id_column: str, row_group_size: int = 2**17
+) -> Path:
+    """
+    Write a whole grid frame to a Parquet file sorted by cell id
+    """
+    with GridParquetWriter(path, id_column, row_group_size) as writer:
+        writer.write(df)
+    return Path(path)
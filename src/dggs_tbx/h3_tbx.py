@@ -20,52 +20,359 @@
 # License along with DGGS Toolbox. If not, see
 # https://www.gnu.org/licenses/.
 
-import json
 import logging
 import shutil
+import warnings
 from logging import INFO
 from pathlib import Path
 from tempfile import gettempdir
-from typing import List
+from typing import List, Tuple
 
-import dask.dataframe as dd
 import geopandas as gpd
-import h3pandas
 import numpy as np
+import pandas as pd
 import rasterio.rio.mask
 from h3 import h3
-from rich.logging import RichHandler
-from rich.progress import track
-from shapely.geometry import Polygon, box
+from h3.api import numpy_int as h3_int
+from shapely.geometry import Polygon, mapping
 
-from dggs_tbx.utils import down_s2, db_connect, binary_scl
+from dggs_tbx import profiling
+from dggs_tbx.download_cache import DEFAULT_CACHE_SIZE
+from dggs_tbx.utils import down_s2, db_connect, job_dir, parse_res_range, save_grid
+from dggs_tbx.cellmap import cached_cell_map
+from dggs_tbx.labels import cached_labels
+from dggs_tbx.cloudindex import CLOUD_NODATA, cloud_index_frame, scl_cloud_values
+from dggs_tbx.transforms import WGS84, extent_lonlat, transform_geometries
+from dggs_tbx.zonal import (
+    CENTROID_RATIO,
+    ZonalStats,
+    band_name,
+    centroid_sampled,
+    reference_raster,
+    zonal_stats,
+)
 
-FORMAT = "%(message)s"
-logging.basicConfig(level=INFO, format=FORMAT, datefmt="[%X]", handlers=[RichHandler()])
+with warnings.catch_warnings():
+    # Vectorized H3 functions are flagged as experimental by h3-py
+    warnings.simplefilter("ignore")
+    try:
+        from h3.unstable import vect as h3_vect
+    except ImportError:  # pragma: no cover
+        h3_vect = None
 
 logger = logging.getLogger(__name__)
 logger.setLevel(INFO)
 
 
 def h3_from_raster_extent(
-    raster_path: Path, output_grid: Path, resolution: int, df_ret=False
+    raster_path: Path, output_grid: Path, resolution: int, df_ret=False, crs=None
 ):
+    # Geometries are in the raster CRS unless another crs is given
+    out_fname = f"{raster_path.stem}_H3_res_{resolution}_ap7.geojson"
+    logger.info(f"-- H3 at resolution {resolution}")
+    batches = list(h3_grid_batches(raster_path, resolution, crs=crs))
+    gdf = pd.concat(batches) if len(batches) > 1 else batches[0]
+    gdf = gdf.drop(columns="h3_id")
+    gdf.insert(0, "id", 1)
+    if df_ret:
+        return gdf
+    else:
+        gdf.to_file(output_grid / out_fname, driver="GeoJSON")
+        logger.info(f"-- Grid saved to: {output_grid / out_fname}")
+        return output_grid / out_fname
+
+
+def raster_extent_lonlat(raster_path: Path) -> Polygon:
+    """
+    Return the raster extent as a lon/lat polygon
+    """
     with rasterio.open(raster_path, "r") as ds:
-        bounds = ds.bounds
-        extent_geom = box(*bounds)
-        df = gpd.GeoDataFrame({"id": 1, "geometry": [extent_geom]})
-        df.crs = ds.crs
-        df = df.to_crs("EPSG:4326")
-        logger.info(f"-- H3 at resolution {resolution}")
-        out_fname = f"{raster_path.stem}_H3_res_{resolution}_ap7.geojson"
-        gdf = df.h3.polyfill_resample(resolution)
-        gdf = gdf.to_crs(f"EPSG:{ds.crs.to_epsg()}")
-        if df_ret:
-            return gdf
-        else:
-            gdf.to_file(output_grid / out_fname, driver="GeoJSON")
-            logger.info(f"-- Grid saved to: {output_grid / out_fname}")
-            return output_grid / out_fname
+        return extent_lonlat(ds.bounds, ds.crs)
+
+
+def h3_polyfill(geometry, resolution: int) -> np.ndarray:
+    """
+    Return the H3 cell ids (uint64) whose centre lies in a lon/lat polygon
+    or multipolygon
+    """
+    polygons = getattr(geometry, "geoms", [geometry])
+    cells = [
+        h3_int.polyfill(mapping(polygon), resolution, geo_json_conformant=True)
+        for polygon in polygons
+        if not polygon.is_empty
+    ]
+    if not cells:
+        return np.empty(0, dtype=np.uint64)
+    return np.unique(np.concatenate(cells).astype(np.uint64))
+
+
+def h3_polyfill_batches(
+    geometry, resolution: int, batch_size: int = 2**16, parent_resolution=None
+):
+    """
+    Stream the H3 cells of h3_polyfill by batches of about batch_size cells,
+    in increasing id order. The polygon is covered at a coarse parent
+    resolution first and the children of one parent are filled at a time, so
+    memory is set by the batch size rather than by the resolution.
+    :param parent_resolution: Resolution of the cover, 4 levels above
+                              resolution by default (2401 children per parent)
+    """
+    if parent_resolution is None:
+        parent_resolution = max(0, resolution - 4)
+    parent_resolution = min(parent_resolution, resolution)
+    # Children may lie slightly outside their parent hexagon, the margin of
+    # two parent edges (in degrees at the highest latitude) is generous
+    max_lat = max(abs(geometry.bounds[1]), abs(geometry.bounds[3]))
+    margin = 2 * h3.edge_length(parent_resolution, unit="km") / 111.32
+    margin /= max(np.cos(np.deg2rad(max_lat)), 0.01)
+    parents = h3_polyfill(geometry.buffer(margin), parent_resolution)
+    batch, size = [], 0
+    for parent in parents:
+        hexagon = Polygon(h3_int.h3_to_geo_boundary(parent, geo_json=True))
+        piece = geometry.intersection(hexagon.buffer(margin / 2))
+        if piece.is_empty:
+            continue
+        cells = h3_polyfill(piece, resolution)
+        # Keep the children of this parent only, each cell is yielded once
+        cells = cells[h3_parents(cells, parent_resolution) == parent]
+        if len(cells) == 0:
+            continue
+        batch.append(cells)
+        size += len(cells)
+        if size >= batch_size:
+            yield np.concatenate(batch)
+            batch, size = [], 0
+    if batch:
+        yield np.concatenate(batch)
+
+
+def h3_grid_batches(
+    raster_path: Path, resolution: int, batch_size: int = 2**16, crs=None
+):
+    """
+    Stream the H3 grid of the raster extent by batches of GeoDataFrames in
+    the raster CRS, indexed by H3 string and with the uint64 h3_id column
+    :param crs: CRS of the geometries instead of the raster CRS, e.g.
+                EPSG:4326 to keep the cell boundaries untransformed
+    """
+    with rasterio.open(raster_path, "r") as ds:
+        extent = extent_lonlat(ds.bounds, ds.crs)
+        crs = crs or ds.crs
+    for cells in profiling.staged_iter(
+        "grid", h3_polyfill_batches(extent, resolution, batch_size)
+    ):
+        with profiling.stage("grid"):
+            ids = pd.Index(
+                [h3.h3_to_string(int(c)) for c in cells], name="h3_polyfill"
+            )
+            geometry = h3_cells_geometry(ids).values
+            with profiling.stage("reprojection"):
+                geometry = transform_geometries(geometry, WGS84, crs)
+            profiling.count(cells=len(cells))
+        yield gpd.GeoDataFrame(
+            {"h3_id": cells}, index=ids, geometry=geometry, crs=crs
+        )
+
+
+def h3_cells_from_points(lon: np.ndarray, lat: np.ndarray, resolution: int):
+    """
+    Return the H3 cell ids (uint64) containing every lon, lat point
+    """
+    lat = np.ascontiguousarray(lat, dtype=np.float64)
+    lon = np.ascontiguousarray(lon, dtype=np.float64)
+    if h3_vect is not None:
+        return h3_vect.geo_to_h3(lat, lon, resolution)
+    return np.fromiter(
+        (h3.string_to_h3(h3.geo_to_h3(y, x, resolution)) for x, y in zip(lon, lat)),
+        dtype=np.uint64,
+        count=len(lon),
+    )
+
+
+def h3_cell_centres(extent: Polygon, resolution: int, batch_size: int = 2**16):
+    """
+    Stream the H3 cells of a lon/lat polygon by batches of (uint64 ids,
+    centre lon, centre lat), see zonal.centroid_stats
+    """
+    for cells in h3_polyfill_batches(extent, resolution, batch_size):
+        lat, lon = np.array([h3_int.h3_to_geo(int(c)) for c in cells]).T
+        yield cells, lon, lat
+
+
+def h3_ids(cells) -> np.ndarray:
+    """
+    Return the H3 cell ids (uint64) of H3 strings
+    """
+    return np.fromiter(
+        (h3.string_to_h3(c) for c in cells), dtype=np.uint64, count=len(cells)
+    )
+
+
+def h3_parents(cells: np.ndarray, resolution: int) -> np.ndarray:
+    """
+    Return the parent H3 cell ids (uint64) at a coarser resolution
+    """
+    cells = np.ascontiguousarray(cells, dtype=np.uint64)
+    if h3_vect is not None:
+        return h3_vect.h3_to_parent(cells, resolution)
+    return np.fromiter(
+        (
+            h3.string_to_h3(h3.h3_to_parent(h3.h3_to_string(int(c)), resolution))
+            for c in cells
+        ),
+        dtype=np.uint64,
+        count=len(cells),
+    )
+
+
+def h3_zonal_stats(
+    list_bands: List[Path],
+    resolution: int,
+    cache_dir: Path = None,
+    tile_id: str = "",
+    workers: int = 1,
+    overview_budget: float = 1e-4,
+    labels_dir: Path = None,
+    **kwargs,
+) -> ZonalStats:
+    """
+    Statistics of every band for each H3 cell covering the rasters
+    :param list_bands: Paths to the single band rasters, named after the band
+    :param resolution: H3 resolution
+    :param cache_dir: Directory of the cached pixel to cell maps, no cache if None
+    :param tile_id: Tile id used to name the cached pixel to cell maps
+    :param workers: Number of processes aggregating the raster windows
+    :param overview_budget: Maximum ratio of the pixel area to the cell area
+                            when reading from the raster overviews
+    :param labels_dir: Directory of the cached memory-mapped cell labels, used
+                       when no cache_dir is given
+    :param kwargs: Other arguments of zonal_stats, e.g. a value_func or the
+                   centroid_ratio below which cells are sampled at their centre
+    """
+    cell_area = h3.hex_area(resolution, unit="m^2")
+    cell_map = labels = None
+    reference = reference_raster(list_bands)
+    with rasterio.open(reference) as ref:
+        sampled = centroid_sampled(
+            ref, cell_area, kwargs.get("centroid_ratio", CENTROID_RATIO)
+        )
+    # Cells sampled at their centre need no cell map or labels
+    if not sampled:
+        if cache_dir is not None:
+            cell_map = cached_cell_map(
+                cache_dir, reference, "H3", h3_cells_from_points, resolution, tile_id
+            )
+        elif labels_dir is not None:
+            labels = cached_labels(
+                labels_dir, reference, "H3", h3_cells_from_points, resolution, tile_id
+            )
+    return zonal_stats(
+        list_bands,
+        h3_cells_from_points,
+        resolution,
+        cell_map=cell_map,
+        labels=labels,
+        workers=workers,
+        cell_area=cell_area,
+        overview_budget=overview_budget,
+        cell_centres=h3_cell_centres,
+        **kwargs,
+    )
+
+
+# Server-side geometry of ids-only tables with the h3-pg extension, see
+# pgload.create_geometry_view
+H3_GEOMETRY_SQL = "h3_cell_to_boundary_geometry(h3_id::h3index)"
+
+
+def h3_cells_geometry(cells) -> gpd.GeoSeries:
+    """
+    Boundary polygons of H3 cells given as uint64 ids or strings (EPSG:4326)
+    """
+    ids = [h3.h3_to_string(int(c)) if not isinstance(c, str) else c for c in cells]
+    return gpd.GeoSeries(
+        [Polygon(h3.h3_to_geo_boundary(c, geo_json=True)) for c in ids],
+        crs="EPSG:4326",
+    )
+
+
+@profiling.staged("grid")
+def h3_with_geometry(df: pd.DataFrame) -> gpd.GeoDataFrame:
+    """
+    Materialize the geometry of an ids-only frame indexed by uint64 H3 ids
+    """
+    df = df.copy()
+    df.index = pd.Index(
+        [h3.h3_to_string(int(c)) for c in df.index], name="h3_polyfill"
+    )
+    geometry = h3_cells_geometry(df.index)
+    profiling.count(cells=len(df))
+    return gpd.GeoDataFrame(df, geometry=geometry.values, crs="EPSG:4326")
+
+
+def h3_stats_frame(
+    stats: ZonalStats, band_names: List[str], ids_only: bool = False
+) -> gpd.GeoDataFrame:
+    """
+    GeoDataFrame indexed by H3 id with the mean of every band (EPSG:4326)
+    :param ids_only: Return a DataFrame indexed by uint64 H3 ids ("h3_id")
+                     without geometry, see h3_with_geometry
+    """
+    df = stats.to_frame(band_names)
+    df.index = pd.Index(df.index.to_numpy().astype(np.uint64), name="h3_id")
+    if ids_only:
+        return df
+    return h3_with_geometry(df)
+
+
+def h3_zonal_mean(
+    list_bands: List[Path], resolution: int, *args, ids_only: bool = False, **kwargs
+):
+    """
+    Mean value of every band for each H3 cell covering the rasters
+    (see h3_zonal_stats for the other arguments)
+    :return: GeoDataFrame indexed by H3 id with one column per band (EPSG:4326),
+             or DataFrame indexed by uint64 H3 id with ids_only
+    """
+    stats = h3_zonal_stats(list_bands, resolution, *args, **kwargs)
+    return h3_stats_frame(stats, [band_name(path) for path in list_bands], ids_only)
+
+
+def h3_zonal_pyramid(
+    list_bands: List[Path], resolutions: List[int], ids_only: bool = False, **kwargs
+):
+    """
+    Aggregate the rasters once at the finest resolution and roll the sums and
+    counts up to the parent cells of every coarser resolution
+    (see h3_zonal_stats for the keyword arguments)
+    :return: Iterator of (resolution, GeoDataFrame) from the finest resolution
+    """
+    band_names = [band_name(path) for path in list_bands]
+    resolutions = sorted(resolutions, reverse=True)
+    stats = h3_zonal_stats(list_bands, resolutions[0], **kwargs)
+    for resolution in resolutions:
+        if resolution < resolutions[0]:
+            with profiling.stage("aggregation"):
+                stats = stats.to_parent(h3_parents(stats.cells, resolution))
+                profiling.count(cells=len(stats.cells))
+        yield resolution, h3_stats_frame(stats, band_names, ids_only)
+
+
+def h3_db_frame(
+    h3_grid: pd.DataFrame, resolution: int, simulate: bool = False
+) -> pd.DataFrame:
+    """
+    Add the simulated, resolution and grid_name columns of the DB tables to a
+    level of the grid, geometries in EPSG:4326
+    """
+    h3_grid["simulated"] = simulate
+    h3_grid["resolution"] = resolution
+    # Add grid name
+    h3_grid["grid_name"] = "H3"
+    if isinstance(h3_grid, gpd.GeoDataFrame):
+        with profiling.stage("reprojection"):
+            h3_grid = h3_grid.to_crs("EPSG:4326")
+    return h3_grid
 
 
 def s2_to_h3(
@@ -77,60 +384,128 @@ def s2_to_h3(
     res: int = 7,
     simulate: bool = False,
     use_dask: bool = False,
+    cache_dir: Path = None,
+    workers: int = 1,
+    overview_budget: float = 1e-4,
+    res_range: str = None,
+    download_cache: Path = None,
+    download_cache_size: int = DEFAULT_CACHE_SIZE,
+    keep_inputs: bool = False,
+    download_workers: int = 4,
+    aoi: Tuple[float, float, float, float] = None,
+    ids_only: bool = False,
+    defer_merge: bool = False,
+    scheduler: str = None,
+    labels_dir: Path = None,
+    create_indexes: bool = False,
+    centroid_ratio: float = CENTROID_RATIO,
 ):
     # Get all 10m tif files and store them in tmp dir
     # for each H3 cell load info from all bands
     # send dataframe to postgis
+    # With a res_range ("5:10"), every resolution of the pyramid is derived
+    # from the finest one
+    # Downloaded bands are removed at the end unless keep_inputs is set, a
+    # download_cache directory keeps them across runs. With aoi bounds, only
+    # the COG blocks overlapping them are fetched. With ids_only, rows hold
+    # 64-bit cell ids and no geometry (not applied to simulated grids). With
+    # defer_merge, all the levels reach the table in a single statement. The
+    # indexes are left to pgload.index_table unless create_indexes is set. With
+    # use_dask, the aggregation runs on the Dask scheduler at the scheduler
+    # address, or on a LocalCluster of as many processes as workers. With
+    # labels_dir, the pixel cell labels are memory-mapped from that directory,
+    # computed by the first date of a tile and reused by the next ones. Cells
+    # smaller than centroid_ratio pixels are sampled at their centre
 
+    resolutions = parse_res_range(res_range) if res_range else [res]
     # Download the Sentinel-2 data
     if simulate:
         # In case of simulation, download only one band for extent
-        out_dir = down_s2(s2_tile_id, date, tmp_dir, bands=bands[0])
+        bands_to_download = bands[0]
     else:
-        out_dir = down_s2(s2_tile_id, date, tmp_dir, bands=bands)
-    # Create a gdf of H3 hex at a given resolution
-    list_bands = list(out_dir.rglob("*.tif"))
+        bands_to_download = bands
+    # The bands of the job are downloaded to a directory of its own, batch
+    # jobs on the same product may run at the same time
+    download_dir = job_dir(tmp_dir)
+    client = None
+    try:
+        out_dir = down_s2(
+            s2_tile_id,
+            date,
+            download_dir,
+            bands=bands_to_download,
+            cache_dir=download_cache,
+            cache_size=download_cache_size,
+            max_workers=download_workers,
+            aoi=aoi,
+        )
+        # Create a gdf of H3 hex at a given resolution
+        list_bands = list(out_dir.rglob("*.tif"))
+        if simulate:
+            levels = (
+                (r, simulate_h3_grid(list_bands[0], out_dir, r, bands, use_dask))
+                for r in resolutions
+            )
+        else:
+            # Fill the H3 dataframe with a vectorized pixel to cell aggregation
+            if use_dask:
+                from dggs_tbx.dask_backend import dask_client
+
+                client = dask_client(scheduler, workers)
+            levels = h3_zonal_pyramid(
+                list_bands,
+                resolutions,
+                cache_dir=cache_dir,
+                labels_dir=labels_dir,
+                tile_id=s2_tile_id,
+                workers=workers,
+                overview_budget=overview_budget,
+                ids_only=ids_only,
+                dask_client=client,
+                centroid_ratio=centroid_ratio,
+            )
+        from dggs_tbx.pgload import PostGISLoader
+
+        # Rows are streamed with COPY and merged once per level, indexes are
+        # built after the last level
+        with PostGISLoader(
+            db_connect(),
+            table_name,
+            defer_merge=defer_merge,
+            create_indexes=create_indexes,
+        ) as loader:
+            for level_res, h3_grid in levels:
+                h3_grid = h3_db_frame(h3_grid, level_res, simulate)
+                logger.info("-- Connected to DB, pushing data")
+                loader.load(h3_grid, index=True)
+                logger.info(
+                    f" -- H3 data sent to {table_name} table ({len(h3_grid)} Cells)"
+                )
+    finally:
+        if client is not None:
+            client.close()
+        if not keep_inputs:
+            shutil.rmtree(download_dir, ignore_errors=True)
+
+
+def simulate_h3_grid(
+    raster_path: Path, out_dir: Path, res: int, bands: List, use_dask: bool = False
+) -> gpd.GeoDataFrame:
+    """
+    H3 grid of the raster extent filled with uniformly distributed band values
+    """
     if use_dask:
         logger.info("-- Using H3 library with Dask")
-        h3_grid = dask_h3_from_raster(list_bands[0], out_dir, res, df_ret=True)
+        h3_grid = dask_h3_from_raster(raster_path, out_dir, res, df_ret=True)
     else:
         logger.info("-- Using H3 pandas")
-        h3_grid = h3_from_raster_extent(list_bands[0], out_dir, res, df_ret=True)
-    band_values = {}
-    if simulate:
-        logger.info("-- Simulation is ON, using uniform distribution")
-        for band in bands:
-            h3_grid[band] = np.random.uniform(0, 10000, h3_grid.shape[0]).astype(int)
-    else:
-        # Fill the H3 dataframe
-        for sat_band_path in track(list_bands):
-            band_name = sat_band_path.parts[-1].replace(".tif", "")
-            band_values[band_name] = []
-            with rasterio.open(sat_band_path, "r") as src:
-                shapes = [geom for geom in h3_grid.geometry]
-                for shape in shapes:
-                    try:
-                        out_image, out_transform = rasterio.mask.mask(
-                            src, [shape], True
-                        )
-                        sub_data = int(np.mean(out_image))
-                        band_values[band_name].append(sub_data)
-                    except:
-                        logger.warning("Shape outside raster")
-                        band_values[band_name].append(0)
-        for band_val in band_values:
-            h3_grid[band_val] = band_values[band_val]
-    h3_grid["simulated"] = simulate
-    h3_grid["resolution"] = res
-    # Add grid name
-    h3_grid["grid_name"] = "H3"
-    # add column with the resolution
-    h3_grid = h3_grid.to_crs("EPSG:4326")
-    engine = db_connect()
-    logger.info("-- Connected to DB, pushing data")
-    h3_grid.to_postgis(table_name, engine, if_exists="append", index=True)
-    shutil.rmtree(out_dir)
-    logger.info(f" -- H3 data sent to {table_name} table ({len(h3_grid)} Cells)")
+        h3_grid = h3_from_raster_extent(
+            raster_path, out_dir, res, df_ret=True, crs=WGS84
+        )
+    logger.info("-- Simulation is ON, using uniform distribution")
+    for band in bands:
+        h3_grid[band] = np.random.uniform(0, 10000, h3_grid.shape[0]).astype(int)
+    return h3_grid
 
 
 def dask_h3_from_raster(
@@ -140,63 +515,136 @@ def dask_h3_from_raster(
     df_ret=False,
     dask_partition=4,
 ):
+    """
+    H3 grid of the raster extent, the cell boundaries being computed by Dask
+    partitions
+    :param dask_partition: Number of partitions of the cell ids
+    """
     out_fname = f"{raster_path.stem}_H3_res_{resolution}_ap7.geojson"
     logger.info(f"H3 at resolution {resolution}")
-    with rasterio.open(raster_path, "r") as ds:
-        bounds = ds.bounds
-        extent_geom = box(*bounds)
-        df = gpd.GeoDataFrame({"id": 1, "geometry": [extent_geom]})
-        df.crs = ds.crs
-        df = df.to_crs("EPSG:4326")
-        logger.info(f"-- Getting extent from raster")
-        map_json = df.to_json()
-        map_json = json.loads(map_json)
-        aoi = map_json["features"][0]["geometry"]
-        logger.info(f"-- Start query hexagon ids within area")
-        idx = h3.polyfill(aoi, res=resolution)
-        logger.info(f"-- Done getting H3 hex ids")
-        logger.info(f"-- Adding geometry to H3 hex ids")
-        dest = gpd.GeoDataFrame(columns=["h3id", "geometry"], geometry="geometry")
-        dest["h3id"] = list(idx)
-        ddf = dd.from_pandas(dest, npartitions=dask_partition)
-        ddf_applied = ddf["h3id"].apply(
-            lambda row: Polygon(h3.h3_to_geo_boundary(row)), meta=(dest.columns)
+    logger.info(f"-- Start query hexagon ids within area")
+    idx = [
+        h3.h3_to_string(int(c))
+        for c in h3_polyfill(raster_extent_lonlat(raster_path), resolution)
+    ]
+    logger.info(f"-- Done getting H3 hex ids")
+    logger.info(f"-- Adding geometry to H3 hex ids")
+    import dask.dataframe as dd
+
+    ddf = dd.from_pandas(pd.Series(idx, name="h3id"), npartitions=dask_partition)
+    geometry = ddf.map_partitions(_h3_boundaries, meta=("geometry", object))
+    dest = gpd.GeoDataFrame(
+        {"h3id": idx}, geometry=list(geometry.compute()), crs="EPSG:4326"
+    )
+    logger.info(f"-- Done Adding geometry to H3 hex ids")
+    if df_ret:
+        return dest
+    else:
+        dest.to_file(output_grid / out_fname, driver="GeoJSON")
+        logger.info(f"-- Grid saved to: {output_grid / out_fname}")
+        return output_grid / out_fname
+
+
+def _h3_boundaries(cells: pd.Series) -> pd.Series:
+    # Dask partition task: (lng, lat) boundary polygons of H3 ids
+    return pd.Series(
+        [Polygon(h3.h3_to_geo_boundary(c, geo_json=True)) for c in cells],
+        index=cells.index,
+        name="geometry",
+    )
+
+
+def h3_cloud_index(
+    scl_path: Path, resolution: int, ids_only: bool = False, **kwargs
+) -> pd.DataFrame:
+    """
+    Cloud fraction, valid pixel count and highest SCL class of every H3 cell
+    covering an SCL raster, classified block by block
+    (see h3_zonal_stats for the keyword arguments)
+    :return: GeoDataFrame indexed by H3 id with an h3_id column (EPSG:4326),
+             or DataFrame indexed by uint64 H3 id with ids_only
+    """
+    stats = h3_zonal_stats(
+        [scl_path],
+        resolution,
+        overview_budget=0,
+        value_func=scl_cloud_values,
+        value_nodata=CLOUD_NODATA,
+        **kwargs,
+    )
+    df = cloud_index_frame(stats)
+    df.index = pd.Index(df.index.to_numpy().astype(np.uint64), name="h3_id")
+    if ids_only:
+        return df
+    grid = h3_with_geometry(df)
+    grid.insert(0, "h3_id", df.index.to_numpy())
+    return grid
+
+
+def h3cloudcindex(
+    s2_tile_id: str,
+    date: str,
+    table_name: str,
+    resolution: int,
+    tmp_dir: Path = Path(gettempdir()),
+    out_path: Path = None,
+    workers: int = 1,
+    cache_dir: Path = None,
+    ids_only: bool = False,
+    download_cache: Path = None,
+    download_cache_size: int = DEFAULT_CACHE_SIZE,
+    keep_inputs: bool = False,
+    labels_dir: Path = None,
+    create_indexes: bool = False,
+):
+    # Cloud index of the SCL band of a Sentinel-2 acquisition per H3 cell,
+    # loaded into table_name, or written to out_path (.parquet or .geojson)
+    # when given. SCL windows are classified as they are read, no mask raster
+    # is written. The indexes of table_name are left to pgload.index_table
+    # unless create_indexes is set
+    if ids_only and out_path is not None and out_path.suffix != ".parquet":
+        raise ValueError("Ids-only cloud indexes are written to .parquet only")
+    # Like s2_to_h3, the SCL band is downloaded to a directory of its own
+    download_dir = job_dir(tmp_dir)
+    try:
+        out_dir = down_s2(
+            s2_tile_id,
+            date,
+            download_dir,
+            bands=["SCL"],
+            cache_dir=download_cache,
+            cache_size=download_cache_size,
         )
-        ddf_applied.compute()
-        dest["geometry"] = ddf_applied
-        dest.crs = "EPSG:4326"
-        logger.info(f"-- Done Adding geometry to H3 hex ids")
-        if df_ret:
-            return dest
+        scl_grid = h3_cloud_index(
+            out_dir / "SCL.tif",
+            resolution,
+            ids_only=ids_only,
+            cache_dir=cache_dir,
+            labels_dir=labels_dir,
+            tile_id=s2_tile_id,
+            workers=workers,
+        )
+        scl_grid["resolution"] = resolution
+        if out_path is not None:
+            save_grid(
+                scl_grid.reset_index() if ids_only else scl_grid,
+                out_path,
+                id_column="h3_id",
+            )
         else:
-            dest.to_file(output_grid / out_fname, driver="GeoJSON")
-            logger.info(f"-- Grid saved to: {output_grid / out_fname}")
-            return output_grid / out_fname
-
-def h3cloudcindex(s2_tile_id: str,date: str,table_name: str,resolution: int,tmp_dir = Path(gettempdir())):
-    bands = ["SCL"]
-    out_dir = down_s2(s2_tile_id, date, tmp_dir, bands=bands)
-    scl_path = out_dir/'SCL.tif'
-    raster_fn = scl_path.parent / Path(scl_path.name + "_bin.tif")
-    binary_scl(scl_path, raster_fn)
-    scl_grid = h3_from_raster_extent(raster_fn, out_dir, resolution,df_ret=True)
-    scl_band_val=[]
-    with rasterio.open(scl_path, "r") as src:
-        shapes = [geom for geom in scl_grid.geometry]
-        for shape in shapes:
-            try:
-                out_image, out_transform = rasterio.mask.mask(
-                    src, [shape], True
-                )
-                sub_data = int(np.max(out_image))
-                scl_band_val.append(sub_data)
-            except:
-                logger.warning("Shape outside raster")
-                scl_band_val.append(0)
-    scl_grid["cloudy"]=scl_band_val
-    # This is WIP
-
+            from dggs_tbx.pgload import PostGISLoader
 
+            with PostGISLoader(
+                db_connect(), table_name, create_indexes=create_indexes
+            ) as loader:
+                loader.load(scl_grid, index=True)
+            logger.info(
+                f" -- H3 cloud index sent to {table_name} ({len(scl_grid)} Cells)"
+            )
+    finally:
+        if not keep_inputs:
+            shutil.rmtree(download_dir, ignore_errors=True)
+    return scl_grid
 
 
 if __name__ == "__main__":
@@ -0,0 +1,174 @@
+# Copyright (C) 2024-2025 CS GROUP, https://cs-soprasteria.com
+#
+# This file is part of DGGS Toolbox:
+#
+#     https://github.com/CS-SI/dggs_tbx
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+#
+# DGGS Toolbox is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# DGGS Toolbox is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with DGGS Toolbox. If not, see
+# https://www.gnu.org/licenses/.
+
+
+"""
+Per-pixel DGGS cell labels, memory-mapped from disk.
+
+The cell containing every pixel centre of a raster grid only depends on the
+grid and the DGGS resolution, not on the acquisition date. It is computed
+once and stored as a (height, width) array of 64-bit cell ids in a .npy file
+with a JSON sidecar holding the raster transform and CRS. Aggregations read
+the labels of each window straight from the memory map, so the processes of
+a node share one copy of the labels in the page cache.
+"""
+
+import json
+import logging
+import os
+from pathlib import Path
+
+import numpy as np
+import rasterio
+from affine import Affine
+from rasterio.crs import CRS
+from rasterio.windows import Window
+
+from dggs_tbx.cellmap import cell_map_path
+from dggs_tbx.zonal import CellFunc, window_lonlat
+
+logger = logging.getLogger(__name__)
+
+
+class CellLabels:
+    """
+    Memory-mapped cell id of every pixel of a raster grid. Only the path is
+    pickled, processes map the file themselves.
+    :param path: .npy file of the labels, next to its .json metadata
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        meta = json.loads(self.path.with_suffix(".json").read_text())
+        self.transform = Affine(*meta["transform"])
+        self.crs = CRS.from_wkt(meta["crs"])
+        self.resolution = meta["resolution"]
+        self._array = None
+
+    def __getstate__(self) -> dict:
+        return {**self.__dict__, "_array": None}
+
+    @property
+    def array(self) -> np.ndarray:
+        """
+        Read-only memory map of the (height, width) labels
+        """
+        if self._array is None:
+            self._array = np.load(self.path, mmap_mode="r")
+        return self._array
+
+    @property
+    def shape(self):
+        return self.array.shape
+
+    def window(self, window: Window) -> np.ndarray:
+        """
+        Labels of a window of the raster grid, a view of the memory map
+        """
+        row_off, col_off = int(window.row_off), int(window.col_off)
+        return self.array[
+            row_off : row_off + int(window.height),
+            col_off : col_off + int(window.width),
+        ]
+
+    def matches(self, src) -> bool:
+        """
+        Whether the labels were computed on the pixel grid of a dataset
+        """
+        return (
+            self.shape == src.shape
+            and self.transform.almost_equals(src.transform)
+            and self.crs == src.crs
+        )
+
+
+def build_labels(
+    raster_path: Path,
+    cell_func: CellFunc,
+    resolution: int,
+    path: Path,
+    chunk_rows: int = 512,
+) -> CellLabels:
+    """
+    Compute and store the cell labels of a raster grid, a 10980x10980
+    Sentinel-2 tile takes about 1 GB
+    :param raster_path: Path to a raster of the grid
+    :param cell_func: Function mapping lon, lat arrays to cell ids
+    :param resolution: DGGS resolution
+    :param path: Output .npy file
+    :param chunk_rows: Number of raster rows labelled at once
+    """
+    path = Path(path)
+    with rasterio.open(raster_path, "r") as src:
+        height, width, transform, crs = src.height, src.width, src.transform, src.crs
+    # Write then rename so that concurrent runs never read a partial file
+    tmp_path = path.with_name(f"{path.stem}.{os.getpid()}.tmp.npy")
+    meta_path = path.with_suffix(".json")
+    tmp_meta_path = meta_path.with_name(f"{meta_path.stem}.{os.getpid()}.tmp.json")
+    array = None
+    for row_off in range(0, height, chunk_rows):
+        window = Window(0, row_off, width, min(chunk_rows, height - row_off))
+        cells = cell_func(*window_lonlat(transform, crs, window), resolution)
+        if array is None:
+            array = np.lib.format.open_memmap(
+                tmp_path, mode="w+", dtype=cells.dtype, shape=(height, width)
+            )
+        array[row_off : row_off + window.height] = cells.reshape(-1, width)
+    array.flush()
+    del array
+    tmp_meta_path.write_text(
+        json.dumps(
+            {
+                "transform": list(transform)[:6],
+                "crs": crs.to_wkt(),
+                "resolution": resolution,
+            }
+        )
+    )
+    os.replace(tmp_meta_path, meta_path)
+    os.replace(tmp_path, path)
+    logger.info(f"-- Built {height}x{width} cell labels at res {resolution}")
+    return CellLabels(path)
+
+
+def cached_labels(
+    cache_dir: Path,
+    raster_path: Path,
+    grid_name: str,
+    cell_func: CellFunc,
+    resolution: int,
+    tile_id: str = "",
+) -> CellLabels:
+    """
+    Open the cell labels of a raster grid from the cache, building and
+    storing them on a cache miss (see cellmap.cell_map_path for the key)
+    """
+    path = cell_map_path(
+        cache_dir, raster_path, grid_name, resolution, tile_id, suffix=".npy"
+    )
+    if path.exists():
+        logger.info(f"-- Using cached cell labels {path}")
+        return CellLabels(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    labels = build_labels(raster_path, cell_func, resolution, path)
+    logger.info(f"-- Cell labels saved to: {path}")
+    return labels
@@ -28,9 +28,10 @@ from tempfile import gettempdir
 import typer
 from rich.logging import RichHandler
 
-from dggs_tbx.h3_tbx import h3_from_raster_extent, s2_to_h3
-from dggs_tbx.rpix_tbx import rpix_from_raster_extent, s2_to_rpix
-from dggs_tbx.utils import binary_scl, rasterval_geojson
+# Only light modules are imported here, the commands import the grids and
+# their dependencies (rasterio, geopandas, dask, boto3...) when they run
+from dggs_tbx.download_cache import DEFAULT_CACHE_SIZE
+from dggs_tbx.profiling import profiled
 
 FORMAT = "%(message)s"
 logging.basicConfig(level=INFO, format=FORMAT, datefmt="[%X]", handlers=[RichHandler()])
@@ -43,35 +44,182 @@ bands_10m = ["B02", "B03", "B04", "B08"]
 
 
 @app.command()
-def raster2h3(raster_path: Path, resolution: int, out_dir: Path):
+@profiled
+def raster2h3(
+    raster_path: Path,
+    resolution: int,
+    out_dir: Path,
+    workers: int = 1,
+    format: str = "geojson",
+    centroid_ratio: float = 4.0,
+):
     """
-    Convert a raster file to H3 in GeoJSON
+    Convert a raster file to H3 in GeoJSON, or Parquet with --format parquet.
+    Cells smaller than --centroid-ratio pixels take the value of the pixel
+    containing their centroid, 0 always masks the raster.
     """
-    df_path = h3_from_raster_extent(raster_path, out_dir, resolution)
-    rasterval_geojson(df_path, raster_path)
+    from dggs_tbx.h3_tbx import h3_grid_batches
+    from dggs_tbx.utils import rasterval_batches, save_grid
+
+    grid_name = f"{raster_path.stem}_H3_res_{resolution}_ap7"
+    # The grid is generated, filled and written batch by batch, over a single
+    # process pool
+    batches = rasterval_batches(
+        h3_grid_batches(raster_path, resolution),
+        raster_path,
+        grid_name,
+        workers=workers,
+        centroid_ratio=centroid_ratio,
+    )
+    save_grid(batches, out_dir / f"{grid_name}_filled.{format}", id_column="h3_id")
 
 
 @app.command()
-def raster2rpix(raster_path: Path, resolution: int, out_dir: Path):
+@profiled
+def raster2rpix(
+    raster_path: Path,
+    resolution: int,
+    out_dir: Path,
+    workers: int = 1,
+    format: str = "geojson",
+    centroid_ratio: float = 4.0,
+):
     """
-    Convert a raster file to rHEALPix in GeoJSON
+    Convert a raster file to rHEALPix in GeoJSON, or Parquet with --format parquet.
+    Cells smaller than --centroid-ratio pixels take the value of the pixel
+    containing their centroid, 0 always masks the raster.
+    Cells are written in id order, sorting the ids of every cell of the raster
+    extent in memory: 8 bytes a cell, about 320 MB at resolution 12 over a
+    Sentinel-2 tile, nine times more at each finer resolution.
     """
-    df_path = rpix_from_raster_extent(raster_path, out_dir, resolution)
-    rasterval_geojson(Path(df_path), raster_path)
+    from dggs_tbx.rpix_tbx import rpix_grid_batches
+    from dggs_tbx.utils import rasterval_batches, save_grid
+
+    grid_name = f"{raster_path.stem}_rpix_res_{resolution}"
+    # The grid is generated, filled and written batch by batch, over a single
+    # process pool
+    batches = rasterval_batches(
+        rpix_grid_batches(raster_path, resolution),
+        raster_path,
+        grid_name,
+        workers=workers,
+        centroid_ratio=centroid_ratio,
+    )
+    save_grid(batches, out_dir / f"{grid_name}_filled.{format}", id_column="rpix_id")
 
 
 @app.command()
-def sclindex(raster_path: Path, resolution: int, out_dir: Path):
+@profiled
+def sclindex(
+    raster_path: Path,
+    resolution: int,
+    out_dir: Path,
+    workers: int = 1,
+    format: str = "geojson",
+    grid: str = "h3",
+    ids_only: bool = False,
+    labels_dir: Path = None,
+):
     """
-    Create an H3 SCL index from a COG
+    Create a cloud index (cloud fraction, valid pixels, max class) per H3 cell,
+    or rHEALPix cell with --grid rpix, from an SCL COG, in GeoJSON or Parquet
+    (--format parquet). With --ids-only, Parquet rows carry no geometry.
+    With --labels-dir DIR, the pixel cell labels are memory-mapped from DIR
+    and reused by the next rasters of the same grid.
     """
-    raster_fn = raster_path.parent / Path(raster_path.name + "_bin.tif")
-    binary_scl(raster_path, raster_fn)
-    df_path = h3_from_raster_extent(raster_fn, out_dir, resolution)
-    rasterval_geojson(df_path, raster_path)
+    from dggs_tbx.utils import save_grid
+
+    if ids_only and format != "parquet":
+        raise typer.BadParameter("--ids-only requires --format parquet")
+    if grid == "h3":
+        from dggs_tbx.h3_tbx import h3_cloud_index
+
+        grid_name = f"{raster_path.stem}_cloud_H3_res_{resolution}_ap7"
+        scl_grid, id_column = h3_cloud_index, "h3_id"
+    elif grid == "rpix":
+        from dggs_tbx.rpix_tbx import rpix_cloud_index
+
+        grid_name = f"{raster_path.stem}_cloud_rpix_res_{resolution}"
+        scl_grid, id_column = rpix_cloud_index, "rpix_id"
+    else:
+        raise typer.BadParameter(f"Unknown grid {grid}, expected h3 or rpix")
+    # SCL windows are classified as they are read, no mask raster is written
+    scl_grid = scl_grid(
+        raster_path,
+        resolution,
+        ids_only=ids_only,
+        workers=workers,
+        labels_dir=labels_dir,
+    )
+    if ids_only:
+        scl_grid = scl_grid.reset_index()
+    save_grid(scl_grid, out_dir / f"{grid_name}.{format}", id_column=id_column)
+
+
+@app.command()
+@profiled
+def cog2cloudh3db(
+    s2_tile_id: str,
+    date: str,
+    res: int = 7,
+    tmp_dir: Path = Path(gettempdir()),
+    table_name: str = "cloud_index",
+    out_path: Path = None,
+    workers: int = 1,
+    cache_dir: Path = None,
+    ids_only: bool = False,
+    download_cache: Path = None,
+    download_cache_size: int = DEFAULT_CACHE_SIZE,
+    keep_inputs: bool = False,
+    labels_dir: Path = None,
+    geometry_view: bool = False,
+) -> None:
+    """
+    Build the H3 cloud index of a Sentinel-2 acquisition from its SCL COG and
+    store it in PostgresSQL db, or in --out-path (.parquet or .geojson).
+    With --labels-dir DIR, the pixel cell labels are memory-mapped from DIR
+    and reused by the next dates of the tile.
+    With --ids-only --geometry-view, the TABLE_NAME_geom view adds the cell
+    geometries, computed by the h3-pg extension of the database.
+    """
+    from dggs_tbx.h3_tbx import h3cloudcindex
+
+    if geometry_view and (not ids_only or out_path is not None):
+        raise typer.BadParameter(
+            "--geometry-view requires --ids-only and no --out-path"
+        )
+
+    h3cloudcindex(
+        s2_tile_id,
+        date,
+        table_name,
+        res,
+        tmp_dir,
+        out_path=out_path,
+        workers=workers,
+        cache_dir=cache_dir,
+        ids_only=ids_only,
+        download_cache=download_cache,
+        download_cache_size=download_cache_size,
+        keep_inputs=keep_inputs,
+        labels_dir=labels_dir,
+    )
+    if out_path is None:
+        from dggs_tbx.pgload import index_table
+        from dggs_tbx.utils import db_connect
+
+        # Indexes are built once the table is loaded
+        engine = db_connect()
+        index_table(engine, table_name)
+        if geometry_view:
+            from dggs_tbx.h3_tbx import H3_GEOMETRY_SQL
+            from dggs_tbx.pgload import create_geometry_view
+
+            create_geometry_view(engine, table_name, H3_GEOMETRY_SQL)
 
 
 @app.command()
+@profiled
 def cog2h3db(
     s2_tile_id: str,
     date: str,
@@ -81,29 +229,217 @@ def cog2h3db(
     use_dask: bool = False,
     table_name: str = "test_table",
     bands=None,
+    cache_dir: Path = None,
+    workers: int = 1,
+    overview_budget: float = 1e-4,
+    res_range: str = None,
+    download_cache: Path = None,
+    download_cache_size: int = DEFAULT_CACHE_SIZE,
+    keep_inputs: bool = False,
+    download_workers: int = 4,
+    aoi: str = None,
+    ids_only: bool = False,
+    scheduler: str = None,
+    labels_dir: Path = None,
+    centroid_ratio: float = 4.0,
+    geometry_view: bool = False,
 ) -> None:
     """
-    Build H3 grid from COG and store in PostgresSQL db
+    Build H3 grid from COG and store in PostgresSQL db.
+    With --res-range MIN:MAX, every resolution of the range is stored.
+    With --download-cache DIR, downloaded bands are reused across runs.
+    With --aoi MIN_LON,MIN_LAT,MAX_LON,MAX_LAT, only the overlapping blocks are read.
+    With --ids-only, 64-bit cell ids are stored without geometry.
+    With --use-dask, bands are aggregated on a LocalCluster of --workers
+    processes, or on the Dask --scheduler address.
+    With --labels-dir DIR, the pixel cell labels are memory-mapped from DIR
+    and reused by the next dates of the tile.
+    Cells smaller than --centroid-ratio pixels are sampled at their centre.
+    With --ids-only --geometry-view, the TABLE_NAME_geom view adds the cell
+    geometries, computed by the h3-pg extension of the database.
     """
+    from dggs_tbx.h3_tbx import H3_GEOMETRY_SQL, s2_to_h3
+    from dggs_tbx.pgload import create_geometry_view, index_table
+    from dggs_tbx.utils import db_connect, parse_bounds
+
+    if geometry_view and not ids_only:
+        raise typer.BadParameter("--geometry-view requires --ids-only")
     if bands is None:
         bands = bands_10m
-    s2_to_h3(s2_tile_id, date, table_name, bands, tmp_dir, res, simulate, use_dask)
+    s2_to_h3(
+        s2_tile_id,
+        date,
+        table_name,
+        bands,
+        tmp_dir,
+        res,
+        simulate,
+        use_dask,
+        cache_dir=cache_dir,
+        workers=workers,
+        overview_budget=overview_budget,
+        res_range=res_range,
+        download_cache=download_cache,
+        download_cache_size=download_cache_size,
+        keep_inputs=keep_inputs,
+        download_workers=download_workers,
+        aoi=parse_bounds(aoi) if aoi else None,
+        ids_only=ids_only,
+        scheduler=scheduler,
+        labels_dir=labels_dir,
+        centroid_ratio=centroid_ratio,
+    )
+    # Indexes are built once every resolution is loaded
+    engine = db_connect()
+    index_table(engine, table_name)
+    if geometry_view:
+        create_geometry_view(engine, table_name, H3_GEOMETRY_SQL)
 
 @app.command()
+@profiled
 def cog2rpixdb(
     s2_tile_id: str,
     date: str,
     tmp_dir: Path = Path(gettempdir()),
     res: int = 7,
     simulate: bool = False,
+    use_dask: bool = False,
+    table_name: str = "test_table",
+    bands=None,
+    cache_dir: Path = None,
+    workers: int = 1,
+    overview_budget: float = 1e-4,
+    res_range: str = None,
+    download_cache: Path = None,
+    download_cache_size: int = DEFAULT_CACHE_SIZE,
+    keep_inputs: bool = False,
+    download_workers: int = 4,
+    aoi: str = None,
+    ids_only: bool = False,
+    scheduler: str = None,
+    labels_dir: Path = None,
+    centroid_ratio: float = 4.0,
+) -> None:
+    """
+    Build rHEALPIx grid from COG and store in PostgresSQL db.
+    With --res-range MIN:MAX, every resolution of the range is stored.
+    With --download-cache DIR, downloaded bands are reused across runs.
+    With --aoi MIN_LON,MIN_LAT,MAX_LON,MAX_LAT, only the overlapping blocks are read.
+    With --ids-only, 64-bit cell ids are stored without geometry.
+    With --use-dask, bands are aggregated on a LocalCluster of --workers
+    processes, or on the Dask --scheduler address.
+    With --labels-dir DIR, the pixel cell labels are memory-mapped from DIR
+    and reused by the next dates of the tile.
+    Cells smaller than --centroid-ratio pixels are sampled at their centre.
+    """
+    from dggs_tbx.rpix_tbx import s2_to_rpix
+    from dggs_tbx.pgload import index_table
+    from dggs_tbx.utils import db_connect, parse_bounds
+
+    if bands is None:
+        bands = bands_10m
+    s2_to_rpix(
+        s2_tile_id,
+        date,
+        table_name,
+        bands,
+        tmp_dir,
+        res,
+        simulate,
+        use_dask,
+        cache_dir=cache_dir,
+        workers=workers,
+        overview_budget=overview_budget,
+        res_range=res_range,
+        download_cache=download_cache,
+        download_cache_size=download_cache_size,
+        keep_inputs=keep_inputs,
+        download_workers=download_workers,
+        aoi=parse_bounds(aoi) if aoi else None,
+        ids_only=ids_only,
+        scheduler=scheduler,
+        labels_dir=labels_dir,
+        centroid_ratio=centroid_ratio,
+    )
+    # Indexes are built once every resolution is loaded
+    index_table(db_connect(), table_name)
+
+
+@app.command()
+@profiled
+def batch(
+    jobs_path: Path,
+    manifest: Path = Path("dggs_batch.sqlite"),
     table_name: str = "test_table",
+    workers: int = 2,
+    tmp_dir: Path = Path(gettempdir()),
     bands=None,
+    cache_dir: Path = None,
+    overview_budget: float = 1e-4,
+    download_cache: Path = None,
+    download_cache_size: int = DEFAULT_CACHE_SIZE,
+    download_workers: int = 4,
+    ids_only: bool = False,
+    pipeline: bool = False,
+    download_slots: int = 2,
+    queue_size: int = 1,
+    labels_dir: Path = None,
+    centroid_ratio: float = 4.0,
 ) -> None:
     """
-        Build rHEALPIx grid from COG and store in PostgresSQL db
+    Run a list of jobs (tile, date, grid, resolution per line, grid being h3 or
+    rpix) on --workers processes, storing every grid in TABLE_NAME_{grid}.
+    Finished jobs are recorded in the --manifest SQLite file and skipped when
+    the batch is run again.
+    With --pipeline, downloads, aggregations and DB loads of successive jobs
+    overlap, with at most --queue-size jobs waiting between stages.
+    With --labels-dir DIR, the pixel cell labels of every tile, grid and
+    resolution are memory-mapped from DIR and shared by the workers.
+    Cells smaller than --centroid-ratio pixels are sampled at their centre.
     """
+    from dggs_tbx.batch import read_jobs, run_batch
+
     if bands is None:
         bands = bands_10m
-    s2_to_rpix(s2_tile_id,date,table_name,bands,tmp_dir,res,simulate)
+    jobs = read_jobs(jobs_path)
+    zonal_kwargs = dict(
+        cache_dir=cache_dir,
+        overview_budget=overview_budget,
+        ids_only=ids_only,
+        labels_dir=labels_dir,
+        centroid_ratio=centroid_ratio,
+    )
+    download_kwargs = dict(
+        tmp_dir=tmp_dir,
+        download_cache=download_cache,
+        download_cache_size=download_cache_size,
+        download_workers=download_workers,
+    )
+    if pipeline:
+        from dggs_tbx.pipeline import pipeline_batch
+
+        pipeline_batch(
+            jobs,
+            table_name,
+            manifest_path=manifest,
+            bands=bands,
+            download_slots=download_slots,
+            workers=workers,
+            queue_size=queue_size,
+            **download_kwargs,
+            **zonal_kwargs,
+        )
+    else:
+        run_batch(
+            jobs,
+            manifest,
+            table_name,
+            workers=workers,
+            bands=bands,
+            **download_kwargs,
+            **zonal_kwargs,
+        )
+
+
 if __name__ == "__main__":
     app()
@@ -0,0 +1,381 @@
+# Copyright (C) 2024-2025 CS GROUP, https://cs-soprasteria.com
+#
+# This file is part of DGGS Toolbox:
+#
+#     https://github.com/CS-SI/dggs_tbx
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+#
+# DGGS Toolbox is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# DGGS Toolbox is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with DGGS Toolbox. If not, see
+# https://www.gnu.org/licenses/.
+
+"""
+Bulk loading of DGGS frames into PostGIS with COPY.
+
+Rows are streamed with COPY ... FROM STDIN (FORMAT binary) into an unlogged
+staging table, geometries travel as WKB bytea, and the staging rows are
+merged into the target table with a single INSERT ... SELECT that builds the
+geometries server-side.
+"""
+
+import io
+import logging
+import struct
+import uuid
+from typing import List, Tuple
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+from sqlalchemy import inspect, text
+
+from dggs_tbx import profiling
+
+logger = logging.getLogger(__name__)
+
+COPY_HEADER = b"PGCOPY\n\377\r\n\0" + struct.pack(">ii", 0, 0)
+COPY_TRAILER = struct.pack(">h", -1)
+
+# numpy kind/itemsize to (PostgreSQL type, big-endian numpy type)
+FIXED_TYPES = {
+    ("b", 1): ("boolean", ">u1"),
+    ("i", 1): ("smallint", ">i2"),
+    ("i", 2): ("smallint", ">i2"),
+    ("u", 1): ("smallint", ">i2"),
+    ("i", 4): ("integer", ">i4"),
+    ("u", 2): ("integer", ">i4"),
+    ("i", 8): ("bigint", ">i8"),
+    ("u", 4): ("bigint", ">i8"),
+    # H3 ids and packed rHEALPix ids fit in 63 bits
+    ("u", 8): ("bigint", ">i8"),
+    ("f", 4): ("real", ">f4"),
+    ("f", 8): ("double precision", ">f8"),
+}
+
+
+def quote(name: str) -> str:
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def frame_columns(df: pd.DataFrame, index: bool = True) -> pd.DataFrame:
+    """
+    Plain DataFrame of the columns to load, the index becomes a column (named
+    "index" when unnamed, as with to_postgis) and geometries become WKB
+    """
+    geom_col = df.geometry.name if isinstance(df, gpd.GeoDataFrame) else None
+    df = pd.DataFrame(df.reset_index() if index else df)
+    if geom_col is not None:
+        df[geom_col] = shapely.to_wkb(np.asarray(df[geom_col].values))
+    return df
+
+
+def column_types(
+    df: pd.DataFrame, geometry_columns: Tuple[str, ...] = ()
+) -> List[Tuple[str, str]]:
+    """
+    PostgreSQL type of every column of a frame, geometry columns are bytea
+    """
+    types = []
+    for name, dtype in df.dtypes.items():
+        key = (dtype.kind, getattr(dtype, "itemsize", 0))
+        if name in geometry_columns:
+            types.append((name, "bytea"))
+        elif key in FIXED_TYPES and not pd.api.types.is_extension_array_dtype(dtype):
+            types.append((name, FIXED_TYPES[key][0]))
+        else:
+            types.append((name, "text"))
+    return types
+
+
+def _fixed_fields(values: np.ndarray, pg_dtype: str) -> np.ndarray:
+    """
+    (rows, 4 + size) uint8 array of length-prefixed binary COPY fields
+    """
+    size = np.dtype(pg_dtype).itemsize
+    fields = np.empty(len(values), dtype=[("len", ">i4"), ("value", pg_dtype)])
+    fields["len"] = size
+    fields["value"] = values.view(np.int64) if values.dtype == np.uint64 else values
+    return fields.view(np.uint8).reshape(len(values), 4 + size)
+
+
+def _variable_fields(values) -> List[bytes]:
+    fields = []
+    for value in values:
+        if value is None or value is pd.NA or value != value:
+            # NULL
+            fields.append(struct.pack(">i", -1))
+            continue
+        if not isinstance(value, bytes):
+            value = str(value).encode()
+        fields.append(struct.pack(">i", len(value)) + value)
+    return fields
+
+
+def encode_copy(df: pd.DataFrame, types: List[Tuple[str, str]]) -> bytes:
+    """
+    Encode a frame to the PostgreSQL binary COPY format. Runs of fixed-width
+    columns are encoded with numpy, text and bytea columns value by value.
+    """
+    n_rows = len(df)
+    field_counts = np.full(n_rows, len(types), dtype=">i2")
+    run = [field_counts.view(np.uint8).reshape(n_rows, 2)]
+    segments = []
+    for name, pg_type in types:
+        if pg_type in ("bytea", "text"):
+            if run:
+                segments.append(np.hstack(run))
+                run = []
+            segments.append(_variable_fields(df[name].values))
+        else:
+            dtype = df[name].dtype
+            pg_dtype = FIXED_TYPES[dtype.kind, dtype.itemsize][1]
+            run.append(_fixed_fields(df[name].to_numpy(), pg_dtype))
+    if run:
+        segments.append(np.hstack(run))
+    if len(segments) == 1:
+        rows = segments[0].tobytes()
+    else:
+        columns = [
+            (
+                [row.tobytes() for row in segment]
+                if isinstance(segment, np.ndarray)
+                else segment
+            )
+            for segment in segments
+        ]
+        rows = b"".join(b"".join(row) for row in zip(*columns))
+    return COPY_HEADER + rows + COPY_TRAILER
+
+
+class PostGISLoader:
+    """
+    Bulk loader of frames into a PostGIS table through a staging table
+    :param engine: SQLAlchemy engine, shared across tiles to reuse its pool
+    :param table_name: Target table, created on the first load if missing
+    :param defer_merge: Keep the rows in the staging table until finish(),
+                        geometries are then built in a single statement
+    :param create_indexes: Build a GiST index on the geometry and a btree
+                           index on the frame index once the load finishes,
+                           see index_table to build them after a batch of
+                           loads instead
+    :param srid: SRID of the geometries
+    """
+
+    def __init__(
+        self,
+        engine,
+        table_name: str,
+        defer_merge: bool = False,
+        create_indexes: bool = True,
+        srid: int = 4326,
+    ):
+        self.engine = engine
+        self.table_name = table_name
+        # Unique across the processes and hosts loading the same table
+        self.staging_name = f"{table_name}_staging_{uuid.uuid4().hex[:12]}"
+        self.defer_merge = defer_merge
+        self.create_indexes = create_indexes
+        self.srid = srid
+        self.types = None
+        self.geometry_column = None
+        self.index_columns = []
+        self.rows = 0
+
+    def __enter__(self) -> "PostGISLoader":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.finish()
+        else:
+            self._drop_staging()
+
+    @profiling.staged("load")
+    def load(self, df: pd.DataFrame, index: bool = True) -> None:
+        """
+        Stream the rows of a frame to the staging table with a binary COPY
+        """
+        if isinstance(df, gpd.GeoDataFrame):
+            if df.crs is not None:
+                with profiling.stage("reprojection"):
+                    df = df.to_crs(epsg=self.srid)
+            geometry_column = df.geometry.name
+        else:
+            geometry_column = None
+        columns = frame_columns(df, index)
+        types = column_types(columns, (geometry_column,))
+        if self.types is None:
+            self.types = types
+            self.geometry_column = geometry_column
+            self.index_columns = (
+                list(columns.columns[: df.index.nlevels]) if index else []
+            )
+            self._create_tables()
+        elif [name for name, _ in types] != [name for name, _ in self.types]:
+            raise ValueError(
+                f"Columns {list(columns.columns)} differ from the first load "
+                f"into {self.table_name}"
+            )
+        names = ", ".join(quote(name) for name, _ in self.types)
+        raw = self.engine.raw_connection()
+        try:
+            with raw.cursor() as cursor:
+                cursor.copy_expert(
+                    f"COPY {quote(self.staging_name)} ({names}) "
+                    "FROM STDIN (FORMAT binary)",
+                    io.BytesIO(encode_copy(columns, self.types)),
+                )
+            raw.commit()
+        finally:
+            raw.close()
+        self.rows += len(columns)
+        profiling.count(rows=len(columns))
+        logger.info(f" -- Copied {len(columns)} rows to {self.staging_name}")
+        if not self.defer_merge:
+            self.merge()
+
+    @profiling.staged("load")
+    def merge(self) -> None:
+        """
+        Move the staging rows to the target table, building the geometries
+        """
+        if self.types is None:
+            return
+        names = ", ".join(quote(name) for name, _ in self.types)
+        values = ", ".join(
+            (
+                f"ST_SetSRID(ST_GeomFromWKB({quote(name)}), {self.srid})"
+                if name == self.geometry_column
+                else quote(name)
+            )
+            for name, _ in self.types
+        )
+        with self.engine.begin() as conn:
+            conn.execute(
+                text(
+                    f"INSERT INTO {quote(self.table_name)} ({names}) "
+                    f"SELECT {values} FROM {quote(self.staging_name)}"
+                )
+            )
+            conn.execute(text(f"TRUNCATE {quote(self.staging_name)}"))
+
+    @profiling.staged("load")
+    def finish(self) -> None:
+        """
+        Merge the remaining rows, drop the staging table and build indexes
+        """
+        if self.types is None:
+            return
+        self.merge()
+        self._drop_staging()
+        if self.create_indexes:
+            with self.engine.begin() as conn:
+                _create_indexes(
+                    conn, self.table_name, self.geometry_column, self.index_columns
+                )
+        logger.info(f" -- Loaded {self.rows} rows into {self.table_name}")
+
+    def _create_tables(self) -> None:
+        target = ", ".join(
+            (
+                f"{quote(name)} geometry(Geometry, {self.srid})"
+                if name == self.geometry_column
+                else f"{quote(name)} {pg_type}"
+            )
+            for name, pg_type in self.types
+        )
+        staging = ", ".join(f"{quote(name)} {pg_type}" for name, pg_type in self.types)
+        with self.engine.begin() as conn:
+            if not inspect(conn).has_table(self.table_name):
+                # Concurrent loaders (see dggs_tbx.batch) may race to create it
+                conn.execute(
+                    text(
+                        f"CREATE TABLE IF NOT EXISTS {quote(self.table_name)} "
+                        f"({target})"
+                    )
+                )
+            conn.execute(text(f"DROP TABLE IF EXISTS {quote(self.staging_name)}"))
+            conn.execute(
+                text(f"CREATE UNLOGGED TABLE {quote(self.staging_name)} ({staging})")
+            )
+
+    def _drop_staging(self) -> None:
+        if self.types is None:
+            return
+        with self.engine.begin() as conn:
+            conn.execute(text(f"DROP TABLE IF EXISTS {quote(self.staging_name)}"))
+
+
+def _create_indexes(
+    conn, table_name: str, geometry_column: str, index_columns: List[str]
+) -> None:
+    table = quote(table_name)
+    if geometry_column is not None:
+        conn.execute(
+            text(
+                "CREATE INDEX IF NOT EXISTS "
+                f"{quote(f'{table_name}_{geometry_column}_idx')} "
+                f"ON {table} USING GIST ({quote(geometry_column)})"
+            )
+        )
+    if index_columns:
+        conn.execute(
+            text(
+                "CREATE INDEX IF NOT EXISTS "
+                f"{quote(f'{table_name}_index_idx')} ON {table} "
+                f"({', '.join(quote(name) for name in index_columns)})"
+            )
+        )
+    conn.execute(text(f"ANALYZE {table}"))
+
+
+def index_table(engine, table_name: str) -> None:
+    """
+    Build the indexes of a table loaded with create_indexes=False and update
+    its statistics, once after a batch of loads rather than after every one:
+    a GiST index on its PostGIS geometry column, if any, and a btree index on
+    its first column, the frame index written by PostGISLoader
+    """
+    with engine.begin() as conn:
+        geometry_column = conn.execute(
+            text(
+                "SELECT f_geometry_column FROM geometry_columns "
+                "WHERE f_table_schema = current_schema() AND f_table_name = :name"
+            ),
+            {"name": table_name},
+        ).scalar()
+        columns = inspect(conn).get_columns(table_name)
+        _create_indexes(conn, table_name, geometry_column, [columns[0]["name"]])
+    logger.info(f" -- Indexed and analyzed {table_name}")
+
+
+def create_geometry_view(
+    engine, table_name: str, geometry_sql: str, view_name: str = None
+) -> str:
+    """
+    View of an ids-only table with the cell geometries computed at query time
+    :param geometry_sql: SQL expression of the geometry from the id column,
+                         e.g. H3_GEOMETRY_SQL with the h3-pg extension
+    :param view_name: Name of the view, {table_name}_geom by default
+    """
+    view_name = view_name or f"{table_name}_geom"
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                f"CREATE OR REPLACE VIEW {quote(view_name)} AS SELECT *, "
+                f"{geometry_sql} AS geometry FROM {quote(table_name)}"
+            )
+        )
+    return view_name
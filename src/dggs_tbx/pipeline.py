@@ -0,0 +1,237 @@
+# Copyright (C) 2024-2025 CS GROUP, https://cs-soprasteria.com
+#
+# This file is part of DGGS Toolbox:
+#
+#     https://github.com/CS-SI/dggs_tbx
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+#
+# DGGS Toolbox is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# DGGS Toolbox is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with DGGS Toolbox. If not, see
+# https://www.gnu.org/licenses/.
+
+
+"""
+Pipelined conversion of Sentinel-2 acquisitions.
+
+Downloads, aggregations and DB loads of successive jobs run concurrently,
+driven by an asyncio event loop: acquisition N+1 downloads while N is
+aggregated and N-1 is loaded. Stages are connected by bounded queues, a full
+queue pauses the stage feeding it, so at most a fixed number of downloaded
+products (disk) and aggregated grids (memory) exist at any time.
+"""
+
+import asyncio
+import logging
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from pathlib import Path
+from tempfile import gettempdir
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import pandas as pd
+
+from dggs_tbx import profiling
+from dggs_tbx.batch import Job, JobManifest, index_tables, job_table
+from dggs_tbx.download_cache import DEFAULT_CACHE_SIZE
+from dggs_tbx.h3_tbx import h3_db_frame, h3_zonal_pyramid
+from dggs_tbx.pgload import PostGISLoader
+from dggs_tbx.rpix_tbx import rpix_db_frame, rpix_zonal_pyramid
+from dggs_tbx.utils import db_connect, down_s2, job_dir, parse_res_range
+
+logger = logging.getLogger(__name__)
+
+PYRAMIDS = {
+    "h3": (h3_zonal_pyramid, h3_db_frame),
+    "rpix": (rpix_zonal_pyramid, rpix_db_frame),
+}
+
+Levels = List[Tuple[int, pd.DataFrame]]
+
+
+def job_resolutions(job: Job) -> List[int]:
+    if ":" in job.resolution:
+        return parse_res_range(job.resolution)
+    return [int(job.resolution)]
+
+
+def aggregate_job(job: Job, list_bands: List[Path], **kwargs) -> Levels:
+    """
+    Every level of the DB tables of a job, see h3_zonal_pyramid and
+    rpix_zonal_pyramid for the keyword arguments
+    """
+    pyramid, db_frame = PYRAMIDS[job.grid]
+    return [
+        (resolution, db_frame(grid, resolution))
+        for resolution, grid in pyramid(
+            list_bands, job_resolutions(job), tile_id=job.tile, **kwargs
+        )
+    ]
+
+
+def load_levels(job: Job, table_name: str, levels: Levels) -> None:
+    """
+    Load the levels of a job into {table_name}_{grid} in a single statement,
+    the table is indexed at the end of the pipeline
+    """
+    with PostGISLoader(
+        db_connect(),
+        job_table(job, table_name),
+        defer_merge=True,
+        create_indexes=False,
+    ) as loader:
+        for _, grid in levels:
+            loader.load(grid, index=True)
+
+
+async def run_pipeline(
+    jobs: List[Job],
+    table_name: str,
+    manifest_path: Path = None,
+    bands: List[str] = ("B02", "B03", "B04", "B08"),
+    tmp_dir: Path = Path(gettempdir()),
+    download_slots: int = 2,
+    workers: int = 2,
+    queue_size: int = 1,
+    download_cache: Path = None,
+    download_cache_size: int = DEFAULT_CACHE_SIZE,
+    download_workers: int = 4,
+    keep_inputs: bool = False,
+    loader: Callable[[Job, str, Levels], None] = load_levels,
+    indexer: Optional[Callable[[Iterable[str]], None]] = index_tables,
+    **kwargs,
+) -> Dict[str, int]:
+    """
+    Run jobs through the download, aggregation and load stages concurrently
+    :param jobs: Jobs to run, see dggs_tbx.batch.read_jobs
+    :param table_name: Prefix of the tables, one per grid
+    :param manifest_path: SQLite manifest of the jobs done, see
+                          dggs_tbx.batch.JobManifest, no resume if None
+    :param download_slots: Number of acquisitions downloaded at once
+    :param workers: Number of processes aggregating acquisitions
+    :param queue_size: Capacity of the queues between stages, in jobs
+    :param loader: Function loading the levels of a job, load_levels by
+                   default, run on a thread of its own
+    :param indexer: Function indexing the tables of the jobs done once the
+                    pipeline is over, see dggs_tbx.batch.run_batch
+    :param kwargs: Other arguments of the zonal pyramids (cache_dir,
+                   labels_dir, overview_budget, ids_only, centroid_ratio)
+    :return: Number of jobs of the manifest per status
+    """
+    manifest = JobManifest(manifest_path or ":memory:")
+    todo = asyncio.Queue()
+    for job in manifest.pending(jobs):
+        todo.put_nowait(job)
+    downloaded = asyncio.Queue(maxsize=queue_size)
+    aggregated = asyncio.Queue(maxsize=queue_size)
+    loop = asyncio.get_running_loop()
+
+    def failed(job: Job, stage: str, error: Exception) -> None:
+        logger.error(f"-- {stage} of {job} failed: {error!r}")
+        manifest.record(job, "failed", error=f"{stage}: {error!r}")
+
+    def remove_inputs(download_dir: Path) -> None:
+        if not keep_inputs:
+            shutil.rmtree(download_dir, ignore_errors=True)
+
+    async def download_stage() -> None:
+        while not todo.empty():
+            job = todo.get_nowait()
+            # Jobs on the same product may be downloaded and aggregated at
+            # once, each one has a directory of its own
+            download_dir = job_dir(tmp_dir)
+            try:
+                out_dir = await asyncio.to_thread(
+                    down_s2,
+                    job.tile,
+                    job.date,
+                    download_dir,
+                    bands=list(bands),
+                    cache_dir=download_cache,
+                    cache_size=download_cache_size,
+                    max_workers=download_workers,
+                )
+            except Exception as e:
+                failed(job, "Download", e)
+                remove_inputs(download_dir)
+                continue
+            # Waits while the aggregation stage is behind
+            await downloaded.put((job, download_dir, out_dir))
+
+    async def aggregate_stage(pool: ProcessPoolExecutor) -> None:
+        while True:
+            item = await downloaded.get()
+            if item is None:
+                return
+            job, download_dir, out_dir = item
+            try:
+                list_bands = sorted(out_dir.glob("*.tif"))
+                levels = profiling.merged(
+                    await loop.run_in_executor(
+                        pool,
+                        partial(
+                            profiling.remote(aggregate_job), job, list_bands, **kwargs
+                        ),
+                    )
+                )
+            except Exception as e:
+                failed(job, "Aggregation", e)
+                continue
+            finally:
+                remove_inputs(download_dir)
+            await aggregated.put((job, levels))
+
+    async def load_stage() -> None:
+        # A single loader, jobs reach their table one merge at a time
+        while True:
+            item = await aggregated.get()
+            if item is None:
+                return
+            job, levels = item
+            try:
+                await asyncio.to_thread(loader, job, table_name, levels)
+            except Exception as e:
+                failed(job, "Load", e)
+                continue
+            manifest.record(job, "done")
+            logger.info(f"-- {job} loaded ({sum(len(g) for _, g in levels)} cells)")
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            aggregators = [
+                asyncio.create_task(aggregate_stage(pool)) for _ in range(workers)
+            ]
+            load_task = asyncio.create_task(load_stage())
+            await asyncio.gather(*(download_stage() for _ in range(download_slots)))
+            for _ in aggregators:
+                await downloaded.put(None)
+            await asyncio.gather(*aggregators)
+            await aggregated.put(None)
+            await load_task
+        done = manifest.done()
+        tables = {job_table(job, table_name) for job in jobs if job in done}
+        if indexer is not None and tables:
+            await asyncio.to_thread(indexer, tables)
+        counts = manifest.counts()
+    finally:
+        manifest.close()
+    logger.info(f"-- Pipeline finished: {counts}")
+    return counts
+
+
+def pipeline_batch(jobs: List[Job], table_name: str, **kwargs) -> Dict[str, int]:
+    """
+    Run a pipeline to completion, see run_pipeline
+    """
+    return asyncio.run(run_pipeline(jobs, table_name, **kwargs))
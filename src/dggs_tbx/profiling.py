@@ -0,0 +1,388 @@
+# Copyright (C) 2024-2025 CS GROUP, https://cs-soprasteria.com
+#
+# This file is part of DGGS Toolbox:
+#
+#     https://github.com/CS-SI/dggs_tbx
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+#
+# DGGS Toolbox is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# DGGS Toolbox is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with DGGS Toolbox. If not, see
+# https://www.gnu.org/licenses/.
+
+
+"""
+Per-stage instrumentation of the commands.
+
+Library code marks its stages (download, grid, reprojection, aggregation,
+load) with stage() and reports what it processed with count(). Both are no-ops
+until a Profiler is activated, e.g. by the --profile option of the commands,
+which then writes a JSON report with a fixed schema:
+
+    {
+      "schema_version": 1,
+      "command": "cog2h3db",
+      "started": "2024-05-02T10:00:00+00:00",
+      "wall_seconds": 0.0, "cpu_seconds": 0.0, "peak_rss_bytes": 0,
+      "stages": [
+        {"name": "download", "calls": 0, "wall_seconds": 0.0,
+         "cpu_seconds": 0.0, "peak_rss_bytes": 0, "s3_bytes": 0,
+         "disk_bytes": 0, "pixels": 0, "cells": 0, "rows": 0},
+        ...
+      ],
+      "hot_stage": null, "hot_stage_profile": null
+    }
+
+Every stage of STAGES is listed, in that order, even when it did not run.
+Times are inclusive: a stage running inside another one (e.g. reprojection
+within grid) counts in both. CPU times include the child processes that
+ended during the stage, peak_rss_bytes is the peak RSS of the main process
+at the end of the stage. disk_bytes counts the pixel bytes read from local
+rasters.
+
+Active stages are tracked per thread (per asyncio task), the counters of a
+thread go to its own stages. Functions submitted to process pools through
+remote() profile their stages in the worker and send them back with their
+result, merged() adds them to the report: the wall times of concurrent
+workers add up and can exceed the wall time of the command.
+"""
+
+import contextvars
+import cProfile
+import functools
+import inspect
+import json
+import logging
+import platform
+import resource
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_VERSION = 1
+STAGES = ("download", "grid", "reprojection", "aggregation", "load")
+COUNTERS = ("s3_bytes", "disk_bytes", "pixels", "cells", "rows")
+
+_profiler = None
+_END = object()
+# Stages open in the current thread or asyncio task, innermost last
+_active_stages = contextvars.ContextVar("active_stages", default=())
+
+
+def peak_rss_bytes() -> int:
+    # ru_maxrss is in kilobytes on Linux, bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if platform.system() == "Darwin" else maxrss * 1024
+
+
+def cpu_seconds() -> float:
+    """
+    CPU time of the process and of its terminated children
+    """
+    times = [
+        resource.getrusage(who)
+        for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN)
+    ]
+    return sum(usage.ru_utime + usage.ru_stime for usage in times)
+
+
+class Profiler:
+    """
+    Accumulate wall time, CPU time, peak RSS and counters per stage
+    :param command: Name of the profiled command
+    :param hot_stage: Stage run under cProfile, or pyinstrument when installed
+                      and profiler is "pyinstrument"
+    :param profiler: cprofile or pyinstrument
+    """
+
+    def __init__(
+        self,
+        command: str,
+        hot_stage: Optional[str] = None,
+        profiler: str = "cprofile",
+    ):
+        self.command = command
+        self.hot_stage = hot_stage
+        self.profiler = profiler
+        self.stages = {name: self._empty_stage(name) for name in STAGES}
+        self.lock = threading.Lock()
+        self.started = datetime.now(timezone.utc)
+        self.wall_start = time.perf_counter()
+        self.cpu_start = cpu_seconds()
+        self.hot_profile = None
+        self.hot_running = False
+
+    @staticmethod
+    def _empty_stage(name: str) -> Dict:
+        stage = {
+            "name": name,
+            "calls": 0,
+            "wall_seconds": 0.0,
+            "cpu_seconds": 0.0,
+            "peak_rss_bytes": 0,
+        }
+        stage.update({counter: 0 for counter in COUNTERS})
+        return stage
+
+    @contextmanager
+    def stage(self, name: str):
+        with self.lock:
+            record = self.stages.setdefault(name, self._empty_stage(name))
+        active = _active_stages.get()
+        if any(enclosing is record for enclosing in active):
+            # Already timed by the enclosing call of the same stage
+            yield record
+            return
+        _active_stages.set(active + (record,))
+        hot = name == self.hot_stage and not self.hot_running
+        if hot:
+            self._start_hot_profile()
+        wall, cpu = time.perf_counter(), cpu_seconds()
+        try:
+            yield record
+        finally:
+            if hot:
+                self._stop_hot_profile()
+            with self.lock:
+                record["calls"] += 1
+                record["wall_seconds"] += time.perf_counter() - wall
+                record["cpu_seconds"] += cpu_seconds() - cpu
+                record["peak_rss_bytes"] = max(
+                    record["peak_rss_bytes"], peak_rss_bytes()
+                )
+            _active_stages.set(active)
+
+    def count(self, **counters: int) -> None:
+        """
+        Add to the counters of the stages active in the calling thread
+        """
+        with self.lock:
+            for record in _active_stages.get():
+                for counter, value in counters.items():
+                    record[counter] += int(value)
+
+    def merge(self, stages: List[Dict]) -> None:
+        """
+        Add the stages of another profiler, e.g. of a worker process
+        """
+        with self.lock:
+            for other in stages:
+                record = self.stages.setdefault(
+                    other["name"], self._empty_stage(other["name"])
+                )
+                for key in ("calls", "wall_seconds", "cpu_seconds", *COUNTERS):
+                    record[key] += other[key]
+                record["peak_rss_bytes"] = max(
+                    record["peak_rss_bytes"], other["peak_rss_bytes"]
+                )
+
+    def _start_hot_profile(self) -> None:
+        # Every call of the hot stage is added to the same profile
+        if self.profiler == "pyinstrument":
+            from pyinstrument import Profiler as Pyinstrument
+
+            self.hot_profile = self.hot_profile or Pyinstrument()
+            self.hot_profile.start()
+        else:
+            self.hot_profile = self.hot_profile or cProfile.Profile()
+            self.hot_profile.enable()
+        self.hot_running = True
+
+    def _stop_hot_profile(self) -> None:
+        if self.profiler == "pyinstrument":
+            self.hot_profile.stop()
+        else:
+            self.hot_profile.disable()
+        self.hot_running = False
+
+    def report(self) -> Dict:
+        return {
+            "schema_version": SCHEMA_VERSION,
+            "command": self.command,
+            "started": self.started.isoformat(timespec="seconds"),
+            "wall_seconds": time.perf_counter() - self.wall_start,
+            "cpu_seconds": cpu_seconds() - self.cpu_start,
+            "peak_rss_bytes": peak_rss_bytes(),
+            "stages": list(self.stages.values()),
+            "hot_stage": self.hot_stage,
+            "hot_stage_profile": None,
+        }
+
+    def write(self, report_path: Path) -> Dict:
+        """
+        Write the JSON report, and the profile of the hot stage next to it
+        (.prof for cProfile, .html for pyinstrument)
+        """
+        report = self.report()
+        if self.hot_profile is not None:
+            if self.profiler == "pyinstrument":
+                profile_path = report_path.with_suffix(".html")
+                profile_path.write_text(self.hot_profile.output_html())
+            else:
+                profile_path = report_path.with_suffix(".prof")
+                self.hot_profile.dump_stats(profile_path)
+            report["hot_stage_profile"] = str(profile_path)
+        report_path.write_text(json.dumps(report, indent=2))
+        logger.info(f"-- Profile report saved to: {report_path}")
+        return report
+
+
+@contextmanager
+def stage(name: str):
+    """
+    Mark a stage of the processing, a no-op unless profiling is active
+    """
+    if _profiler is None:
+        yield None
+    else:
+        with _profiler.stage(name) as record:
+            yield record
+
+
+def staged(name: str):
+    """
+    Decorator running a function as a stage, see stage()
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _profiler is None:
+                return func(*args, **kwargs)
+            with _profiler.stage(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def staged_iter(name: str, iterable):
+    """
+    Iterate over iterable, producing every item (e.g. running a generator up
+    to its next yield) as a stage
+    """
+    iterator = iter(iterable)
+    while True:
+        with stage(name):
+            item = next(iterator, _END)
+        if item is _END:
+            return
+        yield item
+
+
+def count(**counters: int) -> None:
+    """
+    Add to the counters (s3_bytes, disk_bytes, pixels, cells, rows) of the
+    active stages, a no-op unless profiling is active
+    """
+    if _profiler is not None:
+        _profiler.count(**counters)
+
+
+def remote(func: Callable) -> Callable:
+    """
+    Wrap a function submitted to a process pool: when profiling is active,
+    the worker profiles the stages of the call and returns them with its
+    result. The result of the call is read with merged().
+    """
+    return functools.partial(_run_remote, func, _profiler is not None)
+
+
+def _run_remote(
+    func: Callable, enabled: bool, *args, **kwargs
+) -> Tuple[Any, Optional[List[Dict]]]:
+    global _profiler
+    if not enabled:
+        return func(*args, **kwargs), None
+    # A forked worker inherits the profiler and stages of the parent
+    _active_stages.set(())
+    _profiler = Profiler(func.__name__)
+    try:
+        result = func(*args, **kwargs)
+    finally:
+        worker, _profiler = _profiler, None
+    return result, list(worker.stages.values())
+
+
+def merged(output: Tuple[Any, Optional[List[Dict]]]) -> Any:
+    """
+    Result of a call wrapped by remote(), adding the stages of the worker to
+    the active profiler
+    """
+    result, stages = output
+    if stages is not None and _profiler is not None:
+        _profiler.merge(stages)
+    return result
+
+
+@contextmanager
+def profiling(
+    report_path: Optional[Path],
+    command: str,
+    hot_stage: Optional[str] = None,
+    profiler: str = "cprofile",
+):
+    """
+    Profile the enclosed code and write the report to report_path, does
+    nothing if report_path is None
+    """
+    global _profiler
+    if report_path is None:
+        yield None
+        return
+    _profiler = Profiler(command, hot_stage, profiler)
+    try:
+        yield _profiler
+    finally:
+        profiler_done, _profiler = _profiler, None
+        profiler_done.write(Path(report_path))
+
+
+def profiled(command):
+    """
+    Add the --profile REPORT.json, --profile-stage STAGE and --profiler
+    options to a typer command
+    """
+
+    @functools.wraps(command)
+    def wrapper(
+        *args,
+        profile: Path = None,
+        profile_stage: str = None,
+        profiler: str = "cprofile",
+        **kwargs,
+    ):
+        with profiling(profile, command.__name__, profile_stage, profiler):
+            return command(*args, **kwargs)
+
+    signature = inspect.signature(command)
+    extra = [
+        inspect.Parameter(
+            name, inspect.Parameter.KEYWORD_ONLY, default=default, annotation=hint
+        )
+        for name, default, hint in (
+            ("profile", None, Path),
+            ("profile_stage", None, str),
+            ("profiler", "cprofile", str),
+        )
+    ]
+    wrapper.__signature__ = signature.replace(
+        parameters=[*signature.parameters.values(), *extra]
+    )
+    return wrapper
@@ -31,39 +31,130 @@ import numpy as np
 import pandas as pd
 import rasterio
 import rasterio.rio.mask
-from pyproj import CRS, transform
 from rhealpixdggs.dggs import WGS84_003
-from rich.logging import RichHandler
-from rich.progress import track
 from shapely.geometry import Polygon
-from dggs_tbx.utils import db_connect, down_s2
-from typing import List
-
-FORMAT = "%(message)s"
-logging.basicConfig(
-    level=logging.INFO, format=FORMAT, datefmt="[%X]", handlers=[RichHandler()]
+from dggs_tbx import profiling
+from dggs_tbx.download_cache import DEFAULT_CACHE_SIZE
+from dggs_tbx.utils import db_connect, down_s2, job_dir, parse_res_range
+from dggs_tbx.cellmap import cached_cell_map
+from dggs_tbx.labels import cached_labels
+from dggs_tbx.cloudindex import CLOUD_NODATA, cloud_index_frame, scl_cloud_values
+from dggs_tbx.transforms import WGS84, reproject_bounds, transform_geometries
+from dggs_tbx.zonal import (
+    CENTROID_RATIO,
+    ZonalStats,
+    band_name,
+    centroid_sampled,
+    reference_raster,
+    zonal_stats,
 )
+from typing import List, Tuple
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
 # Credit: https://github.com/allixender/dggs_t1/blob/master/more_grids.ipynb
 
+# Resolution 0 cells of WGS84_003 and the upper left vertex of each one in the
+# rHEALPix projection of the unit sphere (north_square = south_square = 0)
+CELLS0 = ["N", "O", "P", "Q", "R", "S"]
+UL_VERTEX0 = np.array(
+    [
+        (-np.pi, 3 * np.pi / 4),
+        (-np.pi, np.pi / 4),
+        (-np.pi / 2, np.pi / 4),
+        (0, np.pi / 4),
+        (np.pi / 2, np.pi / 4),
+        (-np.pi, -np.pi / 4),
+    ]
+)
+
 
 def create_cells(res: int, extent: tuple = None):
     # Credit: https://github.com/allixender/dggs_t1/blob/master/more_grids.ipynb
-    rdggs = WGS84_003
-    if extent is not None:
-        nw, se = extent
-        ids = rdggs.cells_from_region(res, nw, se, plane=False)
-        set_hex = list(itertools.chain(*ids))
-    else:
-        set_hex = [x for x in rdggs.grid(res)]
+    set_hex = list(itertools.chain.from_iterable(iter_cells(res, extent)))
     df = pd.DataFrame({"cell_id": set_hex})
     logger.info(f"-- Done creating rHEALpix cells at res {res}")
     return df
 
 
+def iter_cells(res: int, extent: tuple = None, batch_size: int = 2**16):
+    """
+    Stream the cells of create_cells by batches of about batch_size cells.
+    Regions are walked one parallel of cell nuclei at a time, so memory is
+    set by the batch size rather than by the resolution.
+    :param extent: (nw, se) lon/lat corners, the whole grid when None
+    """
+    if extent is None:
+        rows = ([cell] for cell in WGS84_003.grid(res))
+    else:
+        rows = region_rows(res, *extent)
+    batch = []
+    for row in rows:
+        batch.extend(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def iter_sorted_cells(res: int, extent: tuple = None, batch_size: int = 2**16):
+    """
+    Stream the cells of iter_cells by batches of batch_size cells in packed
+    id order, the order of sorted outputs, each cell once. Only the packed ids
+    of the extent are kept in memory (8 bytes a cell), cells are rebuilt batch
+    by batch.
+    """
+    ids = [rpix_pack(cells) for cells in iter_cells(res, extent, batch_size)]
+    # Rows of cells along neighbouring parallels may share cells
+    ids = np.unique(np.concatenate(ids)) if ids else np.empty(0, dtype=np.int64)
+    for start in range(0, len(ids), batch_size):
+        yield [
+            WGS84_003.cell(rpix_suid(index, res))
+            for index in ids[start : start + batch_size]
+        ]
+
+
+def region_rows(res: int, ul: tuple, dr: tuple):
+    """
+    Lazy equivalent of WGS84_003.cells_from_region(res, ul, dr, plane=False),
+    yielding the rows of cells from north to south
+    """
+    rdggs = WGS84_003
+    if ul[0] > dr[0] or ul[1] < dr[1]:
+        return
+    phi_min, phi_max = dr[1], ul[1]
+    PI = rdggs.ellipsoid.pi()
+    if (ul == (-PI, PI / 2) and dr[0] == -PI) or (
+        dr == (-PI, -PI / 2) and ul[0] == -PI
+    ):
+        # Cap
+        lam_min, lam_max = -PI, PI
+    else:
+        # Quad
+        lam_min, lam_max = ul[0], dr[0]
+    phis = list(reversed(rdggs.cell_latitudes(res, phi_min, phi_max, True, False)))
+    rows = (
+        rdggs.cells_from_parallel(res, phi, lam_min, lam_max) for phi in phis
+    )
+    first = next(rows, None)
+    # Add the cells along the phi_max parallel if necessary
+    if first is None or first[0] != rdggs.cell_from_point(res, ul, False):
+        first_row = rdggs.cells_from_parallel(res, phi_max, lam_min, lam_max)
+        yield first_row
+        last = first_row
+    if first is not None:
+        yield first
+        last = first
+        for row in rows:
+            yield row
+            last = row
+    # Add the cells along the phi_min parallel if necessary
+    if last[0] != rdggs.cell_from_point(res, (ul[0], dr[1]), False):
+        yield rdggs.cells_from_parallel(res, phi_min, lam_min, lam_max)
+
+
 def add_geom_cell(df):
     # Credit: https://github.com/allixender/dggs_t1/blob/master/more_grids.ipynb
     gdf = gpd.GeoDataFrame(df.copy())
@@ -75,6 +166,304 @@ def add_geom_cell(df):
     return gdf
 
 
+def rhealpix_xy(lon: np.ndarray, lat: np.ndarray):
+    """
+    Vectorized rHEALPix projection of WGS84_003 on the unit sphere.
+    Geodetic latitudes are converted to authalic latitudes, projected with
+    HEALPix and the polar triangles combined into the polar squares.
+    """
+    e = WGS84_003.ellipsoid.e
+    lam = np.deg2rad(np.asarray(lon, dtype=np.float64) - WGS84_003.ellipsoid.lon_0)
+    sin_phi = np.sin(np.deg2rad(np.asarray(lat, dtype=np.float64)))
+
+    # Authalic latitude
+    def q(s):
+        return (1 - e**2) * (
+            s / (1 - (e * s) ** 2) - np.log((1 - e * s) / (1 + e * s)) / (2 * e)
+        )
+
+    sin_beta = np.clip(q(sin_phi) / q(1.0), -1, 1)
+
+    # HEALPix projection of the sphere
+    polar = np.abs(sin_beta) > 2.0 / 3
+    sigma = np.sqrt(3 * (1 - np.abs(sin_beta)))
+    cap = np.clip(np.floor(2 * lam / np.pi + 2), 0, 3)
+    lamc = -3 * np.pi / 4 + np.pi / 2 * cap
+    x = np.where(polar, lamc + (lam - lamc) * sigma, lam)
+    y = np.where(
+        polar, np.sign(sin_beta) * np.pi / 4 * (2 - sigma), 3 * np.pi / 8 * sin_beta
+    )
+
+    # Rotate the polar triangles 1-3 onto triangle 0 to build the polar squares
+    north = y > np.pi / 4
+    south = y < -np.pi / 4
+    tri = np.select([x < -np.pi / 2, x < 0, x < np.pi / 2], [0, 1, 2], default=3)
+    k = np.where(north, tri, -tri) % 4
+    dx = x - (-3 * np.pi / 4 + tri * np.pi / 2)
+    dy = y - np.sign(y) * np.pi / 2
+    rx = np.select([k == 0, k == 1, k == 2], [dx, -dy, -dx], default=dy)
+    ry = np.select([k == 0, k == 1, k == 2], [dy, dx, -dy], default=-dx)
+    combine = north | south
+    x = np.where(combine, rx - 3 * np.pi / 4, x)
+    y = np.where(combine, ry + np.sign(y) * np.pi / 2, y)
+    return x, y
+
+
+def rpix_cells_from_points(lon: np.ndarray, lat: np.ndarray, resolution: int):
+    """
+    Return the packed rHEALPix cell index containing every lon, lat point.
+    The index of a cell is s0 * 9**resolution + the base 9 number made of its
+    resolution digits, s0 being the position of its resolution 0 cell in
+    CELLS0, or -1 for points outside the DGGS.
+    """
+    x, y = rhealpix_xy(lon, lat)
+    quarter = np.pi / 4
+    equatorial = np.abs(y) <= quarter
+    s0 = np.select(
+        [
+            (y > quarter) & (y < 3 * quarter) & (x > -np.pi) & (x < -np.pi / 2),
+            (y < -quarter) & (y > -3 * quarter) & (x > -np.pi) & (x < -np.pi / 2),
+            equatorial & (x >= -np.pi) & (x < np.pi),
+        ],
+        [0, 5, np.floor((x + np.pi) / (np.pi / 2)).astype(np.int64) + 1],
+        default=-1,
+    )
+    inside = s0 >= 0
+    s0 = np.where(inside, s0, 0)
+    n_cells = 3**resolution
+    width = np.pi / 2
+    col = np.floor(np.abs(x - UL_VERTEX0[s0, 0]) / width * n_cells).astype(np.int64)
+    row = np.floor(np.abs(y - UL_VERTEX0[s0, 1]) / width * n_cells).astype(np.int64)
+    col = np.clip(col, 0, n_cells - 1)
+    row = np.clip(row, 0, n_cells - 1)
+    index = s0.astype(np.int64)
+    for level in reversed(range(resolution)):
+        digit = (row // 3**level % 3) * 3 + col // 3**level % 3
+        index = index * 9 + digit
+    return np.where(inside, index, -1)
+
+
+def rpix_suid(index: int, resolution: int) -> tuple:
+    """
+    Return the rHEALPix SUID of a packed cell index
+    """
+    digits = []
+    for _ in range(resolution):
+        index, digit = divmod(int(index), 9)
+        digits.append(digit)
+    return (CELLS0[index], *reversed(digits))
+
+
+def rpix_pack(cell_ids) -> np.ndarray:
+    """
+    Return the packed index (int64) of rHEALPix cell ids such as "N0123"
+    """
+    return np.fromiter(
+        (
+            CELLS0.index(c[0]) * 9 ** (len(c) - 1) + (int(c[1:], 9) if c[1:] else 0)
+            for c in map(str, cell_ids)
+        ),
+        dtype=np.int64,
+        count=len(cell_ids),
+    )
+
+
+def rpix_cell_centres(extent: Polygon, resolution: int, batch_size: int = 2**16):
+    """
+    Stream the rHEALPix cells of a lon/lat polygon by batches of (packed ids,
+    nucleus lon, nucleus lat), see zonal.centroid_stats
+    """
+    west, south, east, north = extent.bounds
+    extent = ((west, north), (east, south))
+    for cells in iter_sorted_cells(resolution, extent, batch_size):
+        lon, lat = np.array([cell.nucleus(plane=False) for cell in cells]).T
+        yield rpix_pack(cells), lon, lat
+
+
+def rpix_parents(
+    cells: np.ndarray, resolution: int, parent_resolution: int
+) -> np.ndarray:
+    """
+    Return the packed index of the parent cells at a coarser resolution
+    """
+    return np.where(cells >= 0, cells // 9 ** (resolution - parent_resolution), -1)
+
+
+def rpix_zonal_stats(
+    list_bands: List[Path],
+    resolution: int,
+    cache_dir: Path = None,
+    tile_id: str = "",
+    workers: int = 1,
+    overview_budget: float = 1e-4,
+    labels_dir: Path = None,
+    **kwargs,
+) -> ZonalStats:
+    """
+    Statistics of every band for each rHEALPix cell covering the rasters
+    :param list_bands: Paths to the single band rasters, named after the band
+    :param resolution: rHEALPix resolution
+    :param cache_dir: Directory of the cached pixel to cell maps, no cache if None
+    :param tile_id: Tile id used to name the cached pixel to cell maps
+    :param workers: Number of processes aggregating the raster windows
+    :param overview_budget: Maximum ratio of the pixel area to the cell area
+                            when reading from the raster overviews
+    :param labels_dir: Directory of the cached memory-mapped cell labels, used
+                       when no cache_dir is given
+    :param kwargs: Other arguments of zonal_stats, e.g. a value_func or the
+                   centroid_ratio below which cells are sampled at their centre
+    """
+    cell_area = WGS84_003.cell_area(resolution, plane=False)
+    cell_map = labels = None
+    reference = reference_raster(list_bands)
+    with rasterio.open(reference) as ref:
+        sampled = centroid_sampled(
+            ref, cell_area, kwargs.get("centroid_ratio", CENTROID_RATIO)
+        )
+    # Cells sampled at their centre need no cell map or labels
+    if not sampled:
+        if cache_dir is not None:
+            cell_map = cached_cell_map(
+                cache_dir,
+                reference,
+                "rpix",
+                rpix_cells_from_points,
+                resolution,
+                tile_id,
+            )
+        elif labels_dir is not None:
+            labels = cached_labels(
+                labels_dir,
+                reference,
+                "rpix",
+                rpix_cells_from_points,
+                resolution,
+                tile_id,
+            )
+    return zonal_stats(
+        list_bands,
+        rpix_cells_from_points,
+        resolution,
+        cell_map=cell_map,
+        labels=labels,
+        workers=workers,
+        cell_area=cell_area,
+        overview_budget=overview_budget,
+        cell_centres=rpix_cell_centres,
+        **kwargs,
+    )
+
+
+def rpix_cells_geometry(cells: np.ndarray, resolution: int) -> gpd.GeoSeries:
+    """
+    Boundary polygons of packed rHEALPix cell ids (EPSG:4326)
+    """
+    return gpd.GeoSeries(
+        [
+            Polygon(
+                WGS84_003.cell(rpix_suid(index, resolution)).boundary(
+                    n=3, plane=False
+                )
+            )
+            for index in cells
+        ],
+        crs="EPSG:4326",
+    )
+
+
+@profiling.staged("grid")
+def rpix_with_geometry(df: pd.DataFrame, resolution: int) -> gpd.GeoDataFrame:
+    """
+    Materialize the cell_id and geometry of an ids-only frame indexed by
+    packed rHEALPix ids
+    """
+    cells = [WGS84_003.cell(rpix_suid(index, resolution)) for index in df.index]
+    profiling.count(cells=len(cells))
+    df = df.copy()
+    df.insert(0, "cell_id", cells)
+    return add_geom_cell(df.reset_index(drop=True))
+
+
+def rpix_stats_frame(
+    stats: ZonalStats, band_names: List[str], resolution: int, ids_only: bool = False
+) -> gpd.GeoDataFrame:
+    """
+    GeoDataFrame with the cell_id and the mean of every band (EPSG:4326)
+    :param ids_only: Return a DataFrame indexed by the packed int64 ids
+                     ("rpix_id") without geometry, see rpix_with_geometry
+    """
+    df = stats.to_frame(band_names)
+    df = df.loc[df.index >= 0]
+    df.index = pd.Index(df.index.to_numpy().astype(np.int64), name="rpix_id")
+    if ids_only:
+        return df
+    return rpix_with_geometry(df, resolution)
+
+
+def rpix_zonal_mean(
+    list_bands: List[Path], resolution: int, *args, ids_only: bool = False, **kwargs
+):
+    """
+    Mean value of every band for each rHEALPix cell covering the rasters
+    (see rpix_zonal_stats for the other arguments)
+    :return: GeoDataFrame with cell_id and one column per band (EPSG:4326),
+             or DataFrame indexed by packed rHEALPix id with ids_only
+    """
+    stats = rpix_zonal_stats(list_bands, resolution, *args, **kwargs)
+    band_names = [band_name(path) for path in list_bands]
+    return rpix_stats_frame(stats, band_names, resolution, ids_only)
+
+
+def rpix_zonal_pyramid(
+    list_bands: List[Path], resolutions: List[int], ids_only: bool = False, **kwargs
+):
+    """
+    Aggregate the rasters once at the finest resolution and roll the sums and
+    counts up to the parent cells of every coarser resolution
+    (see rpix_zonal_stats for the keyword arguments)
+    :return: Iterator of (resolution, GeoDataFrame) from the finest resolution
+    """
+    band_names = [band_name(path) for path in list_bands]
+    resolutions = sorted(resolutions, reverse=True)
+    stats = rpix_zonal_stats(list_bands, resolutions[0], **kwargs)
+    previous = resolutions[0]
+    for resolution in resolutions:
+        if resolution < previous:
+            with profiling.stage("aggregation"):
+                stats = stats.to_parent(rpix_parents(stats.cells, previous, resolution))
+                profiling.count(cells=len(stats.cells))
+            previous = resolution
+        yield resolution, rpix_stats_frame(stats, band_names, resolution, ids_only)
+
+
+def rpix_cloud_index(
+    scl_path: Path, resolution: int, ids_only: bool = False, **kwargs
+) -> pd.DataFrame:
+    """
+    Cloud fraction, valid pixel count and highest SCL class of every rHEALPix
+    cell covering an SCL raster, classified block by block
+    (see rpix_zonal_stats for the keyword arguments)
+    :return: GeoDataFrame with the cell_id and an rpix_id column (EPSG:4326),
+             or DataFrame indexed by packed int64 ids with ids_only
+    """
+    stats = rpix_zonal_stats(
+        [scl_path],
+        resolution,
+        overview_budget=0,
+        value_func=scl_cloud_values,
+        value_nodata=CLOUD_NODATA,
+        **kwargs,
+    )
+    df = cloud_index_frame(stats)
+    df = df.loc[df.index >= 0]
+    df.index = pd.Index(df.index.to_numpy().astype(np.int64), name="rpix_id")
+    if ids_only:
+        return df
+    grid = rpix_with_geometry(df, resolution)
+    grid.insert(0, "rpix_id", df.index.to_numpy())
+    return grid
+
+
 def check_crossing(lon1: float, lon2: float, validate: bool = True):
     """
     Assuming a minimum travel distance between two provided longitude coordinates,
@@ -101,27 +490,11 @@ def check_for_geom(geom):
     return crossed
 
 
-def reproject_bounds(bounds, epsg_in, epsg_out="4326"):
-    nw = (bounds[0], bounds[-1])
-    se = (bounds[2], bounds[1])
-    inProj = CRS(f"epsg:{epsg_in}")
-    outProj = CRS(f"epsg:{epsg_out}")
-    nw_proj = transform(inProj, outProj, nw[0], nw[1])
-    se_proj = transform(inProj, outProj, se[0], se[1])
-    return tuple(reversed(nw_proj)), tuple(reversed(se_proj))
-
-
-def rpix_from_raster_extent(raster_path, out_dir, resolution, df_ret=False):
-    with rasterio.open(raster_path) as ds:
-        bounds = ds.bounds
-        nw, se = reproject_bounds(bounds, ds.crs.to_epsg())
-        logger.info(f" -- Grid extent : {(nw,se)}")
-        epsg = ds.crs.to_epsg()
-    df = create_cells(resolution, extent=(nw, se))
-    grid = add_geom_cell(df)
-    # grid['crossed'] = grid['geometry'].apply(check_for_geom)
-    # grid = grid.loc[grid['crossed'] == False]
-    grid = grid.to_crs(f"EPSG:{epsg}")
+def rpix_from_raster_extent(raster_path, out_dir, resolution, df_ret=False, crs=None):
+    # Geometries are in the raster CRS unless another crs is given
+    batches = list(rpix_grid_batches(raster_path, resolution, crs=crs))
+    grid = pd.concat(batches, ignore_index=True) if len(batches) > 1 else batches[0]
+    grid = grid.drop(columns="rpix_id")
     if df_ret:
         return grid
     else:
@@ -131,57 +504,179 @@ def rpix_from_raster_extent(raster_path, out_dir, resolution, df_ret=False):
         return out_dir / out_fname
 
 
+def rpix_grid_batches(
+    raster_path: Path, resolution: int, batch_size: int = 2**16, crs=None
+):
+    """
+    Stream the rHEALPix grid of the raster extent by batches of
+    GeoDataFrames in the raster CRS, with the cell_id string and the packed
+    int64 rpix_id, batches following each other in rpix_id order. The ids of
+    the extent are sorted in memory, see iter_sorted_cells
+    :param crs: CRS of the geometries instead of the raster CRS, e.g.
+                EPSG:4326 to keep the cell boundaries untransformed
+    """
+    with rasterio.open(raster_path) as ds:
+        nw, se = reproject_bounds(ds.bounds, ds.crs)
+        logger.info(f" -- Grid extent : {(nw,se)}")
+        crs = crs or ds.crs
+    for cells in profiling.staged_iter(
+        "grid", iter_sorted_cells(resolution, (nw, se), batch_size)
+    ):
+        with profiling.stage("grid"):
+            grid = add_geom_cell(pd.DataFrame({"cell_id": cells}))
+            # grid['crossed'] = grid['geometry'].apply(check_for_geom)
+            # grid = grid.loc[grid['crossed'] == False]
+            grid.insert(1, "rpix_id", rpix_pack(grid["cell_id"]))
+            with profiling.stage("reprojection"):
+                grid = grid.set_geometry(
+                    transform_geometries(grid.geometry.values, WGS84, crs), crs=crs
+                )
+            profiling.count(cells=len(grid))
+        yield grid
+
+
+def rpix_db_frame(rpix_grid: pd.DataFrame, resolution: int) -> pd.DataFrame:
+    """
+    Add the resolution and grid_name columns of the DB tables to a level of
+    the grid, geometries in EPSG:4326
+    """
+    # Add resolution column
+    rpix_grid["resolution"] = resolution
+    # Add grid name
+    rpix_grid["grid_name"] = "rpix"
+    # Reproject to 4326 for visualisation
+    if isinstance(rpix_grid, gpd.GeoDataFrame):
+        with profiling.stage("reprojection"):
+            rpix_grid = rpix_grid.to_crs("EPSG:4326")
+    return rpix_grid
+
+
 def s2_to_rpix(
-    s2_tile_id: str, date: str,table_name: str,bands: List, tmp_dir: Path = Path(gettempdir()), res: int =7, simulate: bool = False
+    s2_tile_id: str,
+    date: str,
+    table_name: str,
+    bands: List,
+    tmp_dir: Path = Path(gettempdir()),
+    res: int = 7,
+    simulate: bool = False,
+    use_dask: bool = False,
+    cache_dir: Path = None,
+    workers: int = 1,
+    overview_budget: float = 1e-4,
+    res_range: str = None,
+    download_cache: Path = None,
+    download_cache_size: int = DEFAULT_CACHE_SIZE,
+    keep_inputs: bool = False,
+    download_workers: int = 4,
+    aoi: Tuple[float, float, float, float] = None,
+    ids_only: bool = False,
+    defer_merge: bool = False,
+    scheduler: str = None,
+    labels_dir: Path = None,
+    create_indexes: bool = False,
+    centroid_ratio: float = CENTROID_RATIO,
 ):
     # Get all 10m tif files and store them in tmp dir
     # for each rpix cell load info from all bands
     # send dataframe to postgis
-    # Download the Sentinel-2 data
+    # With a res_range ("5:10"), every resolution of the pyramid is derived
+    # from the finest one
+    # Downloaded bands are removed at the end unless keep_inputs is set, a
+    # download_cache directory keeps them across runs. With aoi bounds, only
+    # the COG blocks overlapping them are fetched. With ids_only, rows hold
+    # 64-bit cell ids and no geometry (not applied to simulated grids). With
+    # defer_merge, all the levels reach the table in a single statement. The
+    # indexes are left to pgload.index_table unless create_indexes is set. With
+    # use_dask, the aggregation runs on the Dask scheduler at the scheduler
+    # address, or on a LocalCluster of as many processes as workers. With
+    # labels_dir, the pixel cell labels are memory-mapped from that directory,
+    # computed by the first date of a tile and reused by the next ones. Cells
+    # smaller than centroid_ratio pixels are sampled at their centre
+    resolutions = parse_res_range(res_range) if res_range else [res]
     # Download the Sentinel-2 data
     if simulate:
         # In case of simulation, download only one band for extent
-        out_dir = down_s2(s2_tile_id, date, tmp_dir, bands=bands[0])
-    else:
-        out_dir = down_s2(s2_tile_id, date, tmp_dir, bands=bands)
-    # Create a gdf of rpix at a given resolution
-    list_bands = list(out_dir.rglob("*.tif"))
-    rpix_grid = rpix_from_raster_extent(list_bands[0], out_dir, res, df_ret=True)
-    if simulate:
-        logger.info("-- Simulation is ON, using uniform distribution")
-        for band in bands:
-            rpix_grid[band] = np.random.uniform(0, 10000, rpix_grid.shape[0]).astype(int)
+        bands_to_download = bands[0]
     else:
-        # Fill the H3 dataframe
-        band_values = {}
-        for sat_band_path in track(list_bands):
-            band_name = sat_band_path.parts[-1].replace(".tif", "")
-            band_values[band_name] = []
-            with rasterio.open(sat_band_path, "r") as src:
-                shapes = [geom for geom in rpix_grid.geometry]
-                for shape in shapes:
-                    try:
-                        out_image, out_transform = rasterio.mask.mask(
-                            src, [shape], True
-                        )
-                        sub_data = int(np.mean(out_image))
-                        band_values[band_name].append(sub_data)
-                    except:
-                        logger.warning("Shape outside raster")
-                        band_values[band_name].append(0)
-        for band_val in band_values:
-            rpix_grid[band_val] = band_values[band_val]
-    # Add resolution column
-    rpix_grid["resolution"] = res
-    # Add grid name
-    rpix_grid["grid_name"] = "rpix"
-    # Reproject to 4326 for visualisation
-    rpix_grid = rpix_grid.to_crs("EPSG:4326")
-    # Send data to Postgis DB
-    engine = db_connect()
-    rpix_grid.to_postgis(table_name, engine, if_exists="append", index=True)
-    shutil.rmtree(out_dir)
-    logger.info(f" -- Rpix data sent to {table_name} table ({len(rpix_grid)} cells)")
+        bands_to_download = bands
+    # The bands of the job are downloaded to a directory of its own, batch
+    # jobs on the same product may run at the same time
+    download_dir = job_dir(tmp_dir)
+    client = None
+    try:
+        out_dir = down_s2(
+            s2_tile_id,
+            date,
+            download_dir,
+            bands=bands_to_download,
+            cache_dir=download_cache,
+            cache_size=download_cache_size,
+            max_workers=download_workers,
+            aoi=aoi,
+        )
+        # Create a gdf of rpix at a given resolution
+        list_bands = list(out_dir.rglob("*.tif"))
+        if simulate:
+            levels = (
+                (r, simulate_rpix_grid(list_bands[0], out_dir, r, bands))
+                for r in resolutions
+            )
+        else:
+            # Fill the rpix dataframe with a vectorized pixel to cell aggregation
+            if use_dask:
+                from dggs_tbx.dask_backend import dask_client
+
+                client = dask_client(scheduler, workers)
+            levels = rpix_zonal_pyramid(
+                list_bands,
+                resolutions,
+                cache_dir=cache_dir,
+                labels_dir=labels_dir,
+                tile_id=s2_tile_id,
+                workers=workers,
+                overview_budget=overview_budget,
+                ids_only=ids_only,
+                dask_client=client,
+                centroid_ratio=centroid_ratio,
+            )
+        from dggs_tbx.pgload import PostGISLoader
+
+        # Rows are streamed with COPY and merged once per level, indexes are
+        # built after the last level
+        with PostGISLoader(
+            db_connect(),
+            table_name,
+            defer_merge=defer_merge,
+            create_indexes=create_indexes,
+        ) as loader:
+            for level_res, rpix_grid in levels:
+                rpix_grid = rpix_db_frame(rpix_grid, level_res)
+                # Send data to Postgis DB
+                loader.load(rpix_grid, index=True)
+                logger.info(
+                    f" -- Rpix data sent to {table_name} table "
+                    f"({len(rpix_grid)} cells)"
+                )
+    finally:
+        if client is not None:
+            client.close()
+        if not keep_inputs:
+            shutil.rmtree(download_dir, ignore_errors=True)
+
+
+def simulate_rpix_grid(
+    raster_path: Path, out_dir: Path, res: int, bands: List
+) -> gpd.GeoDataFrame:
+    """
+    rHEALPix grid of the raster extent filled with uniformly distributed values
+    """
+    rpix_grid = rpix_from_raster_extent(
+        raster_path, out_dir, res, df_ret=True, crs=WGS84
+    )
+    logger.info("-- Simulation is ON, using uniform distribution")
+    for band in bands:
+        rpix_grid[band] = np.random.uniform(0, 10000, rpix_grid.shape[0]).astype(int)
+    return rpix_grid
 
 
 if __name__ == "__main__":
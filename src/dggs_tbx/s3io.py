@@ -0,0 +1,218 @@
+# Copyright (C) 2024-2025 CS GROUP, https://cs-soprasteria.com
+#
+# This file is part of DGGS Toolbox:
+#
+#     https://github.com/CS-SI/dggs_tbx
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+#
+# DGGS Toolbox is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# DGGS Toolbox is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with DGGS Toolbox. If not, see
+# https://www.gnu.org/licenses/.
+
+"""
+S3 access helpers: a shared connection-pooled client, paginated listing and
+HTTP range reads of COGs restricted to an area of interest.
+"""
+
+import io
+import logging
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Iterator, Tuple
+
+import boto3
+import rasterio
+from botocore import UNSIGNED
+from botocore.config import Config
+from rasterio.abc import FileContainer
+from rasterio.warp import transform_bounds
+from rasterio.windows import Window, from_bounds
+
+from dggs_tbx import profiling
+
+logger = logging.getLogger(__name__)
+
+# Bytes fetched at least per range request, GDAL issues many small header reads
+READ_AHEAD = 64 * 1024
+
+
+@lru_cache(maxsize=None)
+def s3_client(max_pool_connections: int = 16):
+    """
+    Anonymous S3 client shared by all downloads of the process. Clients are
+    thread safe and keep their HTTP connections pooled across calls.
+    """
+    return boto3.client(
+        "s3",
+        config=Config(
+            signature_version=UNSIGNED,
+            max_pool_connections=max_pool_connections,
+            retries={"max_attempts": 5, "mode": "adaptive"},
+        ),
+    )
+
+
+def list_objects(
+    client, bucket: str, prefix: str, page_size: int = 1000
+) -> Iterator[dict]:
+    """
+    Every object under a prefix, following list_objects_v2 pagination
+    """
+    paginator = client.get_paginator("list_objects_v2")
+    pages = paginator.paginate(
+        Bucket=bucket, Prefix=prefix, PaginationConfig={"PageSize": page_size}
+    )
+    for page in pages:
+        yield from page.get("Contents", [])
+
+
+class S3RangeFile(io.RawIOBase):
+    """
+    Read-only seekable file over an S3 object, every read is an HTTP range
+    request
+    :param client: S3 client
+    :param bucket: Bucket name
+    :param key: Object key
+    :param size: Object size in bytes
+    """
+
+    def __init__(self, client, bucket: str, key: str, size: int):
+        super().__init__()
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.size = size
+        self.position = 0
+        self.requests = 0
+        self.bytes_read = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self.position = max(0, offset)
+        return self.position
+
+    def readinto(self, buffer) -> int:
+        stop = min(self.position + len(buffer), self.size)
+        if stop <= self.position:
+            return 0
+        response = self.client.get_object(
+            Bucket=self.bucket,
+            Key=self.key,
+            Range=f"bytes={self.position}-{stop - 1}",
+        )
+        self.requests += 1
+        data = response["Body"].read()
+        self.bytes_read += len(data)
+        buffer[: len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+
+class S3ObjectContainer(FileContainer):
+    """
+    rasterio opener serving S3 objects of known sizes through range reads
+    :param client: S3 client
+    :param bucket: Bucket name
+    :param sizes: Size in bytes of every object key
+    """
+
+    def __init__(self, client, bucket: str, sizes: Dict[str, int]):
+        self.client = client
+        self.bucket = bucket
+        self.sizes = sizes
+        self.handles = []
+
+    def open(self, path: str, mode: str = "rb", **kwargs):
+        # GDAL may open and close the file several times
+        self.handles.append(
+            S3RangeFile(self.client, self.bucket, path, self.sizes[path])
+        )
+        return io.BufferedReader(self.handles[-1], buffer_size=READ_AHEAD)
+
+    def size(self, path: str) -> int:
+        return self.sizes[path]
+
+    def isfile(self, path: str) -> bool:
+        return path in self.sizes
+
+    def isdir(self, path: str) -> bool:
+        return False
+
+    def ls(self, path: str) -> list:
+        return []
+
+    def mtime(self, path: str) -> int:
+        return 0
+
+    def rm(self, path: str) -> None:
+        raise PermissionError(f"{path} is read-only")
+
+
+def read_aoi(
+    client,
+    bucket: str,
+    key: str,
+    size: int,
+    aoi: Tuple[float, float, float, float],
+    dest: Path,
+) -> Path:
+    """
+    Copy the blocks of a COG overlapping an area of interest to a local
+    GeoTIFF, fetching only those byte ranges
+    :param aoi: (min lon, min lat, max lon, max lat) in EPSG:4326
+    :param dest: Path of the cropped GeoTIFF
+    """
+    container = S3ObjectContainer(client, bucket, {key: size})
+    with rasterio.open(key, opener=container) as src:
+        bounds = transform_bounds("EPSG:4326", src.crs, *aoi)
+        window = from_bounds(*bounds, transform=src.transform)
+        # Extend the window to whole blocks, those are read anyway
+        block_h, block_w = src.block_shapes[0]
+        col_off = max(0, int(window.col_off // block_w) * block_w)
+        row_off = max(0, int(window.row_off // block_h) * block_h)
+        col_end = min(
+            src.width, -(-int(window.col_off + window.width) // block_w) * block_w
+        )
+        row_end = min(
+            src.height, -(-int(window.row_off + window.height) // block_h) * block_h
+        )
+        if col_end <= col_off or row_end <= row_off:
+            raise ValueError(f"Area of interest {aoi} does not intersect {key}")
+        window = Window(col_off, row_off, col_end - col_off, row_end - row_off)
+        profile = src.profile
+        profile.update(
+            driver="GTiff",
+            width=window.width,
+            height=window.height,
+            transform=src.window_transform(window),
+        )
+        data = src.read(window=window)
+    with rasterio.open(dest, "w", **profile) as dst:
+        dst.write(data)
+    requests = sum(handle.requests for handle in container.handles)
+    profiling.count(s3_bytes=sum(handle.bytes_read for handle in container.handles))
+    logger.info(f" -- Read {requests} ranges of {key}")
+    return dest
@@ -0,0 +1,113 @@
+# Copyright (C) 2024-2025 CS GROUP, https://cs-soprasteria.com
+#
+# This file is part of DGGS Toolbox:
+#
+#     https://github.com/CS-SI/dggs_tbx
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+#
+# DGGS Toolbox is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# DGGS Toolbox is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with DGGS Toolbox. If not, see
+# https://www.gnu.org/licenses/.
+
+
+"""
+Cached coordinate transformations.
+
+pyproj Transformers are costly to build, so they are created once per pair
+of CRSs (and thread, since they are not thread safe) and applied to whole
+coordinate arrays. Cells are handled in EPSG:4326, only raster coordinates
+and the geometries written in the raster CRS are transformed.
+"""
+
+import threading
+from functools import lru_cache
+from typing import Tuple
+
+import numpy as np
+import shapely
+from pyproj import Transformer
+from shapely.geometry import Polygon
+
+WGS84 = "EPSG:4326"
+
+
+def _crs_key(crs) -> str:
+    if isinstance(crs, int):
+        return f"EPSG:{crs}"
+    if isinstance(crs, str):
+        return crs
+    return crs.to_string()
+
+
+@lru_cache(maxsize=64)
+def _transformer(crs_from: str, crs_to: str, thread: int) -> Transformer:
+    return Transformer.from_crs(crs_from, crs_to, always_xy=True)
+
+
+def transformer(crs_from, crs_to) -> Transformer:
+    """
+    Return the cached x, y ordered Transformer between two CRSs
+    :param crs_from: Source CRS, as an EPSG code, a string or a CRS object
+    :param crs_to: Target CRS
+    """
+    return _transformer(_crs_key(crs_from), _crs_key(crs_to), threading.get_ident())
+
+
+def to_lonlat(crs, xs: np.ndarray, ys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Transform x, y arrays in a CRS to lon, lat arrays
+    """
+    return transformer(crs, WGS84).transform(xs, ys)
+
+
+def from_lonlat(crs, lon: np.ndarray, lat: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Transform lon, lat arrays to x, y arrays in a CRS
+    """
+    return transformer(WGS84, crs).transform(lon, lat)
+
+
+def extent_lonlat(bounds, crs) -> Polygon:
+    """
+    Return the lon/lat polygon of the corners of (left, bottom, right, top)
+    bounds in a CRS
+    """
+    left, bottom, right, top = bounds
+    lon, lat = to_lonlat(
+        crs, np.array([left, right, right, left]), np.array([bottom, bottom, top, top])
+    )
+    return Polygon(zip(lon, lat))
+
+
+def reproject_bounds(bounds, crs_in, crs_out=WGS84):
+    """
+    Return the north-west and south-east corners of (left, bottom, right, top)
+    bounds as x, y (lon, lat) tuples in another CRS
+    """
+    xs, ys = transformer(crs_in, crs_out).transform(
+        np.array([bounds[0], bounds[2]]), np.array([bounds[3], bounds[1]])
+    )
+    return (float(xs[0]), float(ys[0])), (float(xs[1]), float(ys[1]))
+
+
+def transform_geometries(geometries: np.ndarray, crs_from, crs_to) -> np.ndarray:
+    """
+    Transform an array of 2D shapely geometries, all vertices at once
+    """
+    if _crs_key(crs_from) == _crs_key(crs_to):
+        return geometries
+    to_crs = transformer(crs_from, crs_to)
+    return shapely.transform(
+        geometries, lambda coords: np.column_stack(to_crs.transform(*coords.T))
+    )
@@ -20,114 +20,269 @@
 # License along with DGGS Toolbox. If not, see
 # https://www.gnu.org/licenses/.
 
+import contextvars
 import logging
 import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import ExitStack
+from functools import lru_cache
 from pathlib import Path
-from tempfile import gettempdir
+from tempfile import gettempdir, mkdtemp
+from typing import Iterable, Iterator, List, Tuple
 
-import boto3
-import fiona
 import geopandas as gpd
 import numpy as np
+import pandas as pd
 import rasterio
-from botocore import UNSIGNED
-from botocore.config import Config
-from pyproj import CRS, transform
 from rasterio.mask import mask
-from rich.logging import RichHandler
 from rich.progress import track
 from shapely.geometry import box
-from sqlalchemy import create_engine
 
-FORMAT = "%(message)s"
-logging.basicConfig(
-    level=logging.INFO, format=FORMAT, datefmt="[%X]", handlers=[RichHandler()]
-)
+from dggs_tbx import profiling
+from dggs_tbx.download_cache import DEFAULT_CACHE_SIZE, DownloadCache
+from dggs_tbx.zonal import CENTROID_RATIO, iter_windows, sample_points
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
 
-def rasterval_geojson(path_to_geojson, raster_path,write=True):
+# Raster opened once per worker process by _open_worker_raster
+_worker_src = None
+
+
+def _open_worker_raster(raster_path: Path) -> None:
+    global _worker_src
+    _worker_src = rasterio.open(raster_path)
+
+
+def _worker_mask_means(shapes: list) -> list:
+    return mask_means(_worker_src, shapes)
+
+
+def mask_means(src, shapes: list) -> list:
+    """
+    Integer mean of the valid raster pixels within each shape, 0 for shapes
+    outside the raster extent or on nodata only, nodata pixels being left out
+    like in zonal.zonal_stats
+    :param src: Open rasterio dataset, or raster path opened for the batch
+    """
+    if not isinstance(src, rasterio.io.DatasetReader):
+        with rasterio.open(src) as dataset:
+            return mask_means(dataset, shapes)
+    values = []
+    for shape in shapes:
+        try:
+            out_image, out_transform = mask(src, [shape], crop=True, filled=False)
+            values.append(int(out_image.mean()) if out_image.count() else 0)
+        except:
+            logger.warning("Mask outside raster extent or nodata")
+            values.append(0)
+    return values
+
+
+def centroid_values(src, grid: gpd.GeoDataFrame) -> list:
+    """
+    Integer raster value at the centroid of every cell, 0 for cells outside
+    the raster extent or on nodata
+    :param src: Open rasterio dataset
+    :param grid: Grid in the raster CRS
+    """
+    centroids = grid.geometry.centroid
+    sampled, inside = sample_points([src], src.transform, centroids.x, centroids.y)
+    values = np.zeros(len(grid), dtype=np.int64)
+    sampled = sampled[0]
+    if src.nodata is not None:
+        sampled = np.where(sampled == src.nodata, 0, sampled)
+    values[inside] = sampled
+    return values.tolist()
+
+
+@profiling.staged("aggregation")
+def rasterval_grid(
+    grid: gpd.GeoDataFrame,
+    raster_path: Path,
+    column: str,
+    workers: int = 1,
+    centroid_ratio: float = CENTROID_RATIO,
+) -> gpd.GeoDataFrame:
+    """
+    Fill an in-memory grid with the mean raster value of every cell. The
+    raster is opened once, or once per worker process. Cells smaller than
+    centroid_ratio pixels take the value of the pixel containing their
+    centroid, without masking the raster.
+    :param grid: Grid in the raster CRS
+    :param column: Name of the column of mean values
+    :param centroid_ratio: Ratio of the mean cell area to the pixel area below
+                           which cells are sampled at their centroid, 0 to
+                           always mask the raster
+    """
+    with ExitStack() as stack:
+        src, pool = _open_fill(stack, raster_path, workers)
+        return _fill_grid(grid, src, pool, column, workers, centroid_ratio)
+
+
+def rasterval_batches(
+    grids: Iterable[gpd.GeoDataFrame],
+    raster_path: Path,
+    column: str,
+    workers: int = 1,
+    centroid_ratio: float = CENTROID_RATIO,
+) -> Iterator[gpd.GeoDataFrame]:
+    """
+    Fill grid batches one at a time, see rasterval_grid. The raster, and the
+    process pool of the workers, are opened once for all the batches.
+    """
+    with ExitStack() as stack:
+        src, pool = _open_fill(stack, raster_path, workers)
+        for grid in grids:
+            with profiling.stage("aggregation"):
+                grid = _fill_grid(grid, src, pool, column, workers, centroid_ratio)
+            yield grid
+
+
+def _open_fill(stack: ExitStack, raster_path: Path, workers: int):
+    # Raster of the caller, and pool of workers opening it once each
+    src = stack.enter_context(rasterio.open(raster_path))
+    pool = None
+    if workers > 1:
+        pool = stack.enter_context(
+            ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=_open_worker_raster,
+                initargs=(raster_path,),
+            )
+        )
+    return src, pool
+
+
+def _fill_grid(
+    grid: gpd.GeoDataFrame,
+    src,
+    pool,
+    column: str,
+    workers: int,
+    centroid_ratio: float,
+) -> gpd.GeoDataFrame:
+    logger.info(f"-- Filling grid with mean values from {src.name}")
+    shapes = list(grid.geometry)
+    target = len(shapes)
+    # extract the raster values within the polygon, by batches of cells
+    batch_size = max(1, min(1000, -(-target // (4 * workers))))
+    batches = [shapes[i : i + batch_size] for i in range(0, target, batch_size)]
+    pixel_area = abs(src.transform.a * src.transform.e)
     rast_vals = []
+    if target and grid.geometry.area.mean() < centroid_ratio * pixel_area:
+        logger.info("-- Cells smaller than the pixels, sampling the centroids")
+        rast_vals = centroid_values(src, grid)
+    elif pool is not None:
+        results = pool.map(_worker_mask_means, batches)
+        for batch_vals in track(results, total=len(batches)):
+            rast_vals.extend(batch_vals)
+    else:
+        for batch in track(batches):
+            rast_vals.extend(mask_means(src, batch))
+    profiling.count(cells=target)
+    count = sum(1 for val in rast_vals if val != 0)
+    logger.info(f"-- Cells with value: {count}/{target}")
+    grid = grid.copy()
+    grid[column] = rast_vals
+    return grid
+
+
+def save_grid(grid, out_path: Path, id_column: str = None) -> Path:
+    """
+    Write a filled grid, or an iterable of grid batches, to GeoJSON or to
+    GeoParquet sorted by id_column when out_path ends with .parquet. Batches
+    are appended one at a time.
+    :param id_column: Integer cell id column, left out of GeoJSON outputs
+    """
+    batches = [grid] if isinstance(grid, pd.DataFrame) else grid
+    if out_path.suffix == ".parquet":
+        if id_column is None:
+            raise ValueError("Parquet output requires an integer cell id column")
+        from dggs_tbx.geoparquet import GridParquetWriter
+
+        with GridParquetWriter(out_path, id_column) as writer:
+            for batch in batches:
+                with profiling.stage("load"):
+                    writer.write(batch)
+                    profiling.count(rows=len(batch))
+        return out_path
+    if out_path.suffix != ".geojson":
+        raise ValueError(f"Unknown output format {out_path.suffix}")
+    for position, batch in enumerate(batches):
+        if not isinstance(batch, gpd.GeoDataFrame):
+            raise ValueError(
+                "GeoJSON output requires cell geometries, write ids-only grids "
+                "to .parquet"
+            )
+        if id_column in batch.columns:
+            batch = batch.drop(columns=id_column)
+        with profiling.stage("load"):
+            batch.to_file(out_path, driver="GeoJSON", mode="a" if position else "w")
+            profiling.count(rows=len(batch))
+    logger.info(f"-- Grid saved to: {out_path}")
+    return out_path
+
+
+def rasterval_geojson(path_to_geojson, raster_path, write=True, workers: int = 1):
     band_name = path_to_geojson.stem
     out_geojson = path_to_geojson.parent / Path(
         str(path_to_geojson.stem) + "_filled.geojson"
     )
     logger.info(f"-- Filling {path_to_geojson} with mean values from {raster_path}")
-    count = 0
-    with fiona.open(path_to_geojson, "r") as geofile:
-        shapes = [feature["geometry"] for feature in geofile]
-        target = len(shapes)
-        # extract the raster values within the polygon
-        for i in track(range(len(shapes))):
-            with rasterio.open(raster_path) as src:
-                try:
-                    out_image, out_transform = mask(src, [shapes[i]], crop=True)
-                    rast_vals.append(int(np.mean(out_image)))
-                    count += 1
-                except:
-                    logger.warning("Mask outside raster extent or nodata")
-                    rast_vals.append(0)
-    gdf = gpd.read_file(path_to_geojson)
-    gdf[band_name] = rast_vals
+    gdf = rasterval_grid(
+        gpd.read_file(path_to_geojson), raster_path, band_name, workers
+    )
     # gdf = gdf.to_crs("EPSG:4326")
     if write:
-        gdf.to_file(out_geojson, driver="GeoJSON")
-        logger.info(f"-- Updated geojson saved to: {out_geojson}")
-        logger.info(f"-- Cells with value: {count}/{target}")
+        save_grid(gdf, out_geojson)
     else:
         return gdf
 
 
-def reproject_bounds(bounds, epsg_in, epsg_out="4326"):
-    nw = (bounds[0], bounds[-1])
-    se = (bounds[2], bounds[1])
-    inProj = CRS(f"epsg:{epsg_in}")
-    outProj = CRS(f"epsg:{epsg_out}")
-    nw_proj = transform(inProj, outProj, nw[0], nw[1])
-    se_proj = transform(inProj, outProj, se[0], se[1])
-    return tuple(reversed(nw_proj)), tuple(reversed(se_proj))
+# Set the to-be-masked SCL values
+SCL_MASK_VALUES = [0, 1, 3, 8, 9, 10, 11]
+
+# Set the nodata value in SCL
+SCL_NODATA_VALUE = 0
+
+
+def classify_scl(scl: np.ndarray) -> np.ndarray:
+    """
+    Classify L2A SCL values as 0 (masked), 1 (clear) or 255 (nodata)
+    """
+    # Contruct the final binary 0-1-255 mask
+    mask = np.zeros(scl.shape, dtype=rasterio.uint8)
+    mask[scl == SCL_NODATA_VALUE] = 255
+    mask[~np.isin(scl, SCL_MASK_VALUES)] = 1
+    return mask
 
 
 def binary_scl(scl_file: Path, raster_fn: Path) -> None:
     """
-    Convert L2A SCL file to binary cloud mask
+    Convert L2A SCL file to binary cloud mask, block by block
     :param scl_file: Path to SCL file
     :param raster_fn: Output binary mask path
     """
     with rasterio.open(scl_file, "r") as src:
-        scl = src.read(1)
+        meta = src.meta.copy()
+        meta["driver"] = "GTiff"
+        dtype = rasterio.uint8
+        meta["dtype"] = dtype
+        meta["nodata"] = 255
 
-    # Set the to-be-masked SCL values
-    scl_mask_values = [0, 1, 3, 8, 9, 10, 11]
-
-    # Set the nodata value in SCL
-    scl_nodata_value = 0
-
-    # Contruct the final binary 0-1-255 mask
-    mask = np.zeros_like(scl)
-    mask[scl == scl_nodata_value] = 255
-    mask[~np.isin(scl, scl_mask_values)] = 1
-
-    meta = src.meta.copy()
-    meta["driver"] = "GTiff"
-    dtype = rasterio.uint8
-    meta["dtype"] = dtype
-    meta["nodata"] = 255
-
-    with rasterio.open(
-        raster_fn,
-        "w+",
-        **meta,
-        compress="deflate",
-        tiled=True,
-        blockxsize=512,
-        blockysize=512,
-    ) as out:
-        # Modify output metadata
-
-        out.write(mask.astype(rasterio.uint8), 1)
+        with rasterio.open(
+            raster_fn,
+            "w+",
+            **meta,
+            compress="deflate",
+            tiled=True,
+            blockxsize=512,
+            blockysize=512,
+        ) as out:
+            for window in iter_windows(src):
+                out.write(classify_scl(src.read(1, window=window)), 1, window=window)
 
 
 def get_raster_extent(raster_path: Path, outfname: Path = None) -> None:
@@ -159,42 +314,128 @@ def reproject_vector(
         return Path(outfname)
 
 
+@profiling.staged("download")
 def down_s2(
-    s2_tile_id: str, date: str, tmp_dir=Path(gettempdir()), bands=["B02", "B08"]
+    s2_tile_id: str,
+    date: str,
+    tmp_dir=Path(gettempdir()),
+    bands=["B02", "B08"],
+    cache_dir: Path = None,
+    cache_size: int = DEFAULT_CACHE_SIZE,
+    max_workers: int = 4,
+    aoi: Tuple[float, float, float, float] = None,
 ):
+    """
+    Download Sentinel-2 L2A COG bands of a tile and date
+    :param s2_tile_id: Sentinel-2 tile id (e.g. 32TQM)
+    :param date: Acquisition date YYYYMMDD
+    :param tmp_dir: Directory of the downloaded product
+    :param bands: Bands to download
+    :param cache_dir: Directory of a download cache shared across runs, files
+                      are hard-linked from the cache into tmp_dir
+    :param cache_size: Size cap in bytes of the download cache
+    :param max_workers: Number of bands downloaded concurrently
+    :param aoi: (min lon, min lat, max lon, max lat) bounds, when set only the
+                COG blocks overlapping them are read with range requests and
+                the download cache is not used
+    """
+    from dggs_tbx.s3io import list_objects, read_aoi, s3_client
+
     # Download the Sentinel-2 data
     if date[5] == 0:
         month = date[6]
     else:
         month = date[5:6]
     prefix = f"sentinel-s2-l2a-cogs/{s2_tile_id[:2]}/{s2_tile_id[2:3]}/{s2_tile_id[3:]}/{date[:4]}/{month}/"
-    client = boto3.client("s3", config=Config(signature_version=UNSIGNED))
+    client = s3_client(max_pool_connections=max(10, max_workers))
     bucket_name = "sentinel-cogs"
-    default_kwargs = {
-        "Bucket": bucket_name,
-        "Prefix": prefix,
-    }
-    response = client.list_objects_v2(**default_kwargs)
-    contents = response.get("Contents")
-    logger.info(" -- S3 response recieved")
-    for resp in contents:
+    cache = None if cache_dir is None else DownloadCache(cache_dir, cache_size)
+    downloads = []
+    for resp in list_objects(client, bucket_name, prefix):
         key = resp["Key"]
         band = key.split("/")[-1].replace(".tif", "")
         if date in resp["Key"] and band in bands:
             product_name = key.split("/")[-2]
             out_dir = tmp_dir / product_name
             out_dir.mkdir(parents=True, exist_ok=True)
-            file_name = out_dir / Path(band + ".tif")
-            client.download_file(bucket_name, resp["Key"], str(file_name))
-            logger.info(f" -- Saved {band} to {file_name}")
+            downloads.append((resp, out_dir / Path(band + ".tif")))
+    logger.info(f" -- S3 listing recieved, {len(downloads)} bands to download")
+    if not downloads:
+        raise FileNotFoundError(f"No {bands} bands found for {s2_tile_id} {date}")
+
+    def download(resp: dict, file_name: Path) -> Path:
+        key = resp["Key"]
+        if aoi is not None:
+            read_aoi(client, bucket_name, key, resp["Size"], aoi, file_name)
+        elif cache is None:
+            client.download_file(bucket_name, key, str(file_name))
+            profiling.count(s3_bytes=resp["Size"])
+        else:
+            cache.get(client, bucket_name, key, resp["ETag"], file_name)
+        logger.info(f" -- Saved {file_name.stem} to {file_name}")
+        return file_name
+
+    # Downloads count their bytes in the download stage of this thread
+    context = contextvars.copy_context()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # Raise the first download error, if any
+        list(
+            executor.map(lambda item: context.copy().run(download, *item), downloads)
+        )
     return out_dir
 
 
+def parse_bounds(bounds: str) -> Tuple[float, float, float, float]:
+    """
+    Parse lon/lat bounds such as "9.1,45.2,9.3,45.4"
+    """
+    try:
+        min_lon, min_lat, max_lon, max_lat = (float(v) for v in bounds.split(","))
+    except ValueError:
+        raise ValueError(
+            f"Invalid bounds {bounds}, expected MIN_LON,MIN_LAT,MAX_LON,MAX_LAT"
+        )
+    return min_lon, min_lat, max_lon, max_lat
+
+
+def parse_res_range(res_range: str) -> List[int]:
+    """
+    Parse an inclusive resolution range such as "5:10"
+    """
+    try:
+        start, stop = (int(res) for res in res_range.split(":"))
+    except ValueError:
+        raise ValueError(f"Invalid resolution range {res_range}, expected MIN:MAX")
+    return list(range(min(start, stop), max(start, stop) + 1))
+
+
+def job_dir(tmp_dir: Path = Path(gettempdir())) -> Path:
+    """
+    New directory of its own for the downloads of one job under tmp_dir.
+    down_s2 always writes a product to the same tmp_dir/<product> directory,
+    jobs on the same product running at once would otherwise remove each
+    other's bands.
+    """
+    tmp_dir = Path(tmp_dir)
+    tmp_dir.mkdir(parents=True, exist_ok=True)
+    return Path(mkdtemp(dir=tmp_dir))
+
+
 def db_connect():
     db = os.getenv("pg_db", "DGGS")
     username = os.getenv("pg_username", "postgres")
     password = os.getenv("pg_pass")
     host = os.getenv("pg_host", "172.18.0.3")
     port = os.getenv("pg_port", "19432")
-    engine = create_engine(f"postgresql://{username}:{password}@{host}:{port}/{db}")
-    return engine
+    return pooled_engine(f"postgresql://{username}:{password}@{host}:{port}/{db}")
+
+
+@lru_cache(maxsize=None)
+def pooled_engine(url: str):
+    """
+    SQLAlchemy engine shared by every call with the same URL, so that its
+    connection pool is reused across tiles
+    """
+    from sqlalchemy import create_engine
+
+    return create_engine(url, pool_size=5, max_overflow=10, pool_pre_ping=True)
@@ -0,0 +1,766 @@
+# Copyright (C) 2024-2025 CS GROUP, https://cs-soprasteria.com
+#
+# This file is part of DGGS Toolbox:
+#
+#     https://github.com/CS-SI/dggs_tbx
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+#
+# DGGS Toolbox is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# DGGS Toolbox is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with DGGS Toolbox. If not, see
+# https://www.gnu.org/licenses/.
+
+"""
+Vectorized zonal statistics of a raster over DGGS cells.
+
+Every pixel centre is transformed to lon/lat in bulk, assigned to the cell
+containing it with a grid specific ``cell_func(lon, lat, resolution)`` and
+reduced per cell with grouped bincounts, instead of masking the raster once
+per cell geometry. Cells smaller than a few pixels are sampled at their centre
+instead, since most of them would not contain any pixel centre.
+"""
+
+import logging
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from contextlib import ExitStack
+from dataclasses import dataclass
+from multiprocessing.shared_memory import SharedMemory
+from pathlib import Path
+from typing import Callable, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.vrt import WarpedVRT
+from rasterio.windows import Window
+from rich.progress import track
+from shapely.geometry import Polygon
+
+from dggs_tbx import profiling
+from dggs_tbx.transforms import extent_lonlat, from_lonlat, to_lonlat
+
+logger = logging.getLogger(__name__)
+
+CellFunc = Callable[[np.ndarray, np.ndarray, int], np.ndarray]
+ValueFunc = Callable[[np.ndarray], np.ndarray]
+# Batches of (cell ids, centre lon, centre lat) of the cells of a lon/lat polygon
+CentreFunc = Callable[
+    [Polygon, int], Iterable[Tuple[np.ndarray, np.ndarray, np.ndarray]]
+]
+
+# Cells smaller than this number of pixels are sampled at their centre
+CENTROID_RATIO = 4.0
+
+
+def pixel_centres(
+    transform, window: Window, offset: Tuple[float, float] = (0.5, 0.5)
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Return the flattened x, y coordinates of the pixel centres of a window
+    :param transform: Affine transform of the raster
+    :param window: Window of the raster
+    :param offset: Sample position inside the pixels, (0.5, 0.5) is the centre
+    """
+    rows = np.arange(window.row_off, window.row_off + window.height) + offset[1]
+    cols = np.arange(window.col_off, window.col_off + window.width) + offset[0]
+    cols, rows = np.meshgrid(cols, rows)
+    xs = transform.a * cols + transform.b * rows + transform.c
+    ys = transform.d * cols + transform.e * rows + transform.f
+    return xs.ravel(), ys.ravel()
+
+
+def window_lonlat(
+    transform, crs, window: Window, offset: Tuple[float, float] = (0.5, 0.5)
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Return the flattened lon, lat coordinates of the pixel centres of a window
+    :param transform: Affine transform of the raster
+    :param crs: CRS of the raster
+    :param window: Window of the raster
+    :param offset: Sample position inside the pixels, (0.5, 0.5) is the centre
+    """
+    xs, ys = pixel_centres(transform, window, offset)
+    return to_lonlat(crs, xs, ys)
+
+
+def point_pixels(transform, xs: np.ndarray, ys: np.ndarray):
+    """
+    Return the row, col of the pixels containing x, y points, the inverse
+    affine transform being applied to all the points at once
+    """
+    inverse = ~transform
+    cols = np.floor(inverse.a * xs + inverse.b * ys + inverse.c).astype(np.int64)
+    rows = np.floor(inverse.d * xs + inverse.e * ys + inverse.f).astype(np.int64)
+    return rows, cols
+
+
+def sample_points(
+    sources, transform, xs: np.ndarray, ys: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Values of every band at x, y points in the CRS of the sources, read from
+    the window bounding the points
+    :param sources: Datasets sharing the same pixel grid
+    :param transform: Affine transform of the pixel grid
+    :return: (bands, points) values of the points inside the rasters and the
+             mask of these points
+    """
+    rows, cols = point_pixels(transform, np.asarray(xs), np.asarray(ys))
+    height, width = sources[0].shape
+    inside = (rows >= 0) & (rows < height) & (cols >= 0) & (cols < width)
+    rows, cols = rows[inside], cols[inside]
+    if len(rows) == 0:
+        dtype = np.result_type(*(src.dtypes[0] for src in sources))
+        return np.empty((len(sources), 0), dtype=dtype), inside
+    window = Window(
+        cols.min(),
+        rows.min(),
+        cols.max() - cols.min() + 1,
+        rows.max() - rows.min() + 1,
+    )
+    rows -= window.row_off
+    cols -= window.col_off
+    return (
+        np.stack([src.read(1, window=window)[rows, cols] for src in sources]),
+        inside,
+    )
+
+
+def valid_mask(stack: np.ndarray, nodata) -> np.ndarray:
+    """
+    Mask of the valid values of a (bands, pixels) stack
+    :param nodata: Nodata value, or list of nodata values per band
+    """
+    if not isinstance(nodata, (list, tuple)):
+        nodata = [nodata] * len(stack)
+    return np.stack(
+        [
+            np.ones(v.shape, dtype=bool) if nd is None else v != nd
+            for v, nd in zip(stack, nodata)
+        ]
+    )
+
+
+@dataclass
+class ZonalStats:
+    """
+    Per cell accumulators of a (bands, pixels) stack. Sums, counts, minimums and
+    maximums of partial stats computed on disjoint pixels can be merged, so a
+    raster can be aggregated window by window.
+    :param cells: Sorted unique cell ids
+    :param sums: (bands, cells) sums of the valid values
+    :param counts: (bands, cells) number (or weight) of valid values
+    :param mins: (bands, cells) minimum valid value, +inf if none
+    :param maxs: (bands, cells) maximum valid value, -inf if none
+    """
+
+    cells: np.ndarray
+    sums: np.ndarray
+    counts: np.ndarray
+    mins: np.ndarray
+    maxs: np.ndarray
+
+    @classmethod
+    def empty(cls, n_bands: int, dtype=np.uint64) -> "ZonalStats":
+        return cls(
+            np.empty(0, dtype=dtype),
+            *(np.empty((n_bands, 0)) for _ in range(4)),
+        )
+
+    @classmethod
+    def from_sorted(
+        cls, cells: np.ndarray, values: np.ndarray, weights: np.ndarray
+    ) -> "ZonalStats":
+        """
+        Reduce values already grouped by cell id
+        :param cells: Cell id of every pixel, sorted
+        :param values: (bands, pixels) values in the same order
+        :param weights: (bands, pixels) weight of every value, 0 if not valid
+        """
+        if len(cells) == 0:
+            return cls.empty(len(values), cells.dtype)
+        starts = np.flatnonzero(np.r_[True, cells[1:] != cells[:-1]])
+        values = values.astype(np.float64)
+        valid = weights > 0
+        return cls(
+            cells[starts],
+            np.add.reduceat(values * weights, starts, axis=1),
+            np.add.reduceat(weights, starts, axis=1),
+            np.minimum.reduceat(np.where(valid, values, np.inf), starts, axis=1),
+            np.maximum.reduceat(np.where(valid, values, -np.inf), starts, axis=1),
+        )
+
+    @classmethod
+    def from_pixels(cls, cells: np.ndarray, values: np.ndarray, nodata=None):
+        """
+        Grouped statistics of pixel values per cell id
+        :param cells: Cell id of every pixel
+        :param values: (bands, pixels) array of values, or 1D array of one band
+        :param nodata: Value ignored in the statistics, or list of values per band
+        """
+        stack = np.atleast_2d(values)
+        order = np.argsort(cells, kind="stable")
+        weights = valid_mask(stack, nodata).astype(np.float64)
+        return cls.from_sorted(cells[order], stack[:, order], weights[:, order])
+
+    @classmethod
+    def merge(cls, partials: List["ZonalStats"]) -> "ZonalStats":
+        """
+        Merge partial stats computed on disjoint pixels
+        """
+        partials = [p for p in partials if len(p.cells)] or partials[:1]
+        cells = np.concatenate([p.cells for p in partials])
+        order = np.argsort(cells, kind="stable")
+        cells = cells[order]
+        starts = np.flatnonzero(np.r_[True, cells[1:] != cells[:-1]])
+
+        def regroup(name, ufunc):
+            array = np.concatenate([getattr(p, name) for p in partials], axis=1)
+            return ufunc.reduceat(array[:, order], starts, axis=1)
+
+        return cls(
+            cells[starts],
+            regroup("sums", np.add),
+            regroup("counts", np.add),
+            regroup("mins", np.minimum),
+            regroup("maxs", np.maximum),
+        )
+
+    @classmethod
+    def stack_bands(cls, bands: List["ZonalStats"]) -> "ZonalStats":
+        """
+        Stack single band stats computed over the same cells
+        """
+        return cls(
+            bands[0].cells,
+            *(
+                np.concatenate([getattr(b, name) for b in bands])
+                for name in ("sums", "counts", "mins", "maxs")
+            ),
+        )
+
+    def to_parent(self, parent_cells: np.ndarray) -> "ZonalStats":
+        """
+        Roll the stats up to coarser cells
+        :param parent_cells: Parent cell id of every cell
+        """
+        return ZonalStats.merge(
+            [ZonalStats(parent_cells, self.sums, self.counts, self.mins, self.maxs)]
+        )
+
+    @property
+    def means(self) -> np.ndarray:
+        return np.divide(
+            self.sums, self.counts, out=np.zeros_like(self.sums), where=self.counts > 0
+        )
+
+    def to_frame(self, band_names: List[str], stats=("mean",)) -> pd.DataFrame:
+        """
+        Integer statistics per cell id, one column per band (and statistic when
+        several are requested), 0 for cells without valid pixels
+        :param band_names: Name of every band
+        :param stats: Statistics among mean, sum, count, min and max
+        """
+        arrays = {
+            "mean": self.means,
+            "sum": self.sums,
+            "count": self.counts,
+            "min": np.where(np.isfinite(self.mins), self.mins, 0),
+            "max": np.where(np.isfinite(self.maxs), self.maxs, 0),
+        }
+        columns = {}
+        for stat in stats:
+            for name, values in zip(band_names, arrays[stat]):
+                column = name if len(stats) == 1 else f"{name}_{stat}"
+                columns[column] = values.astype(int)
+        return pd.DataFrame(columns, index=self.cells)
+
+
+class ZonalAccumulator:
+    """
+    Merge partial stats as windows are processed. Partials are buffered and
+    merged once they outgrow the merged stats, which keeps the merge cost
+    linear in the number of cells.
+    """
+
+    def __init__(self, n_bands: int):
+        self.stats = ZonalStats.empty(n_bands)
+        self.buffer = []
+        self.buffered = 0
+
+    def add(self, partial: ZonalStats) -> None:
+        self.buffer.append(partial)
+        self.buffered += len(partial.cells)
+        if self.buffered > max(len(self.stats.cells), 2**20):
+            self._flush()
+
+    def _flush(self) -> None:
+        if self.buffer:
+            self.stats = ZonalStats.merge([self.stats] + self.buffer)
+            self.buffer, self.buffered = [], 0
+
+    def result(self) -> ZonalStats:
+        self._flush()
+        return self.stats
+
+
+def iter_windows(src, max_pixels: int = 2**20):
+    """
+    Iterate over windows of a raster aligned to its internal blocks, e.g. the
+    tiles of a COG. Neighbouring blocks are grouped up to max_pixels.
+    """
+    block_height, block_width = src.block_shapes[0]
+    if block_width >= src.width:
+        # Striped raster: group rows of blocks
+        width = src.width
+        height = max(1, max_pixels // (width * block_height)) * block_height
+    else:
+        height = block_height
+        width = max(1, max_pixels // (block_height * block_width)) * block_width
+    for row_off in range(0, src.height, height):
+        for col_off in range(0, src.width, width):
+            yield Window(
+                col_off,
+                row_off,
+                min(width, src.width - col_off),
+                min(height, src.height - row_off),
+            )
+
+
+def overview_level(raster_path: Path, max_pixel_area: float) -> Optional[int]:
+    """
+    Return the coarsest overview level of a projected raster whose pixel area
+    does not exceed max_pixel_area, None when full resolution is needed
+    """
+    level = None
+    with rasterio.open(raster_path, "r") as src:
+        if src.crs is None or not src.crs.is_projected:
+            return None
+        pixel_area = abs(src.transform.a * src.transform.e)
+        for i, factor in enumerate(src.overviews(1)):
+            if pixel_area * factor**2 <= max_pixel_area:
+                level = i
+    return level
+
+
+def open_raster(raster_path: Path, level: Optional[int] = None):
+    """
+    Open a raster, or one of its overview levels
+    """
+    if level is None:
+        return rasterio.open(raster_path, "r")
+    return rasterio.open(raster_path, "r", overview_level=level)
+
+
+def open_band_stack(
+    stack: ExitStack,
+    list_bands: List[Path],
+    resampling,
+    max_pixel_area: Optional[float] = None,
+):
+    """
+    Open the bands on the pixel grid of the finest one
+    :param max_pixel_area: Read from the coarsest overviews whose pixel area
+                           does not exceed this value, full resolution if None
+    :return: Reference dataset and one dataset (or WarpedVRT) per band
+    """
+    ref_path = reference_raster(list_bands)
+    level = None
+    if max_pixel_area is not None:
+        level = overview_level(ref_path, max_pixel_area)
+    ref = stack.enter_context(open_raster(ref_path, level))
+    if level is not None:
+        logger.info(f"-- Reading overview level {level}, {ref.width}x{ref.height}")
+    sources = []
+    for raster_path in list_bands:
+        band_level = None
+        if level is not None:
+            # Overview of the band not coarser than the reference one
+            band_level = overview_level(
+                raster_path, abs(ref.transform.a * ref.transform.e)
+            )
+        src = stack.enter_context(open_raster(raster_path, band_level))
+        if src.transform != ref.transform or src.shape != ref.shape:
+            src = stack.enter_context(
+                WarpedVRT(
+                    src,
+                    crs=ref.crs,
+                    transform=ref.transform,
+                    width=ref.width,
+                    height=ref.height,
+                    resampling=resampling,
+                )
+            )
+        sources.append(src)
+    return ref, sources
+
+
+def band_name(raster_path: Path) -> str:
+    """
+    Return the band name of a raster file named after its band, e.g. B02.tif
+    """
+    return raster_path.parts[-1].replace(".tif", "")
+
+
+def reference_raster(list_bands: List[Path]) -> Path:
+    """
+    Return the raster with the finest pixel size, used as the common pixel grid
+    """
+    pixel_sizes = []
+    for raster_path in list_bands:
+        with rasterio.open(raster_path, "r") as src:
+            pixel_sizes.append(abs(src.transform.a * src.transform.e))
+    return list_bands[int(np.argmin(pixel_sizes))]
+
+
+def window_stats(
+    values: np.ndarray,
+    transform,
+    crs,
+    window: Window,
+    cell_func: CellFunc,
+    resolution: int,
+    nodata=None,
+    value_func: Optional[ValueFunc] = None,
+    labels=None,
+    cell_map=None,
+) -> ZonalStats:
+    """
+    Statistics of a (bands, rows, cols) window of pixels for every cell
+    :param value_func: Function mapping the window to the (bands, rows, cols)
+                       values to aggregate, applied before the cell assignment
+    :param labels: Cell labels of the pixel grid (see dggs_tbx.labels),
+                   replacing the cell assignment
+    :param cell_map: Pixel to cell map of the window (see
+                     dggs_tbx.cellmap.CellMap.window), replacing the cell
+                     assignment
+    """
+    if value_func is not None:
+        values = value_func(values)
+    if cell_map is not None:
+        return cell_map.aggregate(values, nodata)
+    if labels is not None:
+        cells = labels.window(window).ravel()
+    else:
+        lon, lat = window_lonlat(transform, crs, window)
+        cells = cell_func(lon, lat, resolution)
+    return ZonalStats.from_pixels(cells, values.reshape(len(values), -1), nodata)
+
+
+def centroid_sampled(
+    ref, cell_area: Optional[float], centroid_ratio: float = CENTROID_RATIO
+) -> bool:
+    """
+    Whether cells of cell_area (m2) are sampled at their centre over the
+    pixel grid of the opened raster ref rather than aggregated, see
+    zonal_stats
+    """
+    return (
+        cell_area is not None
+        and ref.crs.is_projected
+        and cell_area < centroid_ratio * abs(ref.transform.a * ref.transform.e)
+    )
+
+
+def centroid_stats(
+    ref,
+    sources,
+    cell_centres: CentreFunc,
+    resolution: int,
+    nodata=None,
+    value_func: Optional[ValueFunc] = None,
+) -> ZonalStats:
+    """
+    Statistics of the cells of the raster extent from the single pixel
+    containing their centre, the fast path of cells smaller than the pixels
+    :param ref: Reference dataset of the pixel grid
+    :param sources: Datasets of the bands on the pixel grid of ref
+    :param cell_centres: Function streaming the cells of a lon/lat extent with
+                         their centres
+    :param value_func: Function mapping (bands, rows, cols) values to the
+                       values to aggregate (see zonal_stats)
+    """
+    accumulator = ZonalAccumulator(len(nodata))
+    for cells, lon, lat in cell_centres(extent_lonlat(ref.bounds, ref.crs), resolution):
+        xs, ys = from_lonlat(ref.crs, lon, lat)
+        values, inside = sample_points(sources, ref.transform, xs, ys)
+        if value_func is not None:
+            values = value_func(values[:, np.newaxis]).reshape(len(nodata), -1)
+        accumulator.add(ZonalStats.from_pixels(cells[inside], values, nodata))
+    return accumulator.result()
+
+
+def _shared_window_stats(shm_name: str, shape, dtype, *args) -> ZonalStats:
+    # Process pool task: the pixels are read from the shared memory block
+    shm = SharedMemory(name=shm_name)
+    try:
+        return window_stats(np.ndarray(shape, dtype, buffer=shm.buf), *args)
+    finally:
+        shm.close()
+
+
+def _parallel_zonal_stats(
+    ref,
+    sources,
+    windows,
+    cell_func,
+    resolution,
+    nodata,
+    workers,
+    value_func=None,
+    labels=None,
+    cell_map=None,
+) -> ZonalStats:
+    """
+    Aggregate windows on a process pool. Each window of the band stack is read
+    into a shared memory block that the worker maps without copying, and at
+    most two windows per worker are in flight.
+    """
+    accumulator = ZonalAccumulator(len(nodata))
+    dtype = np.result_type(*(src.dtypes[0] for src in sources))
+    pending = {}
+    shm = values = None
+
+    def release(block: SharedMemory) -> None:
+        block.close()
+        block.unlink()
+
+    def collect(futures):
+        for future in futures:
+            block = pending.pop(future)
+            try:
+                accumulator.add(future.result())
+            finally:
+                release(block)
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for window in track(windows, description="Aggregating..."):
+                shape = (len(sources), window.height, window.width)
+                shm = SharedMemory(
+                    create=True, size=int(np.prod(shape)) * dtype.itemsize
+                )
+                values = np.ndarray(shape, dtype, buffer=shm.buf)
+                for band, src in enumerate(sources):
+                    values[band] = src.read(1, window=window)
+                values = None
+                future = pool.submit(
+                    _shared_window_stats,
+                    shm.name,
+                    shape,
+                    dtype,
+                    ref.transform,
+                    ref.crs,
+                    window,
+                    cell_func,
+                    resolution,
+                    nodata,
+                    value_func,
+                    labels,
+                    # Workers receive the part of the map of their window only
+                    None if cell_map is None else cell_map.window(window),
+                )
+                pending[future], shm = shm, None
+                if len(pending) >= 2 * workers:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+            collect(list(pending))
+    finally:
+        # Blocks left by a failed read, submit or worker would stay in
+        # /dev/shm, the pool has finished with them once shut down. A view
+        # of the block being filled prevents closing it.
+        values = None
+        for block in [*pending.values(), shm]:
+            if block is not None:
+                release(block)
+    return accumulator.result()
+
+
+@profiling.staged("aggregation")
+def zonal_stats(
+    list_bands: List[Path],
+    cell_func: CellFunc,
+    resolution: int,
+    cell_map=None,
+    resampling: Resampling = Resampling.nearest,
+    max_pixels: int = 2**20,
+    workers: int = 1,
+    cell_area: Optional[float] = None,
+    overview_budget: float = 1e-4,
+    value_func: Optional[ValueFunc] = None,
+    value_nodata=None,
+    dask_client=None,
+    cell_centres: Optional[CentreFunc] = None,
+    centroid_ratio: float = CENTROID_RATIO,
+    labels=None,
+) -> ZonalStats:
+    """
+    Statistics of every band for each DGGS cell containing a pixel centre.
+    Bands are resampled on the pixel grid of the finest one and streamed block
+    by block, all bands being reduced over a single cell assignment. Cells
+    smaller than centroid_ratio pixels take the value of the pixel containing
+    their centre instead (see centroid_stats).
+    :param list_bands: Paths to the single band rasters
+    :param cell_func: Function mapping lon, lat arrays to cell ids
+    :param resolution: DGGS resolution
+    :param cell_map: Precomputed pixel to cell map of the finest band grid
+                     (see dggs_tbx.cellmap), replacing the cell assignment of
+                     every window, unused when the cells are sampled at their
+                     centre
+    :param resampling: Resampling method of the coarser bands
+    :param max_pixels: Approximate number of pixels read at once
+    :param workers: Number of processes aggregating the windows
+    :param cell_area: Area of the cells in m2, enabling overview reads
+    :param overview_budget: Maximum ratio of the pixel area to the cell area
+                            when reading from the raster overviews, 0 to always
+                            read full resolution pixels
+    :param value_func: Function deriving the (bands, rows, cols) values to
+                       aggregate from every window of the band stack, e.g. a
+                       classification, so that no intermediate raster is needed
+    :param value_nodata: List of the nodata values of the derived bands
+    :param dask_client: distributed Client aggregating the windows on a Dask
+                        cluster instead of local processes, see
+                        dggs_tbx.dask_backend
+    :param cell_centres: Function streaming the cells of a lon/lat extent with
+                         their centres, enabling the centroid sampling
+    :param centroid_ratio: Ratio of the cell area to the pixel area below
+                           which cells are sampled at their centre, 0 to
+                           always aggregate the pixels
+    :param labels: Memory-mapped cell labels of the finest band grid (see
+                   dggs_tbx.labels), replacing the cell assignment, unused
+                   when the cells are sampled at their centre
+    """
+    max_pixel_area = None
+    if (
+        cell_area is not None
+        and overview_budget > 0
+        and cell_map is None
+        and labels is None
+    ):
+        max_pixel_area = cell_area * overview_budget
+    with ExitStack() as stack:
+        ref, sources = open_band_stack(stack, list_bands, resampling, max_pixel_area)
+        if labels is not None and (
+            labels.resolution != resolution or not labels.matches(ref)
+        ):
+            raise ValueError(
+                f"Cell labels {labels.path} do not match the pixel grid of "
+                f"{ref.name} at resolution {resolution}"
+            )
+        nodata = [src.nodata for src in sources]
+        profiling.count(
+            pixels=ref.width * ref.height,
+            disk_bytes=sum(
+                ref.width * ref.height * np.dtype(src.dtypes[0]).itemsize
+                for src in sources
+            ),
+        )
+        if value_func is not None:
+            nodata = list(value_nodata)
+        if cell_centres is not None and centroid_sampled(
+            ref, cell_area, centroid_ratio
+        ):
+            # Labels or cell maps, if any, are not needed
+            pixel_area = abs(ref.transform.a * ref.transform.e)
+            logger.info(
+                f"-- Cells of {cell_area:.1f} m2 over pixels of {pixel_area:.1f} m2, "
+                "sampling the cell centres"
+            )
+            stats = centroid_stats(
+                ref, sources, cell_centres, resolution, nodata, value_func
+            )
+            profiling.count(cells=len(stats.cells))
+            return stats
+        windows = list(iter_windows(ref, max_pixels))
+        if dask_client is not None:
+            from dggs_tbx.dask_backend import dask_zonal_stats
+
+            stats = dask_zonal_stats(
+                dask_client,
+                list_bands,
+                windows,
+                resampling,
+                max_pixel_area,
+                cell_func,
+                resolution,
+                nodata,
+                value_func,
+                labels=labels,
+                cell_map=cell_map,
+            )
+        elif workers > 1:
+            stats = _parallel_zonal_stats(
+                ref,
+                sources,
+                windows,
+                cell_func,
+                resolution,
+                nodata,
+                workers,
+                value_func,
+                labels,
+                cell_map,
+            )
+        else:
+            accumulator = ZonalAccumulator(len(nodata))
+            for window in track(windows, description="Aggregating..."):
+                values = np.stack([src.read(1, window=window) for src in sources])
+                accumulator.add(
+                    window_stats(
+                        values,
+                        ref.transform,
+                        ref.crs,
+                        window,
+                        cell_func,
+                        resolution,
+                        nodata,
+                        value_func,
+                        labels,
+                        None if cell_map is None else cell_map.window(window),
+                    )
+                )
+            stats = accumulator.result()
+    profiling.count(cells=len(stats.cells))
+    logger.info(f"-- Aggregated {len(list_bands)} bands over {len(stats.cells)} cells")
+    return stats
+
+
+def zonal_means(
+    list_bands: List[Path],
+    cell_func: CellFunc,
+    resolution: int,
+    cell_map=None,
+    resampling: Resampling = Resampling.nearest,
+    workers: int = 1,
+    cell_area: Optional[float] = None,
+    overview_budget: float = 1e-4,
+) -> pd.DataFrame:
+    """
+    Integer mean of every band for each DGGS cell containing a pixel centre,
+    0 for cells without valid pixels (see zonal_stats)
+    :return: DataFrame indexed by cell id with one column per band, named after
+             the band files
+    """
+    band_names = [band_name(path) for path in list_bands]
+    stats = zonal_stats(
+        list_bands,
+        cell_func,
+        resolution,
+        cell_map,
+        resampling,
+        workers=workers,
+        cell_area=cell_area,
+        overview_budget=overview_budget,
+    )
+    return stats.to_frame(band_names)
@@ -29,4 +29,60 @@
     - https://docs.pytest.org/en/stable/writing_plugins.html
 """
 
-# import pytest
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+
+
+@pytest.fixture
+def s2_band(tmp_path):
+    """Synthetic 10m UTM band named like a Sentinel-2 COG asset"""
+    raster_path = tmp_path / "B02.tif"
+    data = np.random.default_rng(0).integers(1, 10000, (600, 600)).astype("uint16")
+    with rasterio.open(
+        raster_path,
+        "w",
+        driver="GTiff",
+        height=600,
+        width=600,
+        count=1,
+        dtype="uint16",
+        crs="EPSG:32632",
+        transform=from_origin(300000, 5000040, 10, 10),
+        nodata=0,
+        tiled=True,
+        blockxsize=256,
+        blockysize=256,
+    ) as dst:
+        dst.write(data, 1)
+    return raster_path
+
+
+S2_PREFIX = "sentinel-s2-l2a-cogs/32/T/QM/2022/9/S2B_32TQM_20220902_0_L2A"
+
+
+@pytest.fixture
+def s2_bucket(monkeypatch, s2_band):
+    """Local S3 stand-in holding a Sentinel-2 product with two bands"""
+    moto = pytest.importorskip("moto")
+    boto3 = pytest.importorskip("boto3")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-west-2")
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    with moto.mock_aws():
+        client = boto3.client("s3", region_name="us-west-2")
+        client.create_bucket(
+            Bucket="sentinel-cogs",
+            ACL="public-read",
+            CreateBucketConfiguration={"LocationConstraint": "us-west-2"},
+        )
+        for band in ("B02", "B08"):
+            # The public Sentinel-2 bucket is read without credentials
+            client.upload_file(
+                str(s2_band),
+                "sentinel-cogs",
+                f"{S2_PREFIX}/{band}.tif",
+                ExtraArgs={"ACL": "public-read"},
+            )
+        yield client
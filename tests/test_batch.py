@@ -0,0 +1,252 @@
+# Copyright (C) 2024-2025 CS GROUP, https://cs-soprasteria.com
+#
+# This file is part of DGGS Toolbox:
+#
+#     https://github.com/CS-SI/dggs_tbx
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+#
+# DGGS Toolbox is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# DGGS Toolbox is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with DGGS Toolbox. If not, see
+# https://www.gnu.org/licenses/.
+
+
+import os
+
+import pytest
+
+from dggs_tbx import h3_tbx, main, pgload, utils
+from dggs_tbx.batch import Job, JobManifest, read_jobs, run_batch, run_job
+from dggs_tbx.pipeline import pipeline_batch
+from dggs_tbx.zonal import CENTROID_RATIO
+
+__author__ = "CS GROUP (Benatia Fahd, Nicolas Vila)"
+
+
+def test_read_jobs(tmp_path):
+    jobs_path = tmp_path / "jobs.csv"
+    jobs_path.write_text(
+        "date,tile,resolution,grid\n"
+        "# comment\n"
+        "20220902,32TQM,7,h3\n"
+        "\n"
+        "20220902, 32TQM, 5:9, rpix\n"
+    )
+    assert read_jobs(jobs_path) == [
+        Job("32TQM", "20220902", "h3", "7"),
+        Job("32TQM", "20220902", "rpix", "5:9"),
+    ]
+    jobs_path.write_text("32TQM 20220902 h3 7\n32TQM 20220902 s2 7\n")
+    with pytest.raises(ValueError, match="jobs.csv:2"):
+        read_jobs(jobs_path)
+
+
+def fake_job(job: Job, table_name: str, calls_dir, fail=()) -> float:
+    # Leave a trace of every run, the batch runs jobs in other processes
+    (calls_dir / f"{job.tile}_{os.getpid()}_{len(list(calls_dir.iterdir()))}").touch()
+    if job.tile in fail:
+        raise RuntimeError(f"{job.tile} failed")
+    return 1.0
+
+
+def test_batch_resume(tmp_path):
+    jobs = [Job(tile, "20220902", "h3", "7") for tile in ("A", "B", "C", "A")]
+    manifest_path = tmp_path / "manifest.sqlite"
+    first, second = tmp_path / "first", tmp_path / "second"
+    first.mkdir()
+    second.mkdir()
+    indexed = []
+    counts = run_batch(
+        jobs,
+        manifest_path,
+        "t",
+        runner=fake_job,
+        indexer=indexed.append,
+        calls_dir=first,
+        fail=("B",),
+    )
+    assert counts == {"done": 2, "failed": 1}
+    assert len(list(first.iterdir())) == 3
+    # Only the failed job runs again
+    counts = run_batch(
+        jobs,
+        manifest_path,
+        "t",
+        runner=fake_job,
+        indexer=indexed.append,
+        calls_dir=second,
+    )
+    assert counts == {"done": 3}
+    # Tables are indexed once per batch
+    assert indexed == [{"t_h3"}, {"t_h3"}]
+    assert [p.name.split("_")[0] for p in second.iterdir()] == ["B"]
+    with JobManifest(manifest_path) as manifest:
+        assert manifest.pending(jobs) == []
+
+
+class FakeLoader:
+    """PostGISLoader keeping the loaded frames"""
+
+    loaded = []
+
+    def __init__(self, engine, table_name, **kwargs):
+        self.table_name = table_name
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+    def load(self, df, index=True):
+        self.loaded.append((self.table_name, df))
+
+
+def test_jobs_same_product(s2_bucket, tmp_path, monkeypatch):
+    monkeypatch.setattr(pgload, "PostGISLoader", FakeLoader)
+    monkeypatch.setattr(h3_tbx, "db_connect", lambda: None)
+    monkeypatch.setattr(FakeLoader, "loaded", [])
+    products = tmp_path / "products"
+    down_s2 = h3_tbx.down_s2
+    nested = []
+
+    def down_s2_and_run(*args, **kwargs):
+        out_dir = down_s2(*args, **kwargs)
+        if not nested:
+            # A job on the same product finishes while this one has its
+            # bands downloaded but not read yet
+            nested.append(True)
+            run_job(Job("32TQM", "20220902", "h3", "8"), "t", **job_kwargs)
+        return out_dir
+
+    monkeypatch.setattr(h3_tbx, "down_s2", down_s2_and_run)
+    job_kwargs = dict(bands=["B02"], tmp_dir=products, ids_only=True)
+    run_job(Job("32TQM", "20220902", "h3", "7"), "t", **job_kwargs)
+    assert [(name, len(df) > 0) for name, df in FakeLoader.loaded] == [
+        ("t_h3", True),
+        ("t_h3", True),
+    ]
+    assert not list(products.rglob("*.tif"))
+
+
+class FailingLoader(FakeLoader):
+    def load(self, df, index=True):
+        raise RuntimeError("load failed")
+
+
+def test_failed_job_inputs(s2_bucket, tmp_path, monkeypatch):
+    monkeypatch.setattr(pgload, "PostGISLoader", FailingLoader)
+    monkeypatch.setattr(h3_tbx, "db_connect", lambda: None)
+    products = tmp_path / "products"
+    job_kwargs = dict(bands=["B02"], tmp_dir=products, ids_only=True)
+    with pytest.raises(RuntimeError, match="load failed"):
+        run_job(Job("32TQM", "20220902", "h3", "7"), "t", **job_kwargs)
+    # No download either
+    with pytest.raises(FileNotFoundError):
+        run_job(Job("32TQM", "20220903", "h3", "7"), "t", **job_kwargs)
+    # The download directories of failed jobs are removed
+    assert list(products.iterdir()) == []
+
+
+def test_command_indexes_once(s2_bucket, tmp_path, monkeypatch):
+    monkeypatch.setattr(pgload, "PostGISLoader", FakeLoader)
+    monkeypatch.setattr(h3_tbx, "db_connect", lambda: None)
+    monkeypatch.setattr(utils, "db_connect", lambda: None)
+    monkeypatch.setattr(FakeLoader, "loaded", [])
+    indexed = []
+    monkeypatch.setattr(
+        pgload, "index_table", lambda engine, name: indexed.append(name)
+    )
+    main.cog2h3db(
+        "32TQM", "20220902", tmp_path, res_range="7:8", bands=["B02"], ids_only=True
+    )
+    # Per-tile loaders leave the indexes to the command, built once
+    assert [name for name, _ in FakeLoader.loaded] == ["test_table"] * 2
+    assert indexed == ["test_table"]
+
+def test_job_centroid_ratio(s2_bucket, tmp_path, monkeypatch):
+    monkeypatch.setattr(pgload, "PostGISLoader", FakeLoader)
+    monkeypatch.setattr(h3_tbx, "db_connect", lambda: None)
+    monkeypatch.setattr(FakeLoader, "loaded", [])
+    zonal_stats = h3_tbx.h3_zonal_stats
+    ratios = []
+
+    def record_ratio(*args, **kwargs):
+        ratios.append(kwargs["centroid_ratio"])
+        return zonal_stats(*args, **kwargs)
+
+    monkeypatch.setattr(h3_tbx, "h3_zonal_stats", record_ratio)
+    job_kwargs = dict(bands=["B02"], tmp_dir=tmp_path, ids_only=True)
+    run_job(Job("32TQM", "20220902", "h3", "7"), "t", **job_kwargs)
+    run_job(Job("32TQM", "20220902", "h3", "7"), "t", centroid_ratio=0, **job_kwargs)
+    assert ratios == [CENTROID_RATIO, 0]
+
+
+def test_pipeline(s2_bucket, tmp_path):
+    loaded = []
+
+    def collect(job, table_name, levels):
+        loaded.append((job, table_name, levels))
+
+    indexed = []
+
+    jobs = [
+        Job("32TQM", "20220902", "h3", "7:8"),
+        Job("32TQN", "20220902", "h3", "7"),
+    ]
+    counts = pipeline_batch(
+        jobs,
+        "t",
+        manifest_path=tmp_path / "manifest.sqlite",
+        bands=["B02"],
+        tmp_dir=tmp_path / "products",
+        loader=collect,
+        indexer=indexed.append,
+        ids_only=True,
+    )
+    assert counts == {"done": 1, "failed": 1}
+    assert indexed == [{"t_h3"}]
+    [(job, table_name, levels)] = loaded
+    assert job == jobs[0] and table_name == "t"
+    assert [resolution for resolution, _ in levels] == [8, 7]
+    assert levels[0][1].columns.tolist() == [
+        "B02",
+        "simulated",
+        "resolution",
+        "grid_name",
+    ]
+    # Downloaded products are removed once aggregated
+    assert not list((tmp_path / "products").rglob("*.tif"))
+
+
+def test_pipeline_same_product(s2_bucket, tmp_path):
+    loaded = []
+    jobs = [
+        Job("32TQM", "20220902", "h3", "7"),
+        Job("32TQM", "20220902", "h3", "8"),
+        Job("32TQM", "20220902", "rpix", "9"),
+    ]
+    counts = pipeline_batch(
+        jobs,
+        "t",
+        bands=["B02"],
+        tmp_dir=tmp_path / "products",
+        download_slots=3,
+        loader=lambda job, table_name, levels: loaded.append(job),
+        indexer=None,
+        ids_only=True,
+    )
+    # Removing the inputs of a job leaves the other downloads of the product
+    assert counts == {"done": 3}
+    assert sorted(loaded, key=jobs.index) == jobs
+    assert not list((tmp_path / "products").rglob("*.tif"))
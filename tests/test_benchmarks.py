@@ -0,0 +1,113 @@
+# Copyright (C) 2024-2025 CS GROUP, https://cs-soprasteria.com
+#
+# This file is part of DGGS Toolbox:
+#
+#     https://github.com/CS-SI/dggs_tbx
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+#
+# DGGS Toolbox is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# DGGS Toolbox is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with DGGS Toolbox. If not, see
+# https://www.gnu.org/licenses/.
+
+
+import importlib.util
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+from typer.testing import CliRunner
+
+__author__ = "CS GROUP (Benatia Fahd, Nicolas Vila)"
+
+BENCH_PATH = Path(__file__).parents[1] / "benchmarks" / "bench_dggs.py"
+spec = importlib.util.spec_from_file_location("bench_dggs", BENCH_PATH)
+bench_dggs = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(bench_dggs)
+
+
+def result(case: str, seconds: float, peak_rss_mb: float) -> dict:
+    return {
+        "case": case,
+        "resolution": 9,
+        "seconds": seconds,
+        "peak_rss_mb": peak_rss_mb,
+    }
+
+
+def test_compare_results():
+    base = [result("h3_zonal", 2.0, 100.0), result("rpix_zonal", 4.0, 200.0)]
+    assert [row[-1] for row in bench_dggs.compare_results(base, base, 0.2)] == [
+        False,
+        False,
+    ]
+    new = [
+        result("h3_zonal", 2.2, 100.0),
+        result("rpix_zonal", 4.0, 300.0),
+        result("only_new", 1.0, 1.0),
+    ]
+    rows = bench_dggs.compare_results(base, new, 0.2)
+    # Within the tolerance, memory regression, case missing from the base
+    assert [(name, regression) for name, *_, regression in rows] == [
+        ("h3_zonal", False),
+        ("rpix_zonal", True),
+    ]
+    assert rows[1][2:4] == (1.0, 1.5)
+
+
+def test_compare_command(tmp_path):
+    meta = {"size": 1024, "cpu_count": 2, "machine": "x86_64"}
+    paths = []
+    for name, seconds in (("base", 2.0), ("new", 3.0)):
+        path = tmp_path / f"{name}.json"
+        path.write_text(
+            json.dumps({"meta": meta, "results": [result("h3_zonal", seconds, 1.0)]})
+        )
+        paths.append(str(path))
+    runner = CliRunner()
+    same = runner.invoke(bench_dggs.app, ["compare", paths[0], paths[0]])
+    assert same.exit_code == 0, same.output
+    slower = runner.invoke(bench_dggs.app, ["compare", *paths])
+    assert slower.exit_code == 1
+    assert "REGRESSION" in slower.output
+
+
+def test_run_command(tmp_path):
+    # Cases run in spawned processes, which import the script by its path
+    out = tmp_path / "results.json"
+    subprocess.run(
+        [
+            sys.executable,
+            str(BENCH_PATH),
+            "run",
+            "--out",
+            str(out),
+            "--cases",
+            "grid_h3,zonal_h3",
+            "--resolutions",
+            "5",
+            "--size",
+            "600",
+            "--repeat",
+            "1",
+        ],
+        check=True,
+    )
+    grid, zonal = json.loads(out.read_text())["results"]
+    for row in (grid, zonal):
+        assert row["resolution"] == 5
+        assert row["cells"] > 0 and row["cells_per_s"] > 0
+        assert row["peak_rss_mb"] > 0
+    assert grid["pixels_per_s"] is None
+    assert zonal["pixels_per_s"] > 0
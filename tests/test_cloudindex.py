@@ -0,0 +1,137 @@
+# Copyright (C) 2024-2025 CS GROUP, https://cs-soprasteria.com
+#
+# This file is part of DGGS Toolbox:
+#
+#     https://github.com/CS-SI/dggs_tbx
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+#
+# DGGS Toolbox is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# DGGS Toolbox is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with DGGS Toolbox. If not, see
+# https://www.gnu.org/licenses/.
+
+
+import numpy as np
+import pandas as pd
+import pytest
+import rasterio
+import typer
+from rasterio.transform import from_origin
+from rasterio.windows import Window
+
+from conftest import S2_PREFIX
+from dggs_tbx import h3_tbx, pgload
+from dggs_tbx.h3_tbx import h3_cells_from_points, h3_cloud_index, h3cloudcindex
+from dggs_tbx.main import sclindex
+from dggs_tbx.rpix_tbx import rpix_cloud_index
+from dggs_tbx.utils import SCL_MASK_VALUES, save_grid
+from dggs_tbx.zonal import window_lonlat
+
+__author__ = "CS GROUP (Benatia Fahd, Nicolas Vila)"
+
+
+@pytest.fixture
+def scl_band(tmp_path):
+    """Synthetic 20m SCL band, classes 0 (nodata) to 11"""
+    raster_path = tmp_path / "SCL.tif"
+    data = np.random.default_rng(0).integers(0, 12, (300, 300)).astype("uint8")
+    with rasterio.open(
+        raster_path,
+        "w",
+        driver="GTiff",
+        height=300,
+        width=300,
+        count=1,
+        dtype="uint8",
+        crs="EPSG:32632",
+        transform=from_origin(300000, 5000040, 20, 20),
+        nodata=0,
+        tiled=True,
+        blockxsize=128,
+        blockysize=128,
+    ) as dst:
+        dst.write(data, 1)
+    return raster_path
+
+
+def test_h3_cloud_index(scl_band):
+    index = h3_cloud_index(scl_band, 8, ids_only=True)
+    with rasterio.open(scl_band) as src:
+        scl = src.read(1).ravel()
+        lon, lat = window_lonlat(src.transform, src.crs, Window(0, 0, 300, 300))
+    pixels = pd.DataFrame({"cell": h3_cells_from_points(lon, lat, 8), "scl": scl})
+    valid = pixels[pixels.scl != 0]
+    expected = valid.groupby("cell").agg(
+        cloud_fraction=("scl", lambda v: np.isin(v, SCL_MASK_VALUES).mean()),
+        valid_pixels=("scl", "size"),
+        max_class=("scl", "max"),
+    )
+    assert set(index.index) == set(pixels.cell)
+    index = index.loc[expected.index]
+    assert np.allclose(index.cloud_fraction, expected.cloud_fraction, atol=1e-6)
+    assert (index.valid_pixels == expected.valid_pixels).all()
+    assert (index.max_class == expected.max_class).all()
+    parallel = h3_cloud_index(scl_band, 8, ids_only=True, workers=2)
+    assert parallel.loc[expected.index].equals(index)
+
+
+def test_sclindex_outputs(scl_band, tmp_path):
+    sclindex(scl_band, 8, tmp_path, format="parquet", ids_only=True)
+    table = pd.read_parquet(tmp_path / "SCL_cloud_H3_res_8_ap7.parquet")
+    assert table.columns.tolist() == [
+        "h3_id",
+        "cloud_fraction",
+        "valid_pixels",
+        "max_class",
+    ]
+    assert table.h3_id.is_monotonic_increasing
+    grid = rpix_cloud_index(scl_band, 9)
+    assert {"rpix_id", "cell_id", "geometry"} <= set(grid.columns)
+    with rasterio.open(scl_band) as src:
+        assert grid.valid_pixels.sum() == (src.read(1) != 0).sum()
+    # GeoJSON outputs need the cell geometries
+    with pytest.raises(typer.BadParameter, match="--format parquet"):
+        sclindex(scl_band, 8, tmp_path, ids_only=True)
+    with pytest.raises(ValueError, match="GeoJSON"):
+        save_grid(table, tmp_path / "ids.geojson", id_column="h3_id")
+    with pytest.raises(ValueError, match="parquet"):
+        h3cloudcindex(
+            "32TQM", "20220902", "t", 8, out_path=tmp_path / "i.geojson", ids_only=True
+        )
+
+
+def test_h3cloudcindex_inputs(s2_bucket, scl_band, tmp_path, monkeypatch):
+    s2_bucket.upload_file(str(scl_band), "sentinel-cogs", f"{S2_PREFIX}/SCL.tif")
+    products = tmp_path / "products"
+    out_path = tmp_path / "cloud.parquet"
+    h3cloudcindex(
+        "32TQM", "20220902", "t", 8, products, out_path=out_path, ids_only=True
+    )
+    assert len(pd.read_parquet(out_path)) > 0
+
+    class FailingLoader:
+        def __init__(self, engine, table_name, **kwargs):
+            pass
+
+        def __enter__(self):
+            raise RuntimeError("load failed")
+
+        def __exit__(self, *args):
+            pass
+
+    monkeypatch.setattr(pgload, "PostGISLoader", FailingLoader)
+    monkeypatch.setattr(h3_tbx, "db_connect", lambda: None)
+    with pytest.raises(RuntimeError, match="load failed"):
+        h3cloudcindex("32TQM", "20220902", "t", 8, products)
+    # The SCL bands are downloaded to job directories, removed even on failure
+    assert list(products.iterdir()) == []
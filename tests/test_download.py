@@ -0,0 +1,129 @@
+# Copyright (C) 2024-2025 CS GROUP, https://cs-soprasteria.com
+#
+# This file is part of DGGS Toolbox:
+#
+#     https://github.com/CS-SI/dggs_tbx
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+#
+# DGGS Toolbox is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# DGGS Toolbox is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with DGGS Toolbox. If not, see
+# https://www.gnu.org/licenses/.
+
+import shutil
+
+import numpy as np
+import rasterio
+from rasterio.warp import transform_bounds
+from rasterio.windows import Window
+
+from dggs_tbx.download_cache import DownloadCache
+from dggs_tbx.s3io import S3RangeFile, list_objects
+from dggs_tbx.utils import down_s2
+
+from conftest import S2_PREFIX
+
+
+def test_down_s2_cache_hit(s2_bucket, s2_band, tmp_path):
+    cache_dir = tmp_path / "cache"
+    out_dir = down_s2("32TQM", "20220902", tmp_path / "a", ["B02"], cache_dir)
+    assert (out_dir / "B02.tif").read_bytes() == s2_band.read_bytes()
+    shutil.rmtree(out_dir)
+    (cached,) = cache_dir.glob("*/*.tif")
+    cached.write_bytes(b"cached")
+    # The second run is served from the cache
+    out_dir = down_s2("32TQM", "20220902", tmp_path / "b", ["B02"], cache_dir)
+    assert (out_dir / "B02.tif").read_bytes() == b"cached"
+
+
+def test_download_cache_eviction(s2_bucket, s2_band, tmp_path):
+    size = s2_band.stat().st_size
+    cache = DownloadCache(tmp_path / "cache", max_bytes=int(1.5 * size))
+    prefix = S2_PREFIX
+    etags = {
+        band: s2_bucket.head_object(Bucket="sentinel-cogs", Key=f"{prefix}/{band}.tif")[
+            "ETag"
+        ]
+        for band in ("B02", "B08")
+    }
+    b02 = cache.fetch(s2_bucket, "sentinel-cogs", f"{prefix}/B02.tif", etags["B02"])
+    b08 = cache.fetch(s2_bucket, "sentinel-cogs", f"{prefix}/B08.tif", etags["B08"])
+    # The least recently used object is evicted to fit the cap
+    assert not b02.exists()
+    assert b08.exists()
+    # A new ETag is a different cache entry
+    assert cache.object_path(f"{prefix}/B08.tif", '"other"') != b08
+
+
+def test_download_cache_evicted_before_link(s2_bucket, s2_band, tmp_path):
+    cache = DownloadCache(tmp_path / "cache")
+    key = f"{S2_PREFIX}/B02.tif"
+    etag = s2_bucket.head_object(Bucket="sentinel-cogs", Key=key)["ETag"]
+    fetch = cache.fetch
+    fetched = []
+
+    def fetch_then_evict(*args):
+        path = fetch(*args)
+        if not fetched:
+            # Another worker evicts the file before it is linked
+            path.unlink()
+        fetched.append(path)
+        return path
+
+    cache.fetch = fetch_then_evict
+    dest = cache.get(s2_bucket, "sentinel-cogs", key, etag, tmp_path / "B02.tif")
+    assert len(fetched) == 2
+    assert dest.read_bytes() == s2_band.read_bytes()
+
+
+def test_down_s2_concurrent(s2_bucket, s2_band, tmp_path):
+    out_dir = down_s2("32TQM", "20220902", tmp_path, ["B02", "B08"], max_workers=2)
+    assert sorted(path.name for path in out_dir.iterdir()) == ["B02.tif", "B08.tif"]
+    assert (out_dir / "B08.tif").read_bytes() == s2_band.read_bytes()
+
+
+def test_list_objects_pages(s2_bucket):
+    keys = [
+        obj["Key"]
+        for obj in list_objects(s2_bucket, "sentinel-cogs", S2_PREFIX, page_size=1)
+    ]
+    assert keys == [f"{S2_PREFIX}/B02.tif", f"{S2_PREFIX}/B08.tif"]
+
+
+def test_read_aoi(s2_bucket, s2_band, tmp_path, monkeypatch):
+    fetched = []
+    readinto = S3RangeFile.readinto
+
+    def counting_readinto(self, buffer):
+        fetched.append(readinto(self, buffer))
+        return fetched[-1]
+
+    monkeypatch.setattr(S3RangeFile, "readinto", counting_readinto)
+    with rasterio.open(s2_band) as src:
+        # Inside the second block row and column
+        window = Window(300, 300, 100, 100)
+        aoi = transform_bounds(src.crs, "EPSG:4326", *src.window_bounds(window))
+        full = src.read(1)
+    key = f"{S2_PREFIX}/B02.tif"
+    size = s2_band.stat().st_size
+    raw = S3RangeFile(s2_bucket, "sentinel-cogs", key, size)
+    assert raw.seek(0, 2) == size
+    out_path = down_s2("32TQM", "20220902", tmp_path, ["B02"], aoi=aoi) / "B02.tif"
+    with rasterio.open(out_path) as dst:
+        col_off, row_off = ~src.transform * (dst.transform.c, dst.transform.f)
+        # Only the overlapping 256 x 256 blocks are copied
+        assert (col_off, row_off) == (256, 256)
+        assert dst.shape == (256, 256)
+        np.testing.assert_array_equal(dst.read(1), full[256:512, 256:512])
+    # One block out of nine, plus the header
+    assert sum(fetched) < size / 2
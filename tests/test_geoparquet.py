@@ -0,0 +1,92 @@
+# Copyright (C) 2024-2025 CS GROUP, https://cs-soprasteria.com
+#
+# This file is part of DGGS Toolbox:
+#
+#     https://github.com/CS-SI/dggs_tbx
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+#
+# DGGS Toolbox is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# DGGS Toolbox is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with DGGS Toolbox. If not, see
+# https://www.gnu.org/licenses/.
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+from dggs_tbx.geoparquet import GridParquetWriter
+from dggs_tbx.h3_tbx import h3_ids, h3_zonal_mean
+from dggs_tbx.rpix_tbx import (
+    rpix_grid_batches,
+    rpix_pack,
+    rpix_with_geometry,
+    rpix_zonal_mean,
+)
+from dggs_tbx.utils import save_grid
+
+__author__ = "CS GROUP (Benatia Fahd, Nicolas Vila)"
+
+
+def test_grid_parquet_row_groups(s2_band, tmp_path):
+    grid = h3_zonal_mean([s2_band], 9)
+    grid.insert(0, "h3_id", h3_ids(grid.index))
+    grid = grid.reset_index(drop=True).sample(frac=1, random_state=0)
+    half = len(grid) // 2
+    ordered = grid.sort_values("h3_id")
+    path = tmp_path / "grid.parquet"
+    with GridParquetWriter(path, "h3_id", row_group_size=100) as writer:
+        # Two increasing chunks, each shuffled
+        writer.write(ordered.iloc[:half].sample(frac=1, random_state=1))
+        writer.write(ordered.iloc[half:])
+    metadata = pq.ParquetFile(path).metadata
+    assert metadata.num_row_groups >= len(grid) // 100
+    bounds = [
+        (rg.column(0).statistics.min, rg.column(0).statistics.max)
+        for rg in (metadata.row_group(i) for i in range(metadata.num_row_groups))
+    ]
+    assert all(low <= high for low, high in bounds)
+    assert all(a[1] < b[0] for a, b in zip(bounds, bounds[1:]))
+    loaded = gpd.read_parquet(path)
+    assert loaded["h3_id"].dtype == np.uint64
+    assert loaded["h3_id"].is_monotonic_increasing
+    assert loaded.crs == grid.crs
+    assert loaded.geometry.geom_equals(ordered.geometry, align=False).all()
+
+
+def test_grid_parquet_ids_only(s2_band, tmp_path):
+    df = h3_zonal_mean([s2_band], 8, ids_only=True).reset_index()
+    path = tmp_path / "ids.parquet"
+    with GridParquetWriter(path, "h3_id") as writer:
+        writer.write(df)
+    pd.testing.assert_frame_equal(pd.read_parquet(path), df)
+
+
+def test_rpix_pack(s2_band):
+    df = rpix_zonal_mean([s2_band], 7, ids_only=True)
+    grid = rpix_with_geometry(df, 7)
+    assert rpix_pack(grid["cell_id"]).tolist() == df.index.tolist()
+
+
+def test_rpix_grid_parquet_sorted(s2_band, tmp_path):
+    batches = rpix_grid_batches(s2_band, 11, batch_size=2000)
+    path = save_grid(batches, tmp_path / "grid.parquet", "rpix_id")
+    metadata = pq.ParquetFile(path).metadata
+    assert metadata.num_row_groups > 1
+    column = pq.ParquetFile(path).schema_arrow.get_field_index("rpix_id")
+    bounds = [
+        (rg.column(column).statistics.min, rg.column(column).statistics.max)
+        for rg in (metadata.row_group(i) for i in range(metadata.num_row_groups))
+    ]
+    # Row groups of the whole file do not overlap
+    assert all(a[1] < b[0] for a, b in zip(bounds, bounds[1:]))
@@ -0,0 +1,121 @@
+# Copyright (C) 2024-2025 CS GROUP, https://cs-soprasteria.com
+#
+# This file is part of DGGS Toolbox:
+#
+#     https://github.com/CS-SI/dggs_tbx
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+#
+# DGGS Toolbox is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# DGGS Toolbox is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with DGGS Toolbox. If not, see
+# https://www.gnu.org/licenses/.
+
+
+import subprocess
+import sys
+
+from typer.testing import CliRunner
+
+from dggs_tbx.main import app
+
+__author__ = "CS GROUP (Benatia Fahd, Nicolas Vila)"
+
+# Modules only imported by the commands that need them
+HEAVY_MODULES = (
+    "boto3",
+    "dask",
+    "distributed",
+    "geopandas",
+    "h3",
+    "h3pandas",
+    "pandas",
+    "rasterio",
+    "rhealpixdggs",
+    "sqlalchemy",
+)
+
+# Cumulative import time of the CLI module, in microseconds
+IMPORT_BUDGET = 500_000
+
+
+def test_lazy_imports():
+    loaded = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys, dggs_tbx.main; "
+            "print(' '.join(m for m in sys.modules if '.' not in m))",
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout.split()
+    assert sorted(set(HEAVY_MODULES) & set(loaded)) == []
+
+
+def test_file_command_imports():
+    # rasterio and pandas may import boto3 and pyarrow themselves, the
+    # modules of the file commands must not add their S3 and Parquet code
+    added = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys, geopandas, pandas, rasterio; before = set(sys.modules); "
+            "import dggs_tbx.h3_tbx, dggs_tbx.rpix_tbx; "
+            "print(' '.join(set(sys.modules) - before))",
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout.split()
+    assert sorted(
+        module
+        for module in added
+        if module.split(".")[0] in ("boto3", "botocore", "pyarrow")
+        or module in ("dggs_tbx.s3io", "dggs_tbx.geoparquet")
+    ) == []
+
+
+def test_import_time():
+    # Best of three runs of python -X importtime, the first one may be slowed
+    # down by a cold file cache
+    timings = []
+    for _ in range(3):
+        stderr = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import dggs_tbx.main"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stderr
+        for line in stderr.splitlines():
+            _, cumulative, module = line.split("|")
+            if module.strip() == "dggs_tbx.main":
+                timings.append(int(cumulative))
+    assert min(timings) < IMPORT_BUDGET
+
+
+def test_help():
+    result = CliRunner().invoke(app, ["--help"])
+    assert result.exit_code == 0
+    for command in ("raster2h3", "cog2h3db", "batch"):
+        assert command in result.output
+
+
+def test_geometry_view_requires_ids_only():
+    for args in (
+        ["cog2h3db", "32TQM", "20220902", "--geometry-view"],
+        ["cog2cloudh3db", "32TQM", "20220902", "--geometry-view"],
+    ):
+        result = CliRunner().invoke(app, args)
+        assert result.exit_code == 2
+        assert "--ids-only" in result.output
@@ -0,0 +1,170 @@
+# Copyright (C) 2024-2025 CS GROUP, https://cs-soprasteria.com
+#
+# This file is part of DGGS Toolbox:
+#
+#     https://github.com/CS-SI/dggs_tbx
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+#
+# DGGS Toolbox is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# DGGS Toolbox is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with DGGS Toolbox. If not, see
+# https://www.gnu.org/licenses/.
+
+import os
+import struct
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pytest
+import shapely
+from h3.api import numpy_int as h3_int
+from shapely.geometry import box
+from sqlalchemy import text
+
+from dggs_tbx.h3_tbx import H3_GEOMETRY_SQL
+from dggs_tbx.pgload import (
+    COPY_HEADER,
+    PostGISLoader,
+    column_types,
+    create_geometry_view,
+    encode_copy,
+    frame_columns,
+    index_table,
+)
+
+
+def decode_copy(data: bytes, formats: list) -> list:
+    """Minimal binary COPY reader, formats are struct codes or None for bytes"""
+    assert data.startswith(COPY_HEADER)
+    pos, rows = len(COPY_HEADER), []
+    while True:
+        (n_fields,) = struct.unpack_from(">h", data, pos)
+        pos += 2
+        if n_fields == -1:
+            return rows
+        row = []
+        for fmt in formats:
+            (size,) = struct.unpack_from(">i", data, pos)
+            pos += 4
+            if size == -1:
+                row.append(None)
+                continue
+            raw = data[pos : pos + size]
+            row.append(raw if fmt is None else struct.unpack(">" + fmt, raw)[0])
+            pos += size
+        rows.append(row)
+
+
+@pytest.fixture
+def cells_frame():
+    return gpd.GeoDataFrame(
+        {
+            "B02": np.array([10, 20], dtype=np.int64),
+            "grid_name": ["H3", None],
+            "simulated": [True, False],
+            "mean": [0.5, 1.5],
+        },
+        index=np.array([2**62 + 1, 5], dtype=np.uint64),
+        geometry=[box(0, 0, 1, 1), box(1, 1, 2, 2)],
+        crs="EPSG:4326",
+    ).rename_axis("cell_id")
+
+
+def test_encode_copy(cells_frame):
+    columns = frame_columns(cells_frame)
+    types = column_types(columns, ("geometry",))
+    assert types == [
+        ("cell_id", "bigint"),
+        ("B02", "bigint"),
+        ("grid_name", "text"),
+        ("simulated", "boolean"),
+        ("mean", "double precision"),
+        ("geometry", "bytea"),
+    ]
+    rows = decode_copy(encode_copy(columns, types), ["q", "q", None, "?", "d", None])
+    assert rows[0][:5] == [2**62 + 1, 10, b"H3", True, 0.5]
+    assert rows[1][:5] == [5, 20, None, False, 1.5]
+    assert shapely.from_wkb(rows[1][5]).equals(box(1, 1, 2, 2))
+
+
+@pytest.fixture
+def pg_engine():
+    if not os.getenv("pg_pass"):
+        pytest.skip("PostGIS test database not configured (pg_* variables)")
+    from dggs_tbx.utils import db_connect
+
+    return db_connect()
+
+
+def test_postgis_loader(pg_engine, cells_frame):
+    table_name = "test_pgload_cells"
+    with pg_engine.begin() as conn:
+        conn.execute(text(f"DROP TABLE IF EXISTS {table_name}"))
+    with PostGISLoader(pg_engine, table_name, defer_merge=True) as loader:
+        loader.load(cells_frame)
+        loader.load(cells_frame)
+    loaded = gpd.read_postgis(
+        f"SELECT * FROM {table_name}", pg_engine, geom_col="geometry"
+    )
+    assert len(loaded) == 4
+    assert sorted(loaded["cell_id"].unique()) == [5, 2**62 + 1]
+    assert loaded.geometry.iloc[0].equals(box(0, 0, 1, 1))
+
+
+def test_staging_names():
+    # Loaders of the same process, or of other hosts, never share staging rows
+    loaders = [PostGISLoader(None, "test_pgload_cells") for _ in range(2)]
+    assert loaders[0].staging_name != loaders[1].staging_name
+
+
+def test_index_table(pg_engine, cells_frame):
+    table_name = "test_pgload_index"
+    with pg_engine.begin() as conn:
+        conn.execute(text(f"DROP TABLE IF EXISTS {table_name}"))
+    for _ in range(2):
+        with PostGISLoader(pg_engine, table_name, create_indexes=False) as loader:
+            loader.load(cells_frame)
+    query = text("SELECT indexname FROM pg_indexes WHERE tablename = :name")
+    with pg_engine.connect() as conn:
+        assert conn.execute(query, {"name": table_name}).all() == []
+    index_table(pg_engine, table_name)
+    with pg_engine.connect() as conn:
+        indexes = {row[0] for row in conn.execute(query, {"name": table_name})}
+    assert indexes == {f"{table_name}_geometry_idx", f"{table_name}_index_idx"}
+
+
+def test_geometry_view(pg_engine):
+    with pg_engine.connect() as conn:
+        extension = text("SELECT 1 FROM pg_extension WHERE extname = 'h3'")
+        if conn.execute(extension).scalar() is None:
+            pytest.skip("h3-pg extension not installed")
+    table_name = "test_pgload_ids"
+    with pg_engine.begin() as conn:
+        conn.execute(text(f"DROP TABLE IF EXISTS {table_name} CASCADE"))
+    h3_id = h3_int.geo_to_h3(45.0, 7.0, 8)
+    frame = pd.DataFrame(
+        {"B02": [10.0]},
+        index=pd.Index(np.array([h3_id], dtype=np.uint64), name="h3_id"),
+    )
+    with PostGISLoader(pg_engine, table_name) as loader:
+        loader.load(frame)
+    view_name = create_geometry_view(pg_engine, table_name, H3_GEOMETRY_SQL)
+    view = gpd.read_postgis(
+        f"SELECT * FROM {view_name}", pg_engine, geom_col="geometry"
+    )
+    assert view["B02"].tolist() == [10.0]
+    expected = shapely.Polygon(
+        [(lon, lat) for lat, lon in h3_int.h3_to_geo_boundary(h3_id)]
+    )
+    assert view.geometry.iloc[0].normalize().equals_exact(expected.normalize(), 1e-7)
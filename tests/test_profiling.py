@@ -0,0 +1,131 @@
+# Copyright (C) 2024-2025 CS GROUP, https://cs-soprasteria.com
+#
+# This file is part of DGGS Toolbox:
+#
+#     https://github.com/CS-SI/dggs_tbx
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+#
+# DGGS Toolbox is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# DGGS Toolbox is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with DGGS Toolbox. If not, see
+# https://www.gnu.org/licenses/.
+
+
+import json
+import pstats
+import threading
+
+from typer.testing import CliRunner
+
+from dggs_tbx import profiling
+from dggs_tbx.batch import Job, run_batch
+from dggs_tbx.main import app
+
+__author__ = "CS GROUP (Benatia Fahd, Nicolas Vila)"
+
+
+def test_profiler_stages():
+    profiler = profiling.Profiler("test")
+    with profiler.stage("load"):
+        profiler.count(rows=2)
+        # Nested calls of the same stage are timed once
+        with profiler.stage("load"):
+            profiler.count(rows=3)
+    stages = {stage["name"]: stage for stage in profiler.report()["stages"]}
+    assert list(stages) == list(profiling.STAGES)
+    assert stages["load"]["calls"] == 1
+    assert stages["load"]["rows"] == 5
+    assert stages["download"]["calls"] == 0
+    # No-ops without an active profiler
+    with profiling.stage("grid"):
+        profiling.count(cells=1)
+
+
+def test_profiler_threads():
+    profiler = profiling.Profiler("test")
+    both_open = threading.Barrier(2)
+
+    def run(name: str, **counters: int) -> None:
+        with profiler.stage(name):
+            both_open.wait()
+            profiler.count(**counters)
+            both_open.wait()
+
+    threads = [
+        threading.Thread(target=run, args=("download",), kwargs={"s3_bytes": 1}),
+        threading.Thread(target=run, args=("load",), kwargs={"rows": 2}),
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stages = {stage["name"]: stage for stage in profiler.report()["stages"]}
+    # Counters go to the stages of their own thread
+    assert (stages["download"]["s3_bytes"], stages["download"]["rows"]) == (1, 0)
+    assert (stages["load"]["s3_bytes"], stages["load"]["rows"]) == (0, 2)
+
+
+def staged_job(job: Job, table_name: str) -> float:
+    with profiling.stage("load"):
+        profiling.count(rows=1)
+    return 1.0
+
+
+def test_profile_workers(tmp_path):
+    jobs = [Job(tile, "20220902", "h3", "7") for tile in ("A", "B", "C")]
+    with profiling.profiling(tmp_path / "report.json", "batch") as profiler:
+        run_batch(
+            jobs, tmp_path / "manifest.sqlite", "t", runner=staged_job, indexer=None
+        )
+        stages = {stage["name"]: stage for stage in profiler.report()["stages"]}
+    # Stages of the worker processes are merged into the report
+    assert stages["load"]["calls"] == 3
+    assert stages["load"]["rows"] == 3
+
+
+def test_profile_option(s2_band, tmp_path):
+    report_path = tmp_path / "report.json"
+    result = CliRunner().invoke(
+        app,
+        [
+            "raster2h3",
+            str(s2_band),
+            "8",
+            str(tmp_path),
+            "--format",
+            "parquet",
+            "--profile",
+            str(report_path),
+            "--profile-stage",
+            "aggregation",
+        ],
+    )
+    assert result.exit_code == 0, result.output
+    report = json.loads(report_path.read_text())
+    assert report["schema_version"] == profiling.SCHEMA_VERSION
+    assert report["command"] == "raster2h3"
+    stages = {stage["name"]: stage for stage in report["stages"]}
+    assert set(stages["grid"]) == {
+        "name",
+        "calls",
+        "wall_seconds",
+        "cpu_seconds",
+        "peak_rss_bytes",
+        *profiling.COUNTERS,
+    }
+    assert stages["grid"]["cells"] > 0
+    assert stages["reprojection"]["calls"] > 0
+    assert stages["aggregation"]["cells"] == stages["grid"]["cells"]
+    assert stages["load"]["rows"] == stages["grid"]["cells"]
+    assert stages["download"]["calls"] == 0
+    pstats.Stats(report["hot_stage_profile"])
@@ -0,0 +1,70 @@
+# Copyright (C) 2024-2025 CS GROUP, https://cs-soprasteria.com
+#
+# This file is part of DGGS Toolbox:
+#
+#     https://github.com/CS-SI/dggs_tbx
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+#
+# DGGS Toolbox is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# DGGS Toolbox is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with DGGS Toolbox. If not, see
+# https://www.gnu.org/licenses/.
+
+
+import geopandas as gpd
+import numpy as np
+import rasterio
+from pyproj import Transformer
+
+from dggs_tbx.h3_tbx import h3_grid_batches
+from dggs_tbx.transforms import (
+    WGS84,
+    extent_lonlat,
+    reproject_bounds,
+    to_lonlat,
+    transform_geometries,
+    transformer,
+)
+
+__author__ = "CS GROUP (Benatia Fahd, Nicolas Vila)"
+
+
+def test_cached_transformer(s2_band):
+    with rasterio.open(s2_band) as src:
+        crs, bounds = src.crs, src.bounds
+    assert transformer(crs, WGS84) is transformer(32632, "EPSG:4326")
+    reference = Transformer.from_crs("EPSG:32632", "EPSG:4326", always_xy=True)
+    xs = np.linspace(bounds.left, bounds.right, 10)
+    ys = np.linspace(bounds.bottom, bounds.top, 10)
+    assert np.allclose(to_lonlat(crs, xs, ys), reference.transform(xs, ys))
+
+    nw, se = reproject_bounds(bounds, 32632)
+    assert np.allclose(nw, reference.transform(bounds.left, bounds.top))
+    assert np.allclose(se, reference.transform(bounds.right, bounds.bottom))
+    extent = extent_lonlat(bounds, crs)
+    assert np.allclose(extent.exterior.coords[2], reference.transform(*bounds[2:]))
+
+
+def test_grid_crs(s2_band):
+    projected = next(h3_grid_batches(s2_band, 8))
+    lonlat = next(h3_grid_batches(s2_band, 8, crs=WGS84))
+    assert projected.crs.to_epsg() == 32632
+    assert lonlat.crs.to_epsg() == 4326
+    assert list(projected.index) == list(lonlat.index)
+    assert projected.geometry.geom_equals_exact(
+        lonlat.to_crs(32632).geometry, 1e-6
+    ).all()
+    back = transform_geometries(projected.geometry.values, projected.crs, WGS84)
+    assert lonlat.geometry.geom_equals_exact(
+        gpd.GeoSeries(back, index=lonlat.index, crs=WGS84), 1e-9
+    ).all()
@@ -0,0 +1,497 @@
+# Copyright (C) 2024-2025 CS GROUP, https://cs-soprasteria.com
+#
+# This file is part of DGGS Toolbox:
+#
+#     https://github.com/CS-SI/dggs_tbx
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+#
+# DGGS Toolbox is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# DGGS Toolbox is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with DGGS Toolbox. If not, see
+# https://www.gnu.org/licenses/.
+
+import os
+import pickle
+
+import geopandas as gpd
+import h3pandas  # noqa: F401
+import numpy as np
+import pytest
+import rasterio
+import rasterio.mask
+from affine import Affine
+from h3 import h3
+from h3.api import numpy_int as h3_int
+from pyproj import Transformer
+from rasterio.enums import Resampling
+from rasterio.windows import Window
+from shapely.geometry import box
+
+from rhealpixdggs.dggs import WGS84_003
+
+from dggs_tbx.cellmap import build_cell_map
+from dggs_tbx.dask_backend import dask_client
+from dggs_tbx.labels import CellLabels
+from dggs_tbx.h3_tbx import (
+    dask_h3_from_raster,
+    h3_cells_from_points,
+    h3_from_raster_extent,
+    h3_grid_batches,
+    h3_ids,
+    h3_parents,
+    h3_polyfill_batches,
+    h3_with_geometry,
+    h3_zonal_mean,
+    h3_zonal_stats,
+    raster_extent_lonlat,
+)
+from dggs_tbx.rpix_tbx import (
+    iter_cells,
+    rpix_cells_from_points,
+    rpix_cells_geometry,
+    rpix_from_raster_extent,
+    rpix_suid,
+    rpix_with_geometry,
+    rpix_zonal_mean,
+    rpix_zonal_pyramid,
+    rpix_zonal_stats,
+)
+from dggs_tbx import utils
+from dggs_tbx.utils import (
+    mask_means,
+    rasterval_batches,
+    rasterval_geojson,
+    rasterval_grid,
+    save_grid,
+)
+from dggs_tbx.zonal import (
+    ZonalStats,
+    overview_level,
+    window_lonlat,
+    zonal_means,
+    zonal_stats,
+)
+
+__author__ = "CS GROUP (Benatia Fahd, Nicolas Vila)"
+
+
+def test_zonal_stats_merge():
+    cells = np.array([3, 1, 3, 1, 2])
+    values = np.array([10, 0, 20, 4, 0])
+    stats = ZonalStats.from_pixels(cells, values, nodata=0)
+    assert stats.cells.tolist() == [1, 2, 3]
+    assert stats.sums.tolist() == [[4, 0, 30]]
+    assert stats.counts.tolist() == [[1, 0, 2]]
+    assert stats.mins.tolist() == [[4, np.inf, 10]]
+    assert stats.maxs.tolist() == [[4, -np.inf, 20]]
+    other = ZonalStats.from_pixels(np.array([2, 3]), np.array([5, 30]))
+    merged = ZonalStats.merge([stats, other])
+    assert merged.sums.tolist() == [[4, 5, 60]]
+    assert merged.counts.tolist() == [[1, 1, 3]]
+    assert merged.mins.tolist() == [[4, 5, 10]]
+    assert merged.maxs.tolist() == [[4, 5, 30]]
+
+
+def test_streamed_windows_match_full_read(s2_band):
+    # 256x256 internal tiles: windows of one tile, and of the whole raster
+    tiled = zonal_stats([s2_band], h3_cells_from_points, 9, max_pixels=2**16)
+    full = zonal_stats([s2_band], h3_cells_from_points, 9, max_pixels=2**20)
+    assert np.array_equal(tiled.cells, full.cells)
+    for name in ("sums", "counts", "mins", "maxs"):
+        assert np.allclose(getattr(tiled, name), getattr(full, name))
+
+
+def test_h3_zonal_mean_matches_mask(s2_band, tmp_path):
+    zonal = h3_zonal_mean([s2_band], 8)
+    grid = h3_from_raster_extent(s2_band, tmp_path, 8, df_ret=True)
+    with rasterio.open(s2_band) as src:
+        for h3_id, geom in zip(grid.index[:10], grid.geometry[:10]):
+            out_image, _ = rasterio.mask.mask(src, [geom], crop=True)
+            expected = int(np.mean(out_image[out_image != src.nodata]))
+            assert zonal.loc[h3_id, "B02"] == expected
+
+
+def test_rpix_cells_from_points():
+    rng = np.random.default_rng(1)
+    lon = rng.uniform(-179.9, 179.9, 500)
+    lat = rng.uniform(-89.9, 89.9, 500)
+    for res in (0, 3, 9):
+        cells = rpix_cells_from_points(lon, lat, res)
+        for x, y, index in zip(lon, lat, cells):
+            cell = WGS84_003.cell_from_point(res, (x, y), plane=False)
+            assert tuple(cell.suid) == rpix_suid(index, res)
+
+
+def test_rpix_zonal_mean_matches_mask(s2_band, tmp_path):
+    zonal = rpix_zonal_mean([s2_band], 7).set_index("cell_id")
+    grid = rpix_from_raster_extent(s2_band, tmp_path, 7, df_ret=True)
+    with rasterio.open(s2_band) as src:
+        for cell_id, geom in zip(grid.cell_id, grid.geometry):
+            try:
+                out_image, _ = rasterio.mask.mask(src, [geom], crop=True)
+            except ValueError:
+                continue
+            valid = out_image[out_image != src.nodata]
+            if valid.size > 1000:
+                # Cell polygons only approximate the rHEALPix cell edges
+                assert abs(zonal.loc[cell_id, "B02"] - np.mean(valid)) < 50
+
+
+def test_cached_cell_map(s2_band, tmp_path):
+    cache_dir = tmp_path / "cache"
+    expected = h3_zonal_mean([s2_band], 8)
+    cached = h3_zonal_mean([s2_band], 8, cache_dir, "32TQM")
+    assert len(list(cache_dir.glob("32TQM_H3_res_8_*.npz"))) == 1
+    assert cached.equals(expected)
+    # Second run reads the map from the cache
+    assert h3_zonal_mean([s2_band], 8, cache_dir, "32TQM").equals(expected)
+
+
+def test_cell_labels(s2_band, tmp_path):
+    labels_dir = tmp_path / "labels"
+    expected = h3_zonal_stats([s2_band], 8)
+    for workers in (1, 2):
+        stats = h3_zonal_stats([s2_band], 8, labels_dir=labels_dir, workers=workers)
+        assert np.array_equal(stats.cells, expected.cells)
+        assert np.array_equal(stats.sums, expected.sums)
+    (path,) = labels_dir.glob("H3_res_8_*.npy")
+    labels = CellLabels(path)
+    assert isinstance(labels.array, np.memmap)
+    assert labels.array.dtype == np.uint64
+    with rasterio.open(s2_band) as src:
+        assert labels.matches(src)
+        window = Window(100, 200, 50, 30)
+        lon, lat = window_lonlat(src.transform, src.crs, window)
+    assert np.array_equal(
+        labels.window(window).ravel(), h3_cells_from_points(lon, lat, 8)
+    )
+    # Workers receive the path and map the file themselves
+    assert len(pickle.dumps(labels)) < 4096
+    rpix = rpix_zonal_stats([s2_band], 7, labels_dir=labels_dir)
+    assert np.array_equal(rpix.sums, rpix_zonal_stats([s2_band], 7).sums)
+    with pytest.raises(ValueError):
+        zonal_stats([s2_band], h3_cells_from_points, 9, labels=labels)
+
+
+def test_cell_map_weights(s2_band):
+    cell_map = build_cell_map(s2_band, h3_cells_from_points, 8, supersample=2)
+    with rasterio.open(s2_band) as src:
+        values = src.read(1)
+    stats = cell_map.aggregate(values)
+    assert np.isclose(stats.counts.sum(), values.size)
+    assert np.isclose(stats.sums.sum(), values.sum(dtype=np.float64))
+
+
+
+def test_cell_map_windows(s2_band, tmp_path):
+    cell_map = build_cell_map(s2_band, h3_cells_from_points, 8, supersample=2)
+    with rasterio.open(s2_band) as src:
+        values = src.read(1)
+        window = Window(100, 200, 300, 30)
+        window_values = src.read(1, window=window)
+    expected = cell_map.aggregate(values, 0)
+    # Windows of the map aggregate the pixels of the window only
+    stats = cell_map.window(window).aggregate(window_values, 0)
+    assert np.isclose(stats.counts.sum(), (window_values != 0).sum())
+    assert np.isclose(stats.sums.sum(), window_values.sum(dtype=np.float64))
+    for workers in (1, 2):
+        streamed = zonal_stats(
+            [s2_band],
+            h3_cells_from_points,
+            8,
+            cell_map=cell_map,
+            max_pixels=2**16,
+            workers=workers,
+        )
+        assert np.array_equal(streamed.cells, expected.cells)
+        for name in ("sums", "counts", "mins", "maxs"):
+            assert np.allclose(getattr(streamed, name), getattr(expected, name))
+    # No map is built for cells sampled at their centre
+    h3_zonal_stats([s2_band], 12, cache_dir=tmp_path / "cache")
+    assert not list(tmp_path.rglob("*.npz"))
+
+def test_multiband_resampling(s2_band):
+    with rasterio.open(s2_band) as src:
+        profile = src.profile
+        values = src.read(1)
+    # 20m band covering the same extent, and its 10m nearest neighbour upsampling
+    coarse = values[::2, ::2]
+    profile.update(
+        width=300, height=300, transform=profile["transform"] * Affine.scale(2)
+    )
+    with rasterio.open(s2_band.with_name("B05.tif"), "w", **profile) as dst:
+        dst.write(coarse, 1)
+    profile.update(
+        width=600, height=600, transform=profile["transform"] * Affine.scale(0.5)
+    )
+    with rasterio.open(s2_band.with_name("B05_10m.tif"), "w", **profile) as dst:
+        dst.write(np.repeat(np.repeat(coarse, 2, axis=0), 2, axis=1), 1)
+
+    list_bands = [s2_band.with_name("B05.tif"), s2_band]
+    zonal = zonal_means(list_bands, h3_cells_from_points, 8)
+    assert zonal.columns.tolist() == ["B05", "B02"]
+    upsampled = zonal_means([s2_band.with_name("B05_10m.tif")], h3_cells_from_points, 8)
+    assert (zonal["B05"] == upsampled["B05_10m"]).all()
+    assert (zonal["B02"] == h3_zonal_mean([s2_band], 8)["B02"].values).all()
+
+
+def test_parallel_zonal_stats(s2_band):
+    serial = zonal_stats([s2_band], h3_cells_from_points, 9, max_pixels=2**16)
+    parallel = zonal_stats(
+        [s2_band], h3_cells_from_points, 9, max_pixels=2**16, workers=2
+    )
+    assert np.array_equal(serial.cells, parallel.cells)
+    for name in ("sums", "counts", "mins", "maxs"):
+        assert np.allclose(getattr(serial, name), getattr(parallel, name))
+
+
+def failing_cells(lon, lat, resolution):
+    raise RuntimeError("cell assignment failed")
+
+
+@pytest.mark.skipif(not os.path.isdir("/dev/shm"), reason="POSIX shared memory")
+def test_parallel_zonal_stats_failure(s2_band):
+    blocks = set(os.listdir("/dev/shm"))
+    with pytest.raises(RuntimeError, match="cell assignment failed"):
+        zonal_stats([s2_band], failing_cells, 9, max_pixels=2**14, workers=2)
+    # Shared memory blocks of the windows in flight are released
+    assert set(os.listdir("/dev/shm")) - blocks == set()
+
+
+def test_overview_reads(s2_band):
+    with rasterio.open(s2_band, "r+") as dst:
+        dst.build_overviews([2, 4], Resampling.average)
+    # Coarsest overview with pixels below 1e-4 of a res 6 H3 cell (~36 km2)
+    assert overview_level(s2_band, h3.hex_area(6, unit="m^2") * 1e-4) == 1
+    assert overview_level(s2_band, 100) is None
+    full = zonal_stats([s2_band], h3_cells_from_points, 6, overview_budget=0)
+    coarse = zonal_stats(
+        [s2_band], h3_cells_from_points, 6, cell_area=h3.hex_area(6, unit="m^2")
+    )
+    assert np.array_equal(full.cells, coarse.cells)
+    assert coarse.counts.sum() == full.counts.sum() / 16
+    assert np.allclose(coarse.means, full.means, rtol=0.01)
+
+
+def test_zonal_pyramid(s2_band):
+    levels = dict(rpix_zonal_pyramid([s2_band], [7, 8, 9]))
+    assert sorted(levels) == [7, 8, 9]
+    # rHEALPix cells nest exactly: rolled up levels match a direct aggregation
+    direct = rpix_zonal_mean([s2_band], 7)
+    assert levels[7]["cell_id"].tolist() == direct["cell_id"].tolist()
+    assert levels[7]["B02"].tolist() == direct["B02"].tolist()
+
+    stats = h3_zonal_stats([s2_band], 9)
+    parents = stats.to_parent(h3_parents(stats.cells, 7))
+    assert np.isin(parents.cells, h3_parents(stats.cells, 7)).all()
+    assert parents.counts.sum() == stats.counts.sum()
+    assert parents.sums.sum() == stats.sums.sum()
+    assert parents.maxs.max() == stats.maxs.max()
+
+
+def test_ids_only_frames(s2_band):
+    h3_ids = h3_zonal_mean([s2_band], 8, ids_only=True)
+    assert h3_ids.index.dtype == np.uint64
+    assert "geometry" not in h3_ids.columns
+    full = h3_zonal_mean([s2_band], 8)
+    lazy = h3_with_geometry(h3_ids)
+    assert list(lazy.index) == list(full.index)
+    assert lazy.geometry.geom_equals(full.geometry).all()
+
+    rpix_ids = rpix_zonal_mean([s2_band], 7, ids_only=True)
+    assert rpix_ids.index.dtype == np.int64
+    full = rpix_zonal_mean([s2_band], 7)
+    lazy = rpix_with_geometry(rpix_ids, 7)
+    assert list(lazy["cell_id"]) == list(full["cell_id"])
+    assert rpix_cells_geometry(rpix_ids.index, 7).geom_equals(full.geometry).all()
+
+
+def test_rasterval_grid_in_memory(s2_band, tmp_path):
+    grid = h3_from_raster_extent(s2_band, tmp_path, 8, df_ret=True)
+    filled = rasterval_grid(grid, s2_band, "B02", workers=2)
+    assert filled["B02"].tolist() == mask_means(s2_band, list(grid.geometry))
+    # Nothing but the final output is written
+    assert list(tmp_path.glob("*.geojson")) == []
+    grid.to_file(tmp_path / "grid.geojson", driver="GeoJSON")
+    from_file = rasterval_geojson(tmp_path / "grid.geojson", s2_band, write=False)
+    assert from_file["grid"].tolist() == filled["B02"].tolist()
+
+
+
+def test_mask_means_nodata(tmp_path):
+    # Nodata on the western half, 100 then 200 on the eastern half
+    data = np.zeros((10, 10), dtype="uint16")
+    data[:, 5:] = 100
+    data[5:, 5:] = 200
+    raster_path = tmp_path / "B02.tif"
+    transform = Affine(10, 0, 300000, 0, -10, 5000000)
+    with rasterio.open(
+        raster_path,
+        "w",
+        driver="GTiff",
+        width=10,
+        height=10,
+        count=1,
+        dtype="uint16",
+        crs="EPSG:32632",
+        transform=transform,
+        nodata=0,
+    ) as dst:
+        dst.write(data, 1)
+    shapes = [
+        box(300000, 4999900, 300100, 5000000),
+        box(300000, 4999950, 300100, 5000000),
+        box(300000, 4999900, 300050, 5000000),
+        box(400000, 4999900, 400100, 5000000),
+    ]
+    # Like zonal_stats, nodata pixels are left out of the means
+    assert mask_means(raster_path, shapes) == [150, 100, 0, 0]
+    stats = ZonalStats.from_pixels(np.zeros(100, dtype=np.uint64), data.ravel(), 0)
+    assert int(stats.means[0, 0]) == 150
+
+def test_rasterval_batches(s2_band, tmp_path, monkeypatch):
+    grid = h3_from_raster_extent(s2_band, tmp_path, 8, df_ret=True)
+    pools = []
+
+    class CountedPool(utils.ProcessPoolExecutor):
+        def __init__(self, *args, **kwargs):
+            pools.append(self)
+            super().__init__(*args, **kwargs)
+
+    monkeypatch.setattr(utils, "ProcessPoolExecutor", CountedPool)
+    batches = [grid.iloc[i : i + 40] for i in range(0, len(grid), 40)]
+    filled = list(rasterval_batches(batches, s2_band, "B02", workers=2))
+    # A single pool fills every batch
+    assert len(filled) == len(batches) > 1
+    assert len(pools) == 1
+    assert [v for batch in filled for v in batch["B02"]] == mask_means(
+        s2_band, list(grid.geometry)
+    )
+
+def test_h3_polyfill_batches(s2_band):
+    extent = raster_extent_lonlat(s2_band)
+    batches = list(h3_polyfill_batches(extent, 11, batch_size=4000))
+    assert len(batches) > 1
+    cells = np.concatenate(batches)
+    assert np.all(cells[1:] > cells[:-1])
+    reference = gpd.GeoDataFrame(geometry=[extent], crs="EPSG:4326")
+    reference = reference.h3.polyfill_resample(11)
+    assert sorted(h3_ids(reference.index)) == cells.tolist()
+
+
+def test_rpix_iter_cells():
+    nw, se = (-10, 60), (20, 30)
+    reference = WGS84_003.cells_from_region(5, nw, se, plane=False)
+    batches = list(iter_cells(5, (nw, se), batch_size=500))
+    assert len(batches) > 1
+    assert [str(c) for batch in batches for c in batch] == [
+        str(c) for row in reference for c in row
+    ]
+
+
+def test_save_grid_batches(s2_band, tmp_path):
+    batches = list(h3_grid_batches(s2_band, 10, batch_size=500))
+    assert len(batches) > 1
+    out_path = save_grid(iter(batches), tmp_path / "grid.geojson", "h3_id")
+    saved = gpd.read_file(out_path)
+    assert len(saved) == sum(len(batch) for batch in batches)
+    assert "h3_id" not in saved.columns
+
+
+def test_dask_zonal_stats(s2_band):
+    serial = zonal_stats([s2_band], h3_cells_from_points, 9, max_pixels=2**16)
+    with dask_client(workers=2) as client:
+        distributed = zonal_stats(
+            [s2_band], h3_cells_from_points, 9, max_pixels=2**16, dask_client=client
+        )
+        # Tasks receive the cell map of their windows
+        mapped = zonal_stats(
+            [s2_band],
+            h3_cells_from_points,
+            9,
+            cell_map=build_cell_map(s2_band, h3_cells_from_points, 9),
+            max_pixels=2**16,
+            dask_client=client,
+        )
+    for stats in (distributed, mapped):
+        assert np.array_equal(serial.cells, stats.cells)
+        for name in ("sums", "counts", "mins", "maxs"):
+            assert np.allclose(getattr(serial, name), getattr(stats, name))
+
+
+def test_dask_h3_from_raster(s2_band, tmp_path):
+    dask_grid = dask_h3_from_raster(s2_band, tmp_path, 8, df_ret=True)
+    grid = h3_from_raster_extent(s2_band, tmp_path, 8, df_ret=True).to_crs(4326)
+    assert sorted(dask_grid.h3id) == sorted(grid.index)
+    expected = grid.geometry.loc[dask_grid.h3id]
+    assert dask_grid.geometry.geom_equals_exact(expected, 1e-9, align=False).all()
+
+
+def test_centroid_sampling(s2_band, tmp_path):
+    with rasterio.open(s2_band) as src:
+        data = src.read(1)
+        inverse = ~src.transform
+    to_utm = Transformer.from_crs("EPSG:4326", "EPSG:32632", always_xy=True)
+
+    # H3 12 cells (307 m2) are smaller than 4 pixels of 100 m2
+    stats = h3_zonal_stats([s2_band], 12)
+    assert np.all(stats.counts == 1)
+    lat, lon = np.array([h3_int.h3_to_geo(int(c)) for c in stats.cells]).T
+    cols, rows = inverse * to_utm.transform(lon, lat)
+    assert np.array_equal(
+        stats.sums[0], data[rows.astype(int), cols.astype(int)].astype(float)
+    )
+    aggregated = h3_zonal_stats([s2_band], 12, centroid_ratio=0)
+    assert aggregated.counts.max() > 1
+    # Cell labels do not change the sampling
+    labelled = h3_zonal_stats([s2_band], 12, labels_dir=tmp_path)
+    assert np.array_equal(labelled.cells, stats.cells)
+    assert np.array_equal(labelled.sums, stats.sums)
+    assert not list(tmp_path.rglob("*.npy"))
+    labelled = h3_zonal_stats([s2_band], 12, labels_dir=tmp_path, centroid_ratio=0)
+    assert np.array_equal(labelled.counts, aggregated.counts)
+
+    grid = next(h3_grid_batches(s2_band, 12, batch_size=2000))
+    filled = rasterval_grid(grid, s2_band, "B02")
+    cols, rows = inverse * (grid.centroid.x.values, grid.centroid.y.values)
+    inside = (rows >= 0) & (rows < 600) & (cols >= 0) & (cols < 600)
+    expected = np.zeros(len(grid), dtype=int)
+    expected[inside] = data[rows[inside].astype(int), cols[inside].astype(int)]
+    assert filled["B02"].tolist() == expected.tolist()
+    masked = rasterval_grid(grid, s2_band, "B02", centroid_ratio=0)
+    assert masked["B02"].tolist() == mask_means(s2_band, list(grid.geometry))
+
+
+
+def test_rpix_centroid_sampling(tmp_path):
+    # The southern edge of these 1 km pixels ends on a parallel of rHEALPix 8
+    # nuclei, walked twice by the rows of cells
+    profile = dict(
+        driver="GTiff",
+        width=10,
+        height=10,
+        count=1,
+        dtype="uint16",
+        crs="EPSG:3857",
+        transform=Affine(1000, 0, -6000, 0, -1000, 5636750),
+        nodata=0,
+    )
+    band = tmp_path / "B02.tif"
+    with rasterio.open(band, "w", **profile) as dst:
+        dst.write(np.arange(1, 101, dtype="uint16").reshape(1, 10, 10))
+
+    # rHEALPix 8 cells (2 km2) are smaller than 4 pixels of 1 km2
+    stats = rpix_zonal_stats([band], 8)
+    assert len(stats.cells) == len(np.unique(stats.cells))
+    assert len(stats.cells) > 0
+    assert np.all(stats.counts == 1)